@@ -0,0 +1,137 @@
+# benchmarks/bench_endpoint_pool.py
+"""
+Endpoint-poolin reititys paikallisia stand-in-palvelimia vasten.
+
+Käynnistää kolme OpenAI-yhteensopivaa /v1/chat/completions -palvelinta
+(uvicorn, samassa prosessissa) ja ajaa niitä vasten kutsuja
+lib.openai_client.chat_completion:n kautta:
+
+  fast   = 50 ms vasteaika
+  slow   = 400 ms vasteaika
+  flaky  = 80 ms, palauttaa 503 jakson ajan (--outage sekuntia ensimmäisestä kutsusta)
+
+Tulostaa kutsujen jakauman, latenssit sekä poistot kierrosta / paluut.
+Odotus: suurin osa kutsuista fastille, flaky poistetaan katkon aikana ja
+palaa kiertoon koekutsun jälkeen.
+
+Ajo backend-juuresta:
+    python -m benchmarks.bench_endpoint_pool [--calls 200] [--concurrency 8]
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import socket
+import asyncio
+import argparse
+import statistics
+from collections import Counter
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+STAND_INS = {"fast": 0.05, "slow": 0.4, "flaky": 0.08}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _stand_in(name: str, latency_s: float, outage: dict, served: Counter) -> Starlette:
+    async def completions(request: Request):
+        body = await request.json()
+        if name == "flaky" and outage["until"] is None:
+            outage["until"] = time.monotonic() + outage["seconds"]  # katko alkaa ensimmäisestä kutsusta
+        await asyncio.sleep(latency_s)
+        if name == "flaky" and time.monotonic() < outage["until"]:
+            return JSONResponse({"error": {"message": "upstream unavailable"}}, status_code=503)
+        served[name] += 1
+        return JSONResponse(
+            {
+                "id": f"{name}-{served[name]}", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "stand-in"),
+                "usage": {"prompt_tokens": 900, "completion_tokens": 100, "total_tokens": 1000},
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": json.dumps({"endpoint": name})}}],
+            },
+            headers={
+                "x-ratelimit-limit-requests": "10000", "x-ratelimit-remaining-requests": "9999",
+                "x-ratelimit-limit-tokens": "10000000", "x-ratelimit-remaining-tokens": "9999000",
+                "x-ratelimit-reset-requests": "6ms", "x-ratelimit-reset-tokens": "6ms",
+            },
+        )
+
+    return Starlette(routes=[Route("/v1/chat/completions", completions, methods=["POST"])])
+
+
+async def _run(args) -> None:
+    served: Counter = Counter()
+    outage = {"seconds": args.outage, "until": None}
+    servers, endpoints = [], []
+    for name, latency in STAND_INS.items():
+        port = _free_port()
+        config = uvicorn.Config(_stand_in(name, latency, outage, served), port=port, log_level="error")
+        servers.append(uvicorn.Server(config))
+        endpoints.append({"name": name, "base_url": f"http://127.0.0.1:{port}/v1", "api_key": "stand-in"})
+
+    os.environ["OPENAI_ENDPOINTS"] = json.dumps(endpoints)
+    os.environ.setdefault("OPENAI_MAX_CONCURRENCY", str(args.concurrency))
+    os.environ.setdefault("OPENAI_EJECT_S", "0.5")
+    os.environ.setdefault("OPENAI_BACKOFF_BASE_S", "0.05")
+    # Oletuspooli luetaan OPENAI_ENDPOINTSista ensimmäisellä kutsulla
+    from lib.openai_client import aclose_clients, chat_completion
+    from lib.openai_scheduler import scheduler
+
+    tasks = [asyncio.create_task(s.serve()) for s in servers]
+    while not all(s.started for s in servers):
+        await asyncio.sleep(0.01)
+
+    answered: Counter = Counter()
+    latencies = []
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def one(i: int) -> None:
+        async with gate:
+            start = time.perf_counter()
+            completion = await chat_completion(
+                tenant=f"org-{i % 3}", estimated_tokens=1000, model="stand-in",
+                messages=[{"role": "user", "content": f"call {i}"}],
+            )
+            latencies.append(time.perf_counter() - start)
+            answered[json.loads(completion.choices[0].message.content)["endpoint"]] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.calls)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"{args.calls} calls in {elapsed:.2f}s (concurrency {args.concurrency}, flaky outage {args.outage:.1f}s)")
+    print(f"latency p50 {statistics.median(latencies) * 1000:.0f} ms, p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f} ms")
+    print(f"{'endpoint':<8}{'answered':>10}{'ewma ms':>9}{'errors':>8}{'ejections':>11}")
+    for snap in scheduler.metrics()["endpoints"]:
+        ewma = f"{snap['latency_s'] * 1000:.0f}" if snap["latency_s"] is not None else "-"
+        print(f"{snap['name']:<8}{answered[snap['name']]:>10}{ewma:>9}{snap['errors']:>8}{snap['ejections']:>11}")
+
+    await aclose_clients()
+    for s in servers:
+        s.should_exit = True
+    await asyncio.gather(*tasks)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--outage", type=float, default=1.0, help="flaky palauttaa 503 näin monta sekuntia ensimmäisestä kutsusta")
+    args = parser.parse_args()
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
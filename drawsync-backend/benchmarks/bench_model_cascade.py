@@ -0,0 +1,102 @@
+# benchmarks/bench_model_cascade.py
+"""
+Mallikaskadin vaikutus latenssiin simuloiduilla malleilla.
+
+Korvaa lib.gpt_utils.chat_completion:n stand-inillä, jolla on tasokohtainen
+vasteaika (skaalattu, oletus fast 0.3 s / large 1.5 s). Osa piirustuksista on
+"vaikeita" (--hard): nopea malli palauttaa niille vajaan vastauksen
+(puuttuva tuotekoodi ja mitat), jolloin kaskadi eskaloi isolle mallille.
+
+Ajaa saman coating-piirustussarjan kahdesti:
+  single  = OPENAI_CASCADE=0 (kaikki OPENAI_MODEL:lle, kuten ennen)
+  cascade = OPENAI_CASCADE=1 (industry_configs.json:n model_cascade)
+
+Tulostaa p50/p95-latenssit sekä vastanneiden tasojen jakauman.
+
+Ajo backend-juuresta:
+    python -m benchmarks.bench_model_cascade [--drawings 200] [--hard 0.2]
+"""
+from __future__ import annotations
+
+import os
+import json
+import random
+import asyncio
+import logging
+import argparse
+import statistics
+from collections import Counter
+
+import lib.gpt_utils as gpt_utils
+from lib.analysis_pipeline import _run_cascade
+
+COMPLETE = {
+    "perustiedot": {"tuotekoodi": "A-100", "materiaali": "S235"},
+    "mitat": {"ulkomitat_mm": {"pituus": 400, "leveys": 200, "korkeus": 5}},
+    "pinta_ala_analyysi": {"pinta_ala_cm2": 1600.0, "varmuus": "korkea"},
+    "huomiot": [],
+}
+INCOMPLETE = {"perustiedot": {"tuotekoodi": None}, "pinta_ala_analyysi": {"varmuus": "matala"}, "huomiot": []}
+
+
+class _Completion:
+    def __init__(self, content: str):
+        self.choices = [type("Choice", (), {"message": type("Message", (), {"content": content})()})()]
+
+
+def _stand_in(latency: dict, hard: set):
+    async def chat_completion(**kwargs):
+        model = kwargs["model"]
+        fast = model != gpt_utils.OPENAI_MODEL
+        await asyncio.sleep(latency["fast" if fast else "large"] * random.uniform(0.8, 1.2))
+        drawing = kwargs["messages"][0]["content"]  # system-prompt = piirustuksen tunniste
+        body = INCOMPLETE if fast and drawing in hard else COMPLETE
+        return _Completion(json.dumps(body))
+    return chat_completion
+
+
+async def _run(args, cascade: bool) -> tuple:
+    os.environ["OPENAI_CASCADE"] = "1" if cascade else "0"
+    rng = random.Random(7)
+    drawings = [f"drawing-{i}" for i in range(args.drawings)]
+    hard = {d for d in drawings if rng.random() < args.hard}
+    gpt_utils.chat_completion = _stand_in({"fast": args.fast_s, "large": args.large_s}, hard)
+
+    latencies, tiers = [], Counter()
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def one(drawing: str) -> None:
+        async with gate:
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            page = {"page": 1, "vision_image": b"\x89PNG\r\n\x1a\n"}
+            result = await _run_cascade(page, drawing, "coating", "high", "bench", None)
+            latencies.append(loop.time() - start)
+            tiers[result["processing_info"]["model_tier"]] += 1
+
+    await asyncio.gather(*(one(d) for d in drawings))
+    latencies.sort()
+    return latencies, tiers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--drawings", type=int, default=200)
+    parser.add_argument("--hard", type=float, default=0.2, help="osuus piirustuksista, joihin nopea malli ei riitä")
+    parser.add_argument("--fast-s", type=float, default=0.3)
+    parser.add_argument("--large-s", type=float, default=1.5)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    # Eskalointien "missing required fields" -varoitukset eivät kuulu tulosteeseen
+    logging.getLogger("lib.industry_manager").setLevel(logging.ERROR)
+
+    print(f"{args.drawings} coating drawings, {args.hard:.0%} hard, fast {args.fast_s}s / large {args.large_s}s")
+    print(f"{'mode':<9}{'p50 s':>8}{'p95 s':>8}  tiers")
+    for mode in ("single", "cascade"):
+        latencies, tiers = asyncio.run(_run(args, mode == "cascade"))
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        print(f"{mode:<9}{statistics.median(latencies):>8.2f}{p95:>8.2f}  {dict(tiers)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# benchmarks/bench_ocr_batching.py
+"""
+Vision-OCR:n mikroerien vaikutus simuloidulla Vision-clientilla.
+
+Korvaa ImageAnnotatorAsyncClientin stand-inillä, jonka kutsu maksaa kiinteän
+kiertoajan (--call-ms, oletus 250 ms) + kuvakohtaisen ajan (--image-ms, 40 ms)
+ja jonka samanaikaisia kutsuja rajoittaa --api-concurrency (kiintiö).
+Ajaa --images kuvaa --concurrency rinnakkaisena pyyntönä kahdesti:
+  single  = VISION_BATCH_WINDOW_MS=0 (yksi kuva per kutsu kuten ennen)
+  batched = oletusikkuna (VISION_BATCH_WINDOW_MS, 20 ms)
+
+Tulostaa API-kutsujen määrän, kokonaisajan ja kuvakohtaisen p50/p95-latenssin.
+
+Ajo backend-juuresta:
+    python -m benchmarks.bench_ocr_batching [--images 400] [--concurrency 64]
+"""
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+import argparse
+import statistics
+
+import lib.ocr_utils as ocr_utils
+
+
+def _stand_in(args, counter: dict):
+    gate = asyncio.Semaphore(args.api_concurrency)
+
+    class _Response:
+        full_text_annotation = type("Full", (), {"text": "HEA200 S355 L=1200", "pages": []})()
+        error = type("Status", (), {"message": ""})()
+
+    class AsyncClient:
+        async def batch_annotate_images(self, requests):
+            async with gate:
+                counter["calls"] += 1
+                await asyncio.sleep((args.call_ms + args.image_ms * len(requests)) / 1000)
+            return type("Batch", (), {"responses": [_Response() for _ in requests]})()
+
+    return AsyncClient
+
+
+async def _run(args, window_ms: str) -> tuple:
+    os.environ["VISION_BATCH_WINDOW_MS"] = window_ms
+    counter = {"calls": 0}
+    ocr_utils.vision.ImageAnnotatorAsyncClient = _stand_in(args, counter)
+    latencies = []
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def one(i: int) -> None:
+        async with gate:
+            start = time.perf_counter()
+            await ocr_utils.extract_text_from_image_bytes_async(b"\x89PNG\r\n\x1a\n" + bytes(2048), verify=False)
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.images)))
+    elapsed = time.perf_counter() - started
+    await ocr_utils.aclose_vision_clients()
+    latencies.sort()
+    return counter["calls"], elapsed, latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=64, help="samanaikaiset OCR-pyynnöt")
+    parser.add_argument("--api-concurrency", type=int, default=8, help="samanaikaiset Vision-kutsut (kiintiö)")
+    parser.add_argument("--call-ms", type=float, default=250.0)
+    parser.add_argument("--image-ms", type=float, default=40.0)
+    args = parser.parse_args()
+    # Payload-debugprintit eivät kuulu tulosteeseen
+    ocr_utils._log_payload = lambda image_bytes: None
+
+    print(f"{args.images} images, {args.concurrency} concurrent, call {args.call_ms:.0f} ms + {args.image_ms:.0f} ms/image")
+    print(f"{'mode':<9}{'calls':>7}{'total s':>9}{'p50 s':>8}{'p95 s':>8}")
+    for mode, window_ms in (("single", "0"), ("batched", os.getenv("VISION_BATCH_WINDOW_MS", "20"))):
+        calls, elapsed, latencies = asyncio.run(_run(args, window_ms))
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        print(f"{mode:<9}{calls:>7}{elapsed:>9.2f}{statistics.median(latencies):>8.2f}{p95:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# benchmarks/bench_pdf_render.py
+"""
+PDF-sivun rasterointi + enkoodaus: CPU-aika per sivu.
+
+  legacy      = get_pixmap -> pix.tobytes("png") -> normalize_for_vision (PNG-dekoodaus + uusi enkoodaus)
+  single-pass = get_pixmap -> PIL-kuva samasta puskurista -> encode_for_vision (yksi enkoodaus)
+  band        = clip-kaistat -> PNG-virta (muistikatto PDF_RENDER_MEM_CEILING_MB)
+
+Ajo backend-juuresta:
+    python -m benchmarks.bench_pdf_render [--dpi 220] [--repeat 3]
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+
+import fitz  # PyMuPDF
+
+from lib.ocr_image_prep import normalize_for_vision
+from lib.pdf_render import render_page_image
+
+# Arkkikoot pisteinä (1 pt = 1/72 in)
+SHEETS = {
+    "A4": (595, 842),
+    "A3": (842, 1191),
+    "A1": (1684, 2384),
+}
+
+
+def _synthetic_drawing(width: float, height: float) -> bytes:
+    """Viivapiirustus: kehys, ruudukko, mittaviivoja ja tekstiä kuten CAD-exportissa."""
+    doc = fitz.open()
+    page = doc.new_page(width=width, height=height)
+    page.draw_rect(fitz.Rect(20, 20, width - 20, height - 20), width=1.5)
+    step = 40
+    for x in range(40, int(width) - 40, step):
+        page.draw_line((x, 40), (x + step / 2, height - 40), width=0.4)
+    for y in range(40, int(height) - 40, step):
+        page.draw_line((40, y), (width - 40, y + step / 3), width=0.4)
+        page.insert_text((50, y + 12), f"IPE{200 + y % 100} L={1000 + y * 3} 2 KPL", fontsize=7)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def _legacy(page, dpi: int) -> bytes:
+    zoom = dpi / 72.0
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return normalize_for_vision(pix.tobytes("png"))
+
+
+def _band(page, dpi: int) -> bytes:
+    return render_page_image(page, dpi, mode="band")
+
+
+def _cpu_seconds(fn, page, dpi: int, repeat: int) -> tuple[float, int]:
+    samples = []
+    size = 0
+    for _ in range(repeat):
+        start = time.process_time()
+        size = len(fn(page, dpi))
+        samples.append(time.process_time() - start)
+    return statistics.median(samples), size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dpi", type=int, default=220)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"dpi={args.dpi}, median of {args.repeat} runs, CPU seconds per page")
+    print(f"{'sheet':<6}{'legacy s':>10}{'single s':>10}{'band s':>9}{'speedup':>9}{'legacy KB':>11}{'single KB':>11}")
+    for name, (w, h) in SHEETS.items():
+        doc = fitz.open(stream=_synthetic_drawing(w, h), filetype="pdf")
+        page = doc.load_page(0)
+        legacy_s, legacy_size = _cpu_seconds(_legacy, page, args.dpi, args.repeat)
+        single_s, single_size = _cpu_seconds(render_page_image, page, args.dpi, args.repeat)
+        band_s, _ = _cpu_seconds(_band, page, args.dpi, args.repeat)
+        doc.close()
+        print(
+            f"{name:<6}{legacy_s:>10.3f}{single_s:>10.3f}{band_s:>9.3f}{legacy_s / single_s:>8.2f}x"
+            f"{legacy_size / 1024:>11.0f}{single_size / 1024:>11.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
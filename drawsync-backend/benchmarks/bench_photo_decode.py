@@ -0,0 +1,152 @@
+# benchmarks/bench_photo_decode.py
+"""
+Kameran JPEG-kuvien dekoodaus + skaalaus: aika ja muistihuippu.
+
+  legacy = PIL-tarkistus + täysi dekoodaus (kahdesti, kuten vanha polku) -> LANCZOS
+  draft  = decode_image (JPEG draft = DCT-skaalattu dekoodaus, EXIF kerran) -> LANCZOS
+
+Kohdekoot:
+  ocr    = PHOTO_OCR_MAX_LONG_SIDE (steel: OCR-kuva)
+  vision = mallin kuvan koko (vision_image_limits("high"))
+
+Jokainen tapaus (ja testikuvan generointi) ajetaan omassa aliprosessissaan:
+Linux periyttää ru_maxrss:n fork/execissä, joten pääprosessin on pysyttävä
+pienenä, jotta luku on tapauskohtainen muistihuippu.
+
+Ajo backend-juuresta:
+    python -m benchmarks.bench_photo_decode [--repeat 3] [--sizes 12 24 48]
+"""
+from __future__ import annotations
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import resource
+import statistics
+import subprocess
+import tempfile
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from lib.ocr_image_prep import decode_image, fit_scale, photo_ocr_long_side
+
+VISION_LIMITS = (2048, 768)  # = vision_image_limits("high"), ilman OpenAI-clientin importtia
+ASPECT = (4, 3)
+
+
+def _synthetic_photo(megapixels: int, path: str) -> None:
+    """Puhelinkuva piirustuksesta: epätasainen valaistus, kohina, viivoja ja tekstiä."""
+    w = int(math.sqrt(megapixels * 1_000_000 * ASPECT[0] / ASPECT[1]))
+    h = int(w * ASPECT[1] / ASPECT[0])
+    rng = np.random.default_rng(megapixels)
+    yy, xx = np.mgrid[0:h:8, 0:w:8]
+    light = 205 + 30 * np.sin(xx / w * 3.0) * np.cos(yy / h * 2.0)
+    base = Image.fromarray(np.clip(light, 0, 255).astype(np.uint8)).resize((w, h), Image.BILINEAR)
+    img = Image.merge("RGB", (base, base, base.point(lambda v: max(v - 12, 0))))
+    draw = ImageDraw.Draw(img)
+    step = max(w // 40, 20)
+    for x in range(step, w - step, step):
+        draw.line((x, step, x + step // 2, h - step), fill=(40, 40, 45), width=3)
+    for y in range(step, h - step, step):
+        draw.text((step, y), f"IPE{200 + y % 100} L={1000 + y} 2 KPL", fill=(20, 20, 25))
+    arr = np.asarray(img, dtype=np.int16)
+    arr[::4, ::4] += rng.normal(0, 4, arr[::4, ::4].shape).astype(np.int16)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: 90° (puhelimen pystykuva)
+    Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8)).save(path, "JPEG", quality=90, exif=exif)
+
+
+def _target(size: tuple, kind: str) -> int:
+    if kind == "ocr":
+        return photo_ocr_long_side()
+    return math.ceil(max(size) * fit_scale(size[0], size[1], *VISION_LIMITS))
+
+
+def _resize(img: Image.Image, target: int) -> Image.Image:
+    scale = target / float(max(img.size))
+    if scale >= 1.0:
+        return img
+    return img.resize((max(int(img.size[0] * scale), 1), max(int(img.size[1] * scale), 1)), Image.LANCZOS)
+
+
+def _legacy(data: bytes, target: int) -> Image.Image:
+    # = ocr_utils._pil_verify (ei importata: Vision-client nostaisi muistin lähtötasoa)
+    Image.open(io.BytesIO(data)).verify()
+    Image.open(io.BytesIO(data)).load()
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    return _resize(img, target)
+
+
+def _draft(data: bytes, target: int) -> Image.Image:
+    return _resize(decode_image(data, target), target)
+
+
+def _worker(path: str, variant: str, kind: str, repeat: int) -> None:
+    with open(path, "rb") as f:
+        data = f.read()
+    fn = _legacy if variant == "legacy" else _draft
+    target = _target(Image.open(io.BytesIO(data)).size, kind)
+    base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn(data, target)
+        samples.append(time.perf_counter() - start)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "seconds": statistics.median(samples),
+        "peak_mb": peak_kb / 1024.0,
+        "delta_mb": (peak_kb - base_kb) / 1024.0,
+        "size": list(out.size),
+    }))
+
+
+def _run(*args: str) -> str:
+    cmd = [sys.executable, "-m", "benchmarks.bench_photo_decode", *args]
+    return subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+
+
+def _run_case(path: str, variant: str, kind: str, repeat: int) -> dict:
+    out = _run("--worker", path, variant, kind, "--repeat", str(repeat))
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[12, 24, 48], help="megapikselit")
+    parser.add_argument("--worker", nargs=3, metavar=("PATH", "VARIANT", "KIND"), help=argparse.SUPPRESS)
+    parser.add_argument("--make", nargs=2, metavar=("MP", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _worker(*args.worker, args.repeat)
+        return
+    if args.make:
+        _synthetic_photo(int(args.make[0]), args.make[1])
+        return
+
+    print(f"median of {args.repeat} runs; peak = ru_maxrss of a fresh process, delta = growth over import baseline")
+    print(f"{'photo':<7}{'target':<8}{'out':>11}{'legacy s':>10}{'draft s':>9}{'speedup':>9}{'legacy MB':>11}{'draft MB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mp in args.sizes:
+            path = os.path.join(tmp, f"photo_{mp}mp.jpg")
+            _run("--make", str(mp), path)
+            for kind in ("ocr", "vision"):
+                legacy = _run_case(path, "legacy", kind, args.repeat)
+                draft = _run_case(path, "draft", kind, args.repeat)
+                out = "x".join(str(v) for v in draft["size"])
+                print(
+                    f"{mp:>3} MP  {kind:<8}{out:>11}{legacy['seconds']:>10.3f}{draft['seconds']:>9.3f}"
+                    f"{legacy['seconds'] / draft['seconds']:>8.2f}x{legacy['delta_mb']:>11.0f}{draft['delta_mb']:>10.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
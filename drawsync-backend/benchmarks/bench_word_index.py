@@ -0,0 +1,92 @@
+# benchmarks/bench_word_index.py
+"""
+OCR-sanataulukon ja GridIndexin nopeus tiheällä arkilla.
+
+Tuottaa synteettisen piirustusarkin (--words sanaa, oletus 5000): materiaali-
+listarivejä (profiili + pituus samalla rivillä) ja satunnaista tekstiä
+ympärillä. Mittaa:
+  table    WordTable.from_words + rivit
+  index    GridIndexin rakennus
+  query    --queries lähihakua: GridIndex vs. kaikkien sanojen läpikäynti
+  steel    analyze_steel_words + link_measurements_spatial koko arkille
+
+Ajo backend-juuresta:
+    python -m benchmarks.bench_word_index [--words 5000] [--queries 2000]
+"""
+from __future__ import annotations
+
+import time
+import random
+import argparse
+
+import numpy as np
+
+from lib.ocr_words import WordTable, GridIndex, CELL_LINE_HEIGHTS, gap_distance
+from lib.steel_ocr_integration import analyze_steel_words, link_measurements_spatial
+
+PROFILES = ["HEA200", "IPE240", "SHS100x8", "UPE160", "HEB300", "RHS120x80x6"]
+FILLER = ["M16", "S355", "Ø18", "A-A", "DETAIL", "+12.500", "t=10", "HITSAUS", "a5", "REV"]
+
+
+def _sheet(n_words: int, rng: random.Random) -> list:
+    """[(teksti, x0, y0, x1, y1, luottamus)]: joka neljäs rivi materiaalilistaa."""
+    h, words, y = 18.0, [], 40.0
+    while len(words) < n_words:
+        if len(words) % 4 == 0:
+            profile = rng.choice(PROFILES)
+            words.append((profile, 100, y, 100 + 11 * len(profile), y + h, 0.95))
+            length = str(rng.randrange(1000, 12000))
+            words.append((length, 420, y + 1, 460, y + h + 1, 0.93))
+        for _ in range(rng.randrange(4, 9)):
+            text = rng.choice(FILLER)
+            x = rng.uniform(600, 8000)
+            words.append((text, x, y + rng.uniform(-2, 2), x + 11 * len(text), y + h, rng.uniform(0.5, 1.0)))
+        y += h * 1.6
+    return words[:n_words]
+
+
+def _ms(fn, repeat: int = 5):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+    rng = random.Random(7)
+    words = _sheet(args.words, rng)
+
+    def build() -> WordTable:
+        table = WordTable.from_words(words)
+        table.rows()
+        return table
+
+    table_ms, table = _ms(build)
+    h = table.line_height()
+    index_ms, index = _ms(lambda: GridIndex(table.boxes, CELL_LINE_HEIGHTS * h))
+    queries = [table.boxes[rng.randrange(len(table))] for _ in range(args.queries)]
+    radius = 4 * h
+    grid_ms, _ = _ms(lambda: [index.query(q, radius) for q in queries], repeat=3)
+    brute_ms, _ = _ms(lambda: [np.flatnonzero(gap_distance(table.boxes, q) <= radius) for q in queries], repeat=3)
+
+    def steel():
+        fresh = WordTable.from_words(words)
+        return link_measurements_spatial(analyze_steel_words(fresh), fresh)
+
+    steel_ms, linked = _ms(steel, repeat=3)
+
+    print(f"{len(table)} words, {len(table.rows())} rows, line height {h:.0f}")
+    print(f"table+rows   {table_ms:8.1f} ms")
+    print(f"grid build   {index_ms:8.1f} ms")
+    print(f"{args.queries} queries: grid {grid_ms:.1f} ms, brute force {brute_ms:.1f} ms ({brute_ms / grid_ms:.1f}x)")
+    print(f"steel link   {steel_ms:8.1f} ms ({len(linked)} profiles)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,480 @@
+# drawsync-backend/lib/analysis_pipeline.py
+"""
+Piirustuksen analyysiputki: upload -> sivukuvat -> (OCR) -> GPT Vision -> yhdistetty tulos.
+
+Yhteinen /process- ja /process/stream-endpointeille. Striimaava kutsuja antaa
+emit-callbackin, joka saa vaiheiden edistymisen ja mallin keskeneräisen
+vastauksen jäsennettynä (lib/partial_json.py).
+"""
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+import logging
+import contextlib
+from typing import Callable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from lib.auth_middleware import AuthenticatedUser
+
+# PDF -> PNG
+try:
+    import fitz  # PyMuPDF
+except Exception as e:
+    fitz = None
+
+from lib.ocr_image_prep import prepare_image_variants, line_art_mode
+from lib.ink_crop import crop_mode
+from lib.ocr_utils import extract_text_detailed_async, ocr_backend_for
+from lib.gpt_utils import (
+    extract_structured_data_with_vision_async,
+    extract_structured_data_with_vision_stream_async,
+    vision_image_limits,
+    normalize_detail,
+    validate_and_enhance_result,
+    OPENAI_MODEL,
+)
+from lib.result_cache import result_cache, make_cache_key
+from lib.upload_spool import SpooledUpload
+from lib.concurrency import run_cpu
+from lib.pdf_render import render_pdf, PdfRenderError
+from lib.page_merge import merge_page_results
+from lib.memstats import RssSampler
+from lib.steel_ocr_integration import create_steel_prompt_with_ocr
+from lib.industry_config import get_vision_config, get_prompt, get_industries_ui_config
+from lib.model_cascade import cascade_for, cascade_signature, assess_result
+from lib.speculative import speculative_policy, reconcile
+
+log = logging.getLogger("process")
+
+# emit(event, data) – striimaavan kutsujan tapahtumakanava (None = ei striimausta)
+Emit = Optional[Callable[[str, dict], None]]
+
+
+def _emit(emit: Emit, event: str, **data) -> None:
+    if emit is not None:
+        emit(event, data)
+
+
+class StageLimits:
+    """
+    Vaihekohtaiset rinnakkaisuusrajat (erä-ajo, lib/batch_pipeline.py):
+    rasterize = tiedoston sivukuvat, ocr = Vision-OCR-kutsut, vision = GPT-kutsut.
+    None/0 = ei rajaa. Yksittäinen /process ei rajaa vaiheita.
+    """
+
+    def __init__(self, rasterize: Optional[int] = None, ocr: Optional[int] = None, vision: Optional[int] = None):
+        self._sems = {
+            name: asyncio.Semaphore(n)
+            for name, n in (("rasterize", rasterize), ("ocr", ocr), ("vision", vision))
+            if n
+        }
+
+    def stage(self, name: str):
+        sem = self._sems.get(name)
+        return sem if sem is not None else contextlib.nullcontext()
+
+
+def _stage(limits: Optional[StageLimits], name: str):
+    return limits.stage(name) if limits is not None else contextlib.nullcontext()
+
+# ---------------------------
+# Apuja
+# ---------------------------
+
+def _ensure_pdf_support():
+    if fitz is None:
+        raise HTTPException(status_code=500, detail="PDF support (PyMuPDF) not available")
+
+def _is_pdf(upload) -> bool:
+    ct = (upload.content_type or "").lower()
+    fname = (upload.filename or "").lower()
+    return "pdf" in ct or fname.endswith(".pdf")
+
+def vision_settings(itype: str) -> dict:
+    """
+    Kuvan valmistelun asetukset industry-configin "vision"-lohkosta:
+      detail:   GPT:n detail-taso
+      limits:   GPT-kuvan koko; VISION_VARIANTS=0 -> None (täysi resoluutio)
+      line_art: "auto" tallentaa viivapiirustukset 1-bit/paletti-PNG:nä (oletus VISION_LINE_ART)
+      crop:     tyhjien marginaalien rajaus (oletus VISION_CROP)
+    """
+    try:
+        vision_cfg = get_vision_config(itype)
+    except Exception:
+        vision_cfg = {}
+    detail = normalize_detail(vision_cfg.get("detail"))
+    limits = None if os.getenv("VISION_VARIANTS", "1").strip() == "0" else vision_image_limits(detail)
+    return {
+        "detail": detail,
+        "limits": limits,
+        "line_art": line_art_mode(vision_cfg.get("line_art")),
+        "crop": crop_mode(vision_cfg.get("crop")),
+    }
+
+async def _prepare_pages(upload: SpooledUpload, itype: str, settings: dict) -> List[dict]:
+    """
+    PDF -> kaikki sivut (enint. PDF_MAX_PAGES) rinnakkain, kuva -> yksi "sivu".
+
+    Jokaiselle sivulle tehdään kuluttajakohtaiset kuvat: täysi resoluutio
+    OCR:lle (vain steel) ja mallin kokoinen kuva GPT:lle. Steelille luetaan
+    PDF:stä ensin tekstikerros (OCR:n pikapolku). Tiedosto avataan levyltä
+    polulla, ei muistiin luettuna kopiona.
+    """
+    need_ocr = itype == "steel"
+    if _is_pdf(upload):
+        _ensure_pdf_support()
+        try:
+            return await render_pdf(
+                upload.path,
+                need_ocr=need_ocr,
+                vision_limits=settings["limits"],
+                line_art=settings["line_art"],
+                crop=settings["crop"],
+            )
+        except PdfRenderError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    variants = await run_cpu(
+        prepare_image_variants, upload.path, need_ocr, settings["limits"], settings["line_art"], settings["crop"]
+    )
+    return [{"page": 1, **variants}]
+
+async def _ocr_prompt(page: dict, base_prompt: str, limits: Optional[StageLimits],
+                      ocr_backend: str = "vision") -> Tuple[str, Optional[str]]:
+    """
+    Steel: (OCR-rikastettu prompt, lähde). Lähde on "pdf_text_layer" tai OCR-moottori
+    ("vision" | "tesseract"). OCR:n virhe -> (peruspromptti, None).
+    """
+    try:
+        # CAD-PDF:n tekstikerros riittää -> ei Vision-kutsua lainkaan
+        ocr = page.get("text_layer")
+        if ocr:
+            source = "pdf_text_layer"
+        else:
+            # ocr_image on juuri enkoodattu itse -> ei erillistä PIL-tarkistusta
+            async with _stage(limits, "ocr"):
+                ocr = await extract_text_detailed_async(page["ocr_image"], ocr_backend, verify=False)
+            source = ocr["engine"]
+        return create_steel_prompt_with_ocr(base_prompt, ocr), source
+    except Exception as e:
+        # Ei kaadeta jos OCR epäonnistuu – jatka ilman rikastusta
+        log.warning(f"OCR enrich failed (page {page['page']}): {e}")
+        return base_prompt, None
+
+async def _analyze_page(
+    page: dict,
+    base_prompt: str,
+    itype: str,
+    detail: str,
+    tenant: Optional[str] = None,
+    emit: Emit = None,
+    limits: Optional[StageLimits] = None,
+    ocr_backend: str = "vision",
+) -> dict:
+    """
+    Yhden sivun OCR-rikastus (steel) + GPT Vision. emit annettuna GPT:n
+    vastaus striimataan ja keskeneräiset tulokset lähetetään partial-tapahtumina.
+    Steel + latenssitila (lib/speculative.py): OCR ja GPT rinnakkain.
+    """
+    n = page["page"]
+    policy = "off"
+    if itype == "steel" and not page.get("text_layer"):
+        policy = speculative_policy(itype, tenant)
+
+    if policy != "off":
+        async with _stage(limits, "vision"):
+            result, ocr_source = await _speculative_steel(page, base_prompt, itype, detail, tenant, emit, limits, policy, ocr_backend)
+    else:
+        final_prompt, ocr_source = base_prompt, None
+        # --- Steel: OCR-rikastus -> parempi prompt ---
+        if itype == "steel":
+            final_prompt, ocr_source = await _ocr_prompt(page, base_prompt, limits, ocr_backend)
+        _emit(emit, "stage", stage="ocr_done", page=n, source=ocr_source or ("failed" if itype == "steel" else "skipped"))
+        _emit(emit, "stage", stage="prompt_built", page=n, prompt_chars=len(final_prompt))
+
+        async with _stage(limits, "vision"):
+            result = await _run_cascade(page, final_prompt, itype, detail, tenant, emit)
+    if not isinstance(result, dict):
+        result = {"success": True, "result": result}
+    info = result.setdefault("processing_info", {})
+    if page.get("render"):
+        info["render"] = page["render"]
+    if ocr_source:
+        info["ocr_source"] = ocr_source
+    return result
+
+def _task_result(task: asyncio.Task) -> Optional[dict]:
+    if task.exception() is not None:
+        log.error(f"Speculative vision call failed: {task.exception()}")
+        return None
+    return task.result()
+
+async def _speculative_steel(
+    page: dict,
+    base_prompt: str,
+    itype: str,
+    detail: str,
+    tenant: Optional[str],
+    emit: Emit,
+    limits: Optional[StageLimits],
+    policy: str,
+    ocr_backend: str = "vision",
+) -> Tuple[dict, Optional[str]]:
+    """
+    GPT peruspromptilla ja OCR samaan aikaan; OCR:n jälkeen rikastettu kutsu
+    rinnalle. first_valid: ensimmäinen validoinnit läpäisevä voittaa ja muut
+    perutaan. merge: molemmat valmiiksi ja reconcile(). Vain peruskutsu striimaa
+    partial-tapahtumia. Molemmat kutsut jakavat sivun yhden vision-vaihepaikan.
+    Palauttaa (tulos, ocr-lähde).
+    """
+    n = page["page"]
+    started = time.perf_counter()
+    _emit(emit, "stage", stage="prompt_built", page=n, prompt_chars=len(base_prompt), speculative=True)
+    base = asyncio.create_task(_run_cascade(page, base_prompt, itype, detail, tenant, emit))
+    ocr_task = asyncio.create_task(_ocr_prompt(page, base_prompt, limits, ocr_backend))
+    enriched: Optional[asyncio.Task] = None
+    pending = {base, ocr_task}
+    results = {}
+    winner = None
+    ocr_source, ocr_ms = None, None
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if ocr_task in done:
+                final_prompt, ocr_source = ocr_task.result()
+                ocr_ms = round((time.perf_counter() - started) * 1000)
+                _emit(emit, "stage", stage="ocr_done", page=n, source=ocr_source or "failed")
+                if ocr_source and final_prompt != base_prompt:
+                    enriched = asyncio.create_task(_run_cascade(page, final_prompt, itype, detail, tenant, None))
+                    pending.add(enriched)
+                    _emit(emit, "stage", stage="prompt_built", page=n, prompt_chars=len(final_prompt), speculative=True)
+            # Sama kierros: rikastettu ensin (parempi prompt)
+            for name, task in (("enriched", enriched), ("base", base)):
+                if task is None or task not in done:
+                    continue
+                results[name] = _task_result(task)
+                if policy == "first_valid" and winner is None and results[name] is not None:
+                    if not assess_result(results[name], itype)[2]:
+                        winner = name
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    candidates = {name: r for name, r in results.items() if r is not None}
+    filled: List[str] = []
+    if winner is None:
+        if not candidates:
+            raise RuntimeError("All speculative vision calls failed")
+        if policy == "merge" and len(candidates) == 2:
+            def rank(name: str) -> tuple:
+                confidence, _, rejected = assess_result(candidates[name], itype)
+                return (not rejected, confidence, name == "enriched")
+            winner = max(candidates, key=rank)
+            other = "base" if winner == "enriched" else "enriched"
+            merged, filled = reconcile(candidates[winner], candidates[other])
+            candidates[winner] = validate_and_enhance_result(merged, itype) if filled else merged
+        else:
+            # Kumpikaan ei läpäissyt validointia (tai vain yksi valmistui): rikastettu ensisijainen
+            winner = "enriched" if "enriched" in candidates else "base"
+
+    result = candidates[winner]
+    if isinstance(result, dict):
+        info = result.setdefault("processing_info", {})
+        info["speculative"] = {
+            "policy": policy,
+            "winner": winner,
+            "calls": 2 if enriched is not None else 1,
+            "ocr_ms": ocr_ms,
+            "ms": round((time.perf_counter() - started) * 1000),
+        }
+        if filled:
+            info["speculative"]["filled"] = filled
+    log.info(f"Speculative steel page {n}: {policy} -> {winner} ({len(candidates)} result(s))")
+    # ocr_source vain, jos OCR päätyi tulokseen (rikastettu voitti tai täydensi)
+    return result, ocr_source if (winner == "enriched" or filled) else None
+
+async def _call_vision(page: dict, prompt: str, itype: str, detail: str, tenant: Optional[str],
+                       emit: Emit, tier: dict) -> dict:
+    n = page["page"]
+    if emit is None:
+        return await extract_structured_data_with_vision_async(
+            image_bytes=page["vision_image"],
+            prompt=prompt,
+            industry_type=itype,
+            detail=detail,
+            tenant=tenant,
+            model=tier["model"],
+        )
+    return await extract_structured_data_with_vision_stream_async(
+        image_bytes=page["vision_image"],
+        prompt=prompt,
+        industry_type=itype,
+        detail=detail,
+        tenant=tenant,
+        model=tier["model"],
+        on_start=lambda: _emit(emit, "stage", stage="model_streaming", page=n, tier=tier["name"]),
+        on_partial=lambda data, complete: _emit(emit, "partial", page=n, data=data, complete=complete, tier=tier["name"]),
+    )
+
+async def _run_cascade(page: dict, prompt: str, itype: str, detail: str, tenant: Optional[str], emit: Emit) -> dict:
+    """
+    Mallikaskadi (lib/model_cascade.py): tasot järjestyksessä, kunnes tulos
+    läpäisee validoinnit ja luottamus >= min_confidence. Viimeinen taso
+    vastaa aina. processing_info: model_tier, confidence ja cascade-historia.
+    """
+    tiers, min_confidence = cascade_for(itype, tenant)
+    attempts = []
+    for i, tier in enumerate(tiers):
+        started = time.perf_counter()
+        result = await _call_vision(page, prompt, itype, detail, tenant, emit, tier)
+        confidence, reasons, rejected = assess_result(result, itype)
+        attempts.append({
+            "tier": tier["name"], "model": tier["model"], "confidence": confidence,
+            "reasons": reasons, "ms": round((time.perf_counter() - started) * 1000),
+        })
+        last = i == len(tiers) - 1
+        if last or (not rejected and confidence >= min_confidence):
+            break
+        log.info(f"Escalating page {page['page']} from {tier['name']} ({confidence}, {reasons}) to {tiers[i + 1]['name']}")
+        _emit(emit, "stage", stage="escalated", page=page["page"], tier=tiers[i + 1]["name"], reasons=reasons)
+
+    if isinstance(result, dict):
+        info = result.setdefault("processing_info", {})
+        info["model_used"] = tier["model"]
+        info["model_tier"] = tier["name"]
+        info["confidence"] = confidence
+        if len(tiers) > 1:
+            info["cascade"] = attempts
+    return result
+
+def cache_tenant(user: AuthenticatedUser) -> str:
+    # Välimuisti on aina tenant-kohtainen; ilman orgia rajataan käyttäjään
+    return f"org:{user.org_slug}" if user.org_slug else f"user:{user.user_id}"
+
+def _set_cache_status(result: dict, status: str) -> None:
+    info = result.get("processing_info")
+    if not isinstance(info, dict):
+        info = result["processing_info"] = {}
+    info["cache"] = status
+
+# ---------------------------
+# Putki
+# ---------------------------
+
+def resolve_prompt(itype: str) -> str:
+    """Industryn prompt; tuntematon industry -> 400, rikkinäinen config -> 500."""
+    try:
+        return get_prompt(itype)
+    except KeyError:
+        available = sorted(get_industries_ui_config())
+        if itype in available:
+            raise HTTPException(status_code=500, detail=f"No prompt configured for '{itype}'")
+        # autetaan debuggia listaamalla mitkä on saatavilla
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown industry_type '{itype}'. Available: {', '.join(available)}",
+        )
+    except Exception:
+        log.exception("Loading industry prompt failed")
+        raise HTTPException(status_code=500, detail="Prompt configuration error")
+
+def resolve_ocr_backend(itype: str, requested: Optional[str] = None) -> str:
+    """OCR-backend (ocr_utils.ocr_backend_for); tuntematon pyynnön arvo -> 400."""
+    try:
+        return ocr_backend_for(itype, requested)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def run_analysis(
+    upload: SpooledUpload,
+    itype: str,
+    base_prompt: str,
+    tenant: str,
+    emit: Emit = None,
+    limits: Optional[StageLimits] = None,
+    ocr_backend: Optional[str] = None,
+) -> dict:
+    """
+    Käsittelee PDF/kuvan:
+      1) PDF->PNG (kaikki sivut rinnakkain), muuten normalisoi kuva Visionia varten
+      2) Palauttaa välimuistiosuman, jos sama tiedosto on jo analysoitu
+      3) (steel) Rikastaa promptin PDF:n tekstikerroksella tai Vision-OCR:llä
+      4) Kutsuu GPT-visionia sivu kerrallaan rinnakkain
+      5) Yhdistää sivujen tulokset ja palauttaa aina rakenteisen JSONin
+
+    emit(event, data) saa vaiheet ("stage": upload_received, rasterized,
+    ocr_done, prompt_built, model_streaming, escalated) ja keskeneräiset tulokset
+    ("partial"); ilman sitä GPT-vastausta ei striimata. tenant = cache_tenant(user):
+    välimuistin rajaus ja OpenAI-jonon omistaja. limits rajaa vaiheiden
+    rinnakkaisuutta, kun useita tiedostoja ajetaan yhtä aikaa (erä-ajo).
+    ocr_backend: pyynnön OCR-backend (steel); None -> ympäristö/industry-config.
+    Virheet nousevat HTTPExceptioneina kuten /process-endpointissa.
+    """
+    settings = vision_settings(itype)
+    ocr_backend = resolve_ocr_backend(itype, ocr_backend)
+    _emit(emit, "stage", stage="upload_received", filename=upload.filename, bytes=upload.size)
+
+    # --- Välimuisti: sama tiedosto + industry + prompt + malli -> sama tulos ---
+    cache_key = None
+    if result_cache.enabled:
+        file_sha = upload.sha256
+        cache_key = make_cache_key(
+            tenant, file_sha, itype, base_prompt, OPENAI_MODEL, cascade_signature(itype, tenant),
+            *(f"{k}={settings[k]}" for k in sorted(settings)),
+            *((f"ocr={ocr_backend}",) if itype == "steel" else ()),
+        )
+        cached = await result_cache.aget(cache_key)
+        if cached is not None:
+            log.info(f"Result cache hit for {itype} ({file_sha[:12]})")
+            _set_cache_status(cached, "hit")
+            return cached
+
+    async with RssSampler() as mem:
+        # --- Kuvan valmistelu (CPU-/prosessipoolissa, ei event loopissa) ---
+        started = time.perf_counter()
+        try:
+            async with _stage(limits, "rasterize"):
+                pages = await _prepare_pages(upload, itype, settings)
+        except HTTPException:
+            raise
+        except Exception:
+            log.exception("Image normalization failed")
+            raise HTTPException(status_code=400, detail="Image normalization failed")
+        _emit(emit, "stage", stage="rasterized", pages=len(pages), ms=round((time.perf_counter() - started) * 1000))
+
+        # --- OCR + GPT Vision jokaiselle sivulle rinnakkain ---
+        try:
+            page_results = await asyncio.gather(*(_analyze_page(p, base_prompt, itype, settings["detail"], tenant, emit, limits, ocr_backend) for p in pages))
+            result = merge_page_results(
+                [(p["page"], r) for p, r in zip(pages, page_results)],
+                itype,
+            )
+        except Exception:
+            log.exception("GPT vision call failed")
+            # Vaikka gpt_utils jo palauttaa virherakenteen useimmissa tapauksissa,
+            # varmistetaan siisti virheviesti jos jotain odottamatonta tapahtuu.
+            raise HTTPException(status_code=500, detail="Vision analysis failed")
+
+    if isinstance(result, dict):
+        result.setdefault("processing_info", {})["memory"] = mem.summary()
+
+    # --- Palautemuoto: aina success-kenttä ja payload juureen ---
+    if not isinstance(result, dict):
+        return {"success": True, "result": result, "industry_type": itype}
+
+    # Jos gpt_utils palautti virhemuodon, siinä on success=False -> säilytä
+    if "success" not in result:
+        result["success"] = True
+
+    # Talleta myös endpointin meta, jos hyödyllistä
+    result.setdefault("industry_type", itype)
+
+    # Vain onnistuneet analyysit välimuistiin – virheet yritetään aina uudelleen
+    if cache_key and result.get("success") is not False and "error" not in result:
+        await result_cache.aput(cache_key, result)
+    _set_cache_status(result, "miss")
+
+    return result
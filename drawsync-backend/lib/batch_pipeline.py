@@ -0,0 +1,269 @@
+# drawsync-backend/lib/batch_pipeline.py
+"""
+Erä-ajo: ZIP-paketti tai monta tiedostoa -> yksi NDJSON-rivi per piirustus.
+
+Asiakkaat lähettävät tarjousta varten 50–500 piirustusta kerralla. /process
+ajaa yhden tiedoston kerrallaan, joten erä vei tiedostojen määrä × analyysiaika.
+Täällä tiedostot kulkevat saman putken läpi (lib/analysis_pipeline.py)
+limittäin:
+
+- ZIP luetaan entry kerrallaan levylle (SpooledUpload); koko pakettia ei
+  pureta kerralla. Tiedostoja on työn alla enintään BATCH_MAX_IN_FLIGHT,
+  joten rasteroituja sivuja ei kerry muistiin koko erän verran.
+- vaiheilla on omat rajat (StageLimits): rasterointi BATCH_RASTER_CONCURRENCY,
+  Vision-OCR BATCH_OCR_CONCURRENCY (oletus 16 = yksi täysi Vision-mikroerä,
+  lib/ocr_batcher.py), GPT BATCH_VISION_CONCURRENCY (oletus
+  OPENAI_MAX_CONCURRENCY). GPT-kutsujen tahdin määrää lopulta OpenAI-ajoittaja
+  (rate limitit), ei erän rakenne.
+- tulosrivi lähtee heti kun tiedosto valmistuu (valmistumisjärjestyksessä,
+  "index" kertoo paikan erässä). Yhden tiedoston virhe on vain virherivi.
+"""
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+import logging
+import zipfile
+import mimetypes
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from lib.analysis_pipeline import StageLimits, run_analysis
+from lib.concurrency import run_cpu, process_workers
+from lib.openai_client import max_concurrency
+from lib.ocr_batcher import MAX_IMAGES_PER_CALL
+from lib.upload_limits import max_file_bytes, too_large_detail
+from lib.upload_spool import SpooledUpload, UploadTooLarge, spool_fileobj
+
+log = logging.getLogger("process.batch")
+
+DRAWING_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".webp", ".tif", ".tiff", ".bmp", ".gif"}
+ZIP_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed", "application/x-zip"}
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def batch_limits() -> StageLimits:
+    return StageLimits(
+        rasterize=_env_int("BATCH_RASTER_CONCURRENCY", process_workers()),
+        ocr=_env_int("BATCH_OCR_CONCURRENCY", MAX_IMAGES_PER_CALL),
+        vision=_env_int("BATCH_VISION_CONCURRENCY", max_concurrency()),
+    )
+
+
+# ---------------------------
+# Erän tiedostot
+# ---------------------------
+
+class BatchEntry:
+    """Yksi erän piirustus: suora upload tai ZIP-entry. spool() antaa sen levyllä."""
+
+    def __init__(self, filename: str, source: SpooledUpload, archive: Optional[zipfile.ZipFile] = None,
+                 info: Optional[zipfile.ZipInfo] = None, error: Optional[str] = None):
+        self.filename = filename
+        self.source = source
+        self.archive = archive
+        self.info = info
+        self.error = error  # ei-tuettu tiedosto -> virherivi ilman käsittelyä
+
+    def spool(self, max_bytes: int) -> SpooledUpload:
+        """
+        Synkroninen (säiepoolissa): ZIP-entry puretaan paloina, SHA-256 samalla.
+        Suora upload on jo levyllä; se annetaan sellaisenaan (analyysi sulkee sen).
+        """
+        if self.archive is None:
+            if self.source.size > max_bytes:
+                raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+            return self.source
+        if self.info.file_size > max_bytes:
+            raise UploadTooLarge(f"Entry exceeds {max_bytes} bytes")
+        content_type = mimetypes.guess_type(self.filename)[0]
+        with self.archive.open(self.info) as src:
+            # file_size on ZIPin oma ilmoitus; _copy laskee todelliset tavut (zip-pommi)
+            return spool_fileobj(src, self.filename, content_type, max_bytes)
+
+
+def _is_zip(source: SpooledUpload) -> bool:
+    if (source.filename or "").lower().endswith(".zip") or (source.content_type or "").lower() in ZIP_CONTENT_TYPES:
+        return True
+    return zipfile.is_zipfile(source.path)
+
+
+def _skip_member(name: str) -> bool:
+    base = os.path.basename(name.rstrip("/"))
+    return name.endswith("/") or name.startswith("__MACOSX/") or base.startswith(".") or not base
+
+
+def close_entries(entries: List[BatchEntry]) -> None:
+    """Sulje erän avaamat ZIPit (lähdetiedostot sulkee niiden omistaja)."""
+    for archive in {id(e.archive): e.archive for e in entries if e.archive is not None}.values():
+        archive.close()
+
+
+def collect_entries(sources: List[SpooledUpload]) -> List[BatchEntry]:
+    """
+    Erän piirustukset levylle tallennetuista uploadeista (ZIPit avataan,
+    sisäkkäisiä ei). Lukee vain ZIPien hakemistot, ei sisältöä. Rikkinäinen
+    ZIP, tyhjä erä tai yli BATCH_MAX_FILES tiedostoa -> 400 ennen kuin mitään
+    käsitellään (jo avatut ZIPit suljetaan).
+    """
+    entries: List[BatchEntry] = []
+    try:
+        _collect(sources, entries)
+    except BaseException:
+        close_entries(entries)
+        raise
+    return entries
+
+
+def _collect(sources: List[SpooledUpload], entries: List[BatchEntry]) -> None:
+    for source in sources:
+        if _is_zip(source):
+            try:
+                archive = zipfile.ZipFile(source.path)
+                members = archive.infolist()
+            except (zipfile.BadZipFile, OSError):
+                raise HTTPException(status_code=400, detail=f"Invalid ZIP archive: {source.filename}")
+            before = len(entries)
+            for info in members:
+                if _skip_member(info.filename):
+                    continue
+                entry = BatchEntry(info.filename, source, archive, info)
+                if os.path.splitext(info.filename)[1].lower() not in DRAWING_EXTENSIONS:
+                    entry.error = "Unsupported file type"
+                elif info.flag_bits & 0x1:
+                    entry.error = "Encrypted ZIP entries are not supported"
+                entries.append(entry)
+            if len(entries) == before:
+                archive.close()  # pelkkiä ohitettavia (hakemistot, __MACOSX)
+        else:
+            entries.append(BatchEntry(source.filename or "upload", source))
+
+    max_files = _env_int("BATCH_MAX_FILES", 500)
+    if not entries:
+        raise HTTPException(status_code=400, detail="No drawings in upload")
+    if len(entries) > max_files:
+        raise HTTPException(status_code=400, detail=f"Too many files in batch ({len(entries)} > {max_files})")
+
+
+# ---------------------------
+# Putki
+# ---------------------------
+
+def _error_line(index: int, entry: BatchEntry, status: int, detail: str, started: float) -> Dict[str, Any]:
+    return {
+        "type": "result", "index": index, "filename": entry.filename, "status": "error",
+        "error": {"status": status, "detail": detail},
+        "ms": round((time.perf_counter() - started) * 1000),
+    }
+
+
+async def run_batch(
+    entries: List[BatchEntry],
+    itype: str,
+    base_prompt: str,
+    tenant: str,
+    ocr_backend: Optional[str] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Ajaa erän ja tuottaa rivit:
+      {"type": "batch", "files": n, "industry_type": ...}
+      {"type": "result", "index", "filename", "status": "ok" | "error", "result" | "error", "ms"}
+      {"type": "ping"}       (kun mitään ei valmistu BATCH_PING_S sekuntiin; pitää proxyt hereillä)
+      {"type": "summary", "files", "ok", "failed", "ms"}
+    Generaattorin sulkeminen (asiakas katkaisi) peruu keskeneräiset tiedostot.
+    """
+    limits = batch_limits()
+    in_flight = asyncio.Semaphore(max(1, _env_int("BATCH_MAX_IN_FLIGHT", 16)))
+    ping_s = _env_float("BATCH_PING_S", 15.0) or None
+    max_bytes = max_file_bytes()
+    lines: asyncio.Queue = asyncio.Queue()
+    tasks: set = set()
+    batch_started = time.perf_counter()
+
+    async def analyze(index: int, entry: BatchEntry, upload: SpooledUpload, started: float) -> None:
+        try:
+            result = await run_analysis(upload, itype, base_prompt, tenant, limits=limits, ocr_backend=ocr_backend)
+            ok = not (isinstance(result, dict) and (result.get("success") is False or "error" in result))
+            line = {
+                "type": "result", "index": index, "filename": entry.filename,
+                "status": "ok" if ok else "error", "result": result,
+                "ms": round((time.perf_counter() - started) * 1000),
+            }
+        except HTTPException as e:
+            line = _error_line(index, entry, e.status_code, e.detail, started)
+        except Exception:
+            log.exception(f"Batch file failed: {entry.filename}")
+            line = _error_line(index, entry, 500, "Vision analysis failed", started)
+        finally:
+            upload.close()
+            in_flight.release()
+        lines.put_nowait(line)
+
+    async def produce() -> None:
+        """Pura tiedostot levylle järjestyksessä sitä mukaa kuin työpaikkoja vapautuu."""
+        for index, entry in enumerate(entries):
+            started = time.perf_counter()
+            if entry.error:
+                lines.put_nowait(_error_line(index, entry, 415, entry.error, started))
+                continue
+            await in_flight.acquire()
+            try:
+                upload = await run_cpu(entry.spool, max_bytes)
+            except UploadTooLarge:
+                in_flight.release()
+                lines.put_nowait(_error_line(index, entry, 413, too_large_detail(max_bytes), started))
+                continue
+            except (zipfile.BadZipFile, OSError, EOFError) as e:
+                in_flight.release()
+                log.warning(f"Batch entry unreadable: {entry.filename}: {e}")
+                lines.put_nowait(_error_line(index, entry, 400, "Corrupt archive entry", started))
+                continue
+            except Exception:
+                in_flight.release()
+                log.exception(f"Batch entry spooling failed: {entry.filename}")
+                lines.put_nowait(_error_line(index, entry, 500, "Could not read file", started))
+                continue
+            task = asyncio.create_task(analyze(index, entry, upload, started))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    producer = asyncio.create_task(produce())
+    log.info(f"Batch started: {len(entries)} file(s), {itype}")
+    yield {"type": "batch", "files": len(entries), "industry_type": itype}
+
+    done = ok = 0
+    try:
+        while done < len(entries):
+            try:
+                line = await asyncio.wait_for(lines.get(), timeout=ping_s)
+            except asyncio.TimeoutError:
+                yield {"type": "ping"}
+                continue
+            done += 1
+            ok += line["status"] == "ok"
+            yield line
+    finally:
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
+        await asyncio.gather(producer, *tasks, return_exceptions=True)
+        close_entries(entries)
+
+    elapsed = time.perf_counter() - batch_started
+    log.info(f"Batch done: {ok}/{len(entries)} ok in {elapsed:.1f}s")
+    yield {"type": "summary", "files": len(entries), "ok": ok, "failed": len(entries) - ok, "ms": round(elapsed * 1000)}
@@ -0,0 +1,89 @@
+# drawsync-backend/lib/concurrency.py
+"""
+Rajatut executorit CPU-raskaalle työlle (PDF-rasterointi, PIL-enkoodaus).
+
+- CPU-säiepooli: PIL vapauttaa GIL:n enkoodauksen/skaalauksen ajaksi
+- prosessipooli: PyMuPDF pitää GIL:n renderöinnin ajan, joten monisivuiset
+  PDF:t rasteroidaan erillisissä prosesseissa aidosti rinnakkain
+
+Event loopissa ei saa ajaa synkronista, pitkään kestävää työtä: yksi
+raskas kuva jäädyttäisi kaikki muut saman uvicorn-workerin pyynnöt.
+"""
+from __future__ import annotations
+
+import os
+import asyncio
+import functools
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+log = logging.getLogger(__name__)
+
+_CPU_POOL: Optional[ThreadPoolExecutor] = None
+_PROCESS_POOL: Optional[ProcessPoolExecutor] = None
+
+
+def _env_workers(name: str) -> int:
+    default = min(4, os.cpu_count() or 1)
+    try:
+        return max(1, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def _cpu_workers() -> int:
+    return _env_workers("CPU_WORKERS")
+
+
+def process_workers() -> int:
+    return _env_workers("PDF_RENDER_PROCESSES")
+
+
+def get_cpu_pool() -> ThreadPoolExecutor:
+    """Prosessin yhteinen, kooltaan rajattu executor CPU-vaiheille."""
+    global _CPU_POOL
+    if _CPU_POOL is None:
+        workers = _cpu_workers()
+        _CPU_POOL = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cpu")
+        log.info(f"CPU pool started with {workers} workers")
+    return _CPU_POOL
+
+
+async def run_cpu(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Aja synkroninen funktio CPU-poolissa ja odota tulosta blokkaamatta loopia."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_cpu_pool(), functools.partial(fn, *args, **kwargs))
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Prosessin yhteinen prosessipooli. spawn-konteksti: uvicornin säikeiden
+    kanssa fork ei ole turvallinen, ja spawn-workerit tuovat vain tarvitsemansa.
+    """
+    global _PROCESS_POOL
+    if _PROCESS_POOL is None:
+        workers = process_workers()
+        _PROCESS_POOL = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        log.info(f"Process pool started with {workers} workers")
+    return _PROCESS_POOL
+
+
+async def run_in_process(fn: Callable[..., Any], *args: Any) -> Any:
+    """Aja picklattava top-level-funktio prosessipoolissa."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), fn, *args)
+
+
+def shutdown_pools() -> None:
+    global _CPU_POOL, _PROCESS_POOL
+    if _CPU_POOL is not None:
+        _CPU_POOL.shutdown(wait=False, cancel_futures=True)
+        _CPU_POOL = None
+    if _PROCESS_POOL is not None:
+        _PROCESS_POOL.shutdown(wait=False, cancel_futures=True)
+        _PROCESS_POOL = None
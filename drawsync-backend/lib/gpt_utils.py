@@ -5,22 +5,138 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from openai import OpenAI
+from PIL import Image
+import io
 import base64
 import math
 import json
 import logging
 import time
 
+from lib.openai_client import chat_completion, chat_completion_stream, request_timeout, max_retries
+from lib.openai_scheduler import estimate_tokens, scheduler
+from lib.partial_json import PartialJsonParser
+
 logger = logging.getLogger(__name__)
 
-# OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Synkroninen client vanhoille kutsujille (SDK:n oma backoff, sama aikaraja, poolin
+# ensimmäinen endpoint); /process-putki käyttää jaettua async-clientia ja koko poolia.
+# Luodaan ensimmäisellä kutsulla: pooli luetaan asetuksista vasta silloin.
+_sync_client = None
+
+
+def _get_sync_client() -> OpenAI:
+    global _sync_client
+    if _sync_client is None:
+        primary = scheduler.pool.primary
+        _sync_client = OpenAI(
+            api_key=primary.api_key,
+            base_url=primary.base_url,
+            timeout=request_timeout(),
+            max_retries=max_retries(),
+        )
+    return _sync_client
+
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5")  
 
+# OpenAI-visionmallien sisäinen resoluutio (pitkä sivu, lyhyt sivu):
+#  high/auto: kuva sovitetaan 2048x2048:aan ja lyhyt sivu 768 px:iin
+#  low:       koko kuva 512x512
+# Isompi kuva ei tuo mallille lisätietoa, vain upload-aikaa ja tokeneita.
+VISION_DETAIL_LIMITS = {
+    "high": (2048, 768),
+    "auto": (2048, 768),
+    "low": (512, 512),
+}
+DEFAULT_VISION_DETAIL = "high"
+
+def normalize_detail(detail) -> str:
+    detail = (detail or DEFAULT_VISION_DETAIL).strip().lower()
+    return detail if detail in VISION_DETAIL_LIMITS else DEFAULT_VISION_DETAIL
+
+def vision_image_limits(detail: str = DEFAULT_VISION_DETAIL) -> tuple:
+    """
+    Mallille lähetettävän kuvan maksimikoko (pitkä sivu, lyhyt sivu).
+    OPENAI_VISION_MAX_LONG_SIDE / OPENAI_VISION_MAX_SHORT_SIDE yliajavat
+    (esim. mallille, jonka tiilijako poikkeaa oletuksesta).
+    """
+    long_side, short_side = VISION_DETAIL_LIMITS[normalize_detail(detail)]
+    try:
+        long_side = int(os.getenv("OPENAI_VISION_MAX_LONG_SIDE", str(long_side)))
+        short_side = int(os.getenv("OPENAI_VISION_MAX_SHORT_SIDE", str(short_side)))
+    except ValueError:
+        pass
+    return long_side, short_side
+
 # -----------------------------
 # MAIN GPT FUNCTION - Yksinkertaistettu versio
 # -----------------------------
 
+def _image_mime(image_bytes: bytes) -> str:
+    return "image/jpeg" if image_bytes[:3] == b"\xff\xd8\xff" else "image/png"
+
+def _build_messages(prompt: str, image_bytes: bytes, detail: str = DEFAULT_VISION_DETAIL) -> list:
+    """Rakenna chat-viestit: system-prompt + kuva base64-data-URLina."""
+    image_base64 = base64.b64encode(image_bytes).decode("utf-8")
+    return [
+        {"role": "system", "content": prompt},  # ← Käytä parametrina saatua promptia
+        {"role": "user", "content": [
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{_image_mime(image_bytes)};base64,{image_base64}",
+                    "detail": normalize_detail(detail),
+                }
+            }
+        ]},
+    ]
+
+def _image_size(image_bytes: bytes):
+    """Kuvan (leveys, korkeus) otsakkeesta – pikseleitä ei dekoodata."""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            return img.size
+    except Exception:
+        return None
+
+def estimate_request_tokens(prompt: str, image_bytes: bytes, detail: str = DEFAULT_VISION_DETAIL) -> int:
+    """Vision-kutsun arvioitu token-kulu rate limit -jonoa varten."""
+    return estimate_tokens(len(prompt), _image_size(image_bytes), normalize_detail(detail))
+
+def _log_request(industry_type: str, prompt: str, image_bytes: bytes, model: str = None) -> None:
+    logger.info(f" Processing {industry_type} image with {model or OPENAI_MODEL}")
+    logger.info(f" Prompt length: {len(prompt)} characters")
+    logger.info(f" Image size: {len(image_bytes)} bytes")
+
+def _finalize_result(raw_content: str, industry_type: str, start_time: float, model: str = None) -> dict:
+    """Parsi GPT:n JSON-vastaus, lisää metadata ja aja industry-validoinnit."""
+    logger.info(f" GPT response length: {len(raw_content)} characters")
+
+    # Parse JSON response
+    try:
+        data = json.loads(raw_content)
+    except json.JSONDecodeError as e:
+        logger.error(f" JSON parse error: {e}")
+        logger.error(f"Raw response preview: {raw_content[:500]}...")
+        raise ValueError(f"Invalid JSON response from GPT: {e}")
+
+    # Add metadata
+    processing_time = round(time.time() - start_time, 2)
+    data["industry_type"] = industry_type
+    data["processing_info"] = {
+        "model_used": model or OPENAI_MODEL,
+        "confidence": 0.9,  # Placeholder - voisi laskea oikeasti response:in perusteella
+        "processing_time": processing_time,
+        "prompt_version": "2.0",
+        "response_length": len(raw_content)
+    }
+
+    # Industry-specific validation and enhancement
+    enhanced_data = validate_and_enhance_result(data, industry_type)
+
+    logger.info(f" Successfully processed {industry_type} drawing in {processing_time}s")
+    return enhanced_data
+
 def extract_structured_data_with_vision(
     image_bytes: bytes, 
     prompt: str,  # ← Prompt tulee parametrina 
@@ -40,62 +156,139 @@ def extract_structured_data_with_vision(
     start_time = time.time()
     
     try:
-        logger.info(f" Processing {industry_type} image with {OPENAI_MODEL}")
-        logger.info(f" Prompt length: {len(prompt)} characters")
-        logger.info(f" Image size: {len(image_bytes)} bytes")
-        
-        # Encode image to base64
-        image_base64 = base64.b64encode(image_bytes).decode("utf-8")
+        _log_request(industry_type, prompt, image_bytes)
 
         #  GPT-5 API kutsu - toimii kuville
-        response = client.chat.completions.create(
+        response = _get_sync_client().chat.completions.create(
             model=OPENAI_MODEL,
             response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": prompt},  # ← Käytä parametrina saatua promptia
-                {"role": "user", "content": [
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/png;base64,{image_base64}"}
-                    }
-                ]},
-            ],
-
+            messages=_build_messages(prompt, image_bytes),
         )
 
-        raw_content = response.choices[0].message.content
-        logger.info(f" GPT response length: {len(raw_content)} characters")
+        return _finalize_result(response.choices[0].message.content, industry_type, start_time)
+
+    except Exception as e:
+        processing_time = round(time.time() - start_time, 2)
+        logger.error(f" Vision processing failed after {processing_time}s: {str(e)}")
         
-        # Parse JSON response
-        try:
-            data = json.loads(raw_content)
-        except json.JSONDecodeError as e:
-            logger.error(f" JSON parse error: {e}")
-            logger.error(f"Raw response preview: {raw_content[:500]}...")
-            raise ValueError(f"Invalid JSON response from GPT: {e}")
-
-        # Add metadata
+        # Return industry-appropriate error structure
+        return create_error_response(industry_type, str(e), processing_time)
+
+async def extract_structured_data_with_vision_async(
+    image_bytes: bytes,
+    prompt: str,
+    industry_type: str = "coating",
+    detail: str = DEFAULT_VISION_DETAIL,
+    tenant: str = None,
+    model: str = None,
+) -> dict:
+    """
+    Async-versio extract_structured_data_with_vision:sta (AsyncOpenAI).
+
+    Ei blokkaa event looppia GPT-kutsun ajaksi, joten saman workerin muut
+    pyynnöt (/health, /config/industries, rinnakkaiset uploadit) etenevät.
+    Palautusmuoto on identtinen synkronisen version kanssa.
+
+    detail: image_url.detail ("high" | "low" | "auto"), industry-configista.
+
+    Kutsu kulkee jaetun clientin kautta: ohimenevät 429/5xx-virheet
+    yritetään uudelleen backoffilla ja OPENAI_DEADLINE_S rajaa kokonaisajan.
+
+    tenant: rate limit -jonon omistaja (org/käyttäjä); vuorot jaetaan reilusti
+    tenanttien kesken ja kutsu odottaa vuoroaan enintään OPENAI_QUEUE_MAX_WAIT_S.
+
+    model: mallikaskadin taso (lib/model_cascade.py); oletus OPENAI_MODEL.
+    """
+    start_time = time.time()
+
+    try:
+        _log_request(industry_type, prompt, image_bytes, model)
+
+        response = await chat_completion(
+            tenant=tenant,
+            estimated_tokens=estimate_request_tokens(prompt, image_bytes, detail),
+            model=model or OPENAI_MODEL,
+            response_format={"type": "json_object"},
+            messages=_build_messages(prompt, image_bytes, detail),
+        )
+
+        return _finalize_result(response.choices[0].message.content, industry_type, start_time, model)
+
+    except Exception as e:
         processing_time = round(time.time() - start_time, 2)
-        data["industry_type"] = industry_type
-        data["processing_info"] = {
-            "model_used": OPENAI_MODEL,
-            "confidence": 0.9,  # Placeholder - voisi laskea oikeasti response:in perusteella
-            "processing_time": processing_time,
-            "prompt_version": "2.0",
-            "response_length": len(raw_content)
-        }
+        logger.error(f" Vision processing failed after {processing_time}s: {str(e)}")
+        return create_error_response(industry_type, str(e), processing_time)
 
-        # Industry-specific validation and enhancement
-        enhanced_data = validate_and_enhance_result(data, industry_type)
-        
-        logger.info(f" Successfully processed {industry_type} drawing in {processing_time}s")
-        return enhanced_data
+def _partial_interval() -> float:
+    try:
+        return max(0.0, float(os.getenv("STREAM_PARTIAL_INTERVAL_S", "0.2")))
+    except ValueError:
+        return 0.2
+
+async def extract_structured_data_with_vision_stream_async(
+    image_bytes: bytes,
+    prompt: str,
+    industry_type: str = "coating",
+    detail: str = DEFAULT_VISION_DETAIL,
+    tenant: str = None,
+    model: str = None,
+    on_start=None,
+    on_partial=None,
+) -> dict:
+    """
+    Striimaava versio extract_structured_data_with_vision_async:sta.
+
+    on_start(): ensimmäinen token saapui (malli kirjoittaa vastausta).
+    on_partial(data, complete_keys): keskeneräisen JSONin paras tulkinta ja
+    valmiiksi kirjoitetut ylätason avaimet, enintään STREAM_PARTIAL_INTERVAL_S
+    välein sekä aina, kun uusi ylätason avain valmistuu. Validointi ajetaan
+    vain lopulliselle vastaukselle; palautusmuoto on sama kuin async-versiolla.
+    """
+    start_time = time.time()
+    state = {"last": 0.0, "complete": 0, "started": False, "parser": PartialJsonParser()}
+    interval = _partial_interval()
+
+    def _on_delta(delta: str, reset: bool) -> None:
+        if reset:
+            state["parser"] = PartialJsonParser()
+            state["complete"] = 0
+        if not state["started"]:
+            state["started"] = True
+            if on_start:
+                on_start()
+        if not on_partial:
+            return
+        # feed() käy läpi vain uuden palan; koko tulkinta (value) rakennetaan
+        # vain välin täyttyessä tai kun uusi ylätason avain valmistuu
+        parser = state["parser"]
+        parser.feed(delta)
+        now = time.monotonic()
+        if now - state["last"] < interval and len(parser.completed) == state["complete"]:
+            return
+        data = parser.value()
+        if not isinstance(data, dict):
+            return
+        state["last"] = now
+        state["complete"] = len(parser.completed)
+        on_partial(data, list(parser.completed))
+
+    try:
+        _log_request(industry_type, prompt, image_bytes, model)
+
+        content = await chat_completion_stream(
+            _on_delta,
+            tenant=tenant,
+            estimated_tokens=estimate_request_tokens(prompt, image_bytes, detail),
+            model=model or OPENAI_MODEL,
+            response_format={"type": "json_object"},
+            messages=_build_messages(prompt, image_bytes, detail),
+        )
+
+        return _finalize_result(content, industry_type, start_time, model)
 
     except Exception as e:
         processing_time = round(time.time() - start_time, 2)
         logger.error(f" Vision processing failed after {processing_time}s: {str(e)}")
-        
-        # Return industry-appropriate error structure
         return create_error_response(industry_type, str(e), processing_time)
 
 # -----------------------------
@@ -344,6 +537,9 @@ def calculate_python_surface_area(data):
 # Backward compatibility exports
 __all__ = [
     'extract_structured_data_with_vision',
+    'extract_structured_data_with_vision_async',
+    'extract_structured_data_with_vision_stream_async',
+    'vision_image_limits',
     'validate_and_enhance_result', 
     'create_error_response',
     'convert_weight_to_kg'
@@ -106,3 +106,33 @@ def get_prompt(industry_type: str) -> str:
     if not prompt:
         raise KeyError(f"No prompt configured for '{industry_type}'")
     return prompt
+
+def get_vision_config(industry_type: str) -> Dict[str, Any]:
+    """
+    Palauttaa teollisuuden "vision"-asetukset (esim. {"detail": "high"}).
+    Puuttuva lohko -> tyhjä dict, jolloin käytetään oletuksia.
+    """
+    cfg = _get_cached()
+    block = cfg.get(industry_type)
+    if not isinstance(block, dict):
+        return {}
+    return _safe_dict(block.get("vision"), {})
+
+def get_cascade_config(industry_type: str) -> Dict[str, Any]:
+    """
+    Palauttaa teollisuuden "model_cascade"-lohkon (tasot + min_confidence).
+    Puuttuva lohko -> tyhjä dict, jolloin käytetään pelkkää OPENAI_MODEL:ia.
+    """
+    cfg = _get_cached()
+    block = cfg.get(industry_type)
+    if not isinstance(block, dict):
+        return {}
+    return _safe_dict(block.get("model_cascade"), {})
+
+def get_industry_block(industry_type: str) -> Dict[str, Any]:
+    """
+    Koko teollisuuden config-lohko backendin asetuksille (esim. "speculative_ocr").
+    Tuntematon teollisuus -> tyhjä dict.
+    """
+    block = _get_cached().get(industry_type)
+    return block if isinstance(block, dict) else {}
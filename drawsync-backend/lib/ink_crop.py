@@ -0,0 +1,150 @@
+# drawsync-backend/lib/ink_crop.py
+"""
+Tyhjien marginaalien rajaus ennen Vision/GPT-kutsuja.
+
+Skannatuissa ja exportatuissa piirustuksissa on usein leveät tyhjät reunat
+tai tyhjiä arkin alueita. Musteen rajauslaatikko haetaan pienennetystä
+harmaasävykopiosta rivi- ja sarakeprojektioilla (NumPy, ei pikselisilmukoita),
+ja kuva rajataan ennen enkoodausta.
+
+Tilat (VISION_CROP tai industry-configin vision.crop):
+- off (oletus): ei rajausta
+- sheet: rajaa vain arkin ulkopuoliset tyhjät reunat (kehys + nimiö mukana)
+- content: ohittaa arkin kehysviivat, jolloin rajaus seuraa itse sisältöä;
+  nimiö on mustetta kehyksen sisällä, joten se säilyy aina mukana
+
+Rajauksen offset talletetaan, jotta rajatun kuvan koordinaatit (OCR,
+mallin vastaukset) voidaan muuntaa takaisin alkuperäiseen kuvaan.
+"""
+from __future__ import annotations
+
+import os
+import math
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+CROP_MODES = ("off", "sheet", "content")
+_PROBE_PIXELS = 1_000_000
+_INK_DELTA = 24            # näin paljon paperia tummempi -> mustetta
+_FRAME_SHARE = 0.6         # rivin/sarakkeen pituudesta näin suuri osa mustetta -> kehysviiva
+_NOISE_SHARE = 0.001       # alle tämän osuuden mustetta rivillä -> pölyä/kohinaa
+_MARGIN_SHARE = 0.01       # jätetään reunaan pieni marginaali pitkästä sivusta
+_MIN_SAVING = 0.1          # rajataan vain, jos pinta-ala pienenee vähintään näin paljon
+
+Box = Tuple[int, int, int, int]
+
+
+def crop_mode(value: Optional[str] = None) -> str:
+    """Konfiguraation arvo (tai VISION_CROP, oletus "off") -> off | sheet | content."""
+    value = (value or os.getenv("VISION_CROP", "off")).strip().lower()
+    return value if value in CROP_MODES else "off"
+
+
+def _min_saving() -> float:
+    try:
+        return min(max(float(os.getenv("VISION_CROP_MIN_SAVING", str(_MIN_SAVING))), 0.0), 0.9)
+    except ValueError:
+        return _MIN_SAVING
+
+
+def _suppress_frame(ink: np.ndarray) -> np.ndarray:
+    """Poista lähes koko kuvan levyiset/korkuiset suorat viivat (arkin kehys)."""
+    h, w = ink.shape
+    rows = ink.sum(axis=1) > w * _FRAME_SHARE
+    cols = ink.sum(axis=0) > h * _FRAME_SHARE
+    if not rows.any() and not cols.any():
+        return ink
+    # Viereiset rivit mukaan (antialiasoitu / paksu viiva)
+    rows[1:] |= rows[:-1].copy()
+    rows[:-1] |= rows[1:].copy()
+    cols[1:] |= cols[:-1].copy()
+    cols[:-1] |= cols[1:].copy()
+    ink = ink.copy()
+    ink[rows, :] = False
+    ink[:, cols] = False
+    return ink
+
+
+def _span(counts: np.ndarray, min_count: float) -> Optional[Tuple[int, int]]:
+    idx = np.flatnonzero(counts >= min_count)
+    if idx.size == 0:
+        return None
+    return int(idx[0]), int(idx[-1]) + 1
+
+
+def find_ink_bbox(img: Image.Image, mode: str = "sheet") -> Optional[Box]:
+    """
+    Musteen rajauslaatikko (x0, y0, x1, y1) alkuperäisen kuvan pikseleinä
+    marginaaleineen, tai None jos kuva on tyhjä / rajaus ei kannata.
+    """
+    w, h = img.size
+    factor = max(1, math.ceil(math.sqrt(w * h / _PROBE_PIXELS)))
+    if img.mode not in ("L", "RGB"):
+        img = img.convert("RGB")  # P/CMYK/alfa: reduce() ei tue kaikkia tiloja
+    small = img.reduce(factor) if factor > 1 else img
+    gray = np.asarray(small.convert("L"), dtype=np.int16)
+
+    # Paperin sävy = vaaleiden pikselien taso (skannit eivät ole puhtaan valkoisia)
+    paper = np.percentile(gray, 90)
+    ink = gray < (paper - _INK_DELTA)
+    if mode == "content":
+        ink = _suppress_frame(ink)
+
+    sh, sw = ink.shape
+    ys = _span(ink.sum(axis=1), max(2, sw * _NOISE_SHARE))
+    xs = _span(ink.sum(axis=0), max(2, sh * _NOISE_SHARE))
+    if ys is None or xs is None:
+        return None
+
+    margin = max(sw, sh) * _MARGIN_SHARE + 1
+    x0 = max(0, int((xs[0] - margin) * factor))
+    y0 = max(0, int((ys[0] - margin) * factor))
+    x1 = min(w, int(math.ceil((xs[1] + margin) * factor)))
+    y1 = min(h, int(math.ceil((ys[1] + margin) * factor)))
+    if (x1 - x0) * (y1 - y0) > w * h * (1.0 - _min_saving()):
+        return None
+    return x0, y0, x1, y1
+
+
+def crop_info(box: Box, source_size: Tuple[int, int]) -> Dict[str, int]:
+    """processing_infoon talletettava rajaus: offset + koot rajatun kuvan mittakaavassa."""
+    x0, y0, x1, y1 = box
+    return {
+        "x": x0,
+        "y": y0,
+        "width": x1 - x0,
+        "height": y1 - y0,
+        "source_width": source_size[0],
+        "source_height": source_size[1],
+    }
+
+
+def crop_to_ink(img: Image.Image, mode: str = "sheet") -> Tuple[Image.Image, Optional[Dict[str, int]]]:
+    """Rajaa kuva musteen mukaan. Palauttaa (kuva, crop_info tai None)."""
+    if mode == "off":
+        return img, None
+    box = find_ink_bbox(img, mode)
+    if box is None:
+        return img, None
+    return img.crop(box), crop_info(box, img.size)
+
+
+def uncrop_point(x: float, y: float, crop: Optional[Dict[str, Any]], image_width: Optional[int] = None) -> Tuple[float, float]:
+    """
+    Muunna rajatun (ja mahdollisesti skaalatun) kuvan piste alkuperäisen
+    kuvan koordinaatteihin. image_width = kuvan leveys, josta piste on
+    (esim. GPT:n pienennetty variantti); None = rajauksen oma mittakaava.
+    """
+    if not crop:
+        return x, y
+    scale = crop["width"] / float(image_width) if image_width else 1.0
+    return crop["x"] + x * scale, crop["y"] + y * scale
+
+
+def uncrop_box(box, crop: Optional[Dict[str, Any]], image_width: Optional[int] = None) -> Tuple[float, float, float, float]:
+    """Kuten uncrop_point, laatikolle (x0, y0, x1, y1)."""
+    x0, y0 = uncrop_point(box[0], box[1], crop, image_width)
+    x1, y1 = uncrop_point(box[2], box[3], crop, image_width)
+    return x0, y0, x1, y1
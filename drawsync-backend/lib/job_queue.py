@@ -0,0 +1,487 @@
+# drawsync-backend/lib/job_queue.py
+"""
+Kestävä työjono analyyseille (POST /jobs/process -> GET /jobs/{id}).
+
+Pitkät GPT-kutsut pitivät HTTP-yhteyden auki koko analyysin ajan, ja
+hostingin proxyt katkaisivat ne. Nyt upload tallennetaan jonoon, vastaus
+palautuu heti job-id:llä ja workerit ajavat saman analyysiputken taustalla.
+
+- tila SQLite-tiedostossa (JOBS_DB, oletus JOBS_DIR/jobs.sqlite3); uploadit
+  JOBS_DIR/files -kansiossa, kunnes job on valmis. Railwayssa JOBS_DIR
+  kannattaa osoittaa pysyvälle volumelle.
+- worker varaa jobin atomisesti leasella (JOBS_LEASE_S) ja uusii sitä
+  ajon aikana. Jos prosessi kuolee (redeploy, OOM), lease vanhenee ja job
+  palaa jonoon; yrityksiä on enintään JOBS_MAX_ATTEMPTS.
+- hallittu sammutus: uusia jobeja ei varata, käynnissä olevia odotetaan
+  JOBS_DRAIN_S, keskeneräiset palautetaan jonoon heti (ei leasen odotusta).
+- JOBS_MODE=inprocess (oletus): JOBS_WORKERS workeria jokaisessa API-prosessissa.
+  JOBS_MODE=external: API vain jonottaa, workerit ajetaan erikseen
+  (python -m lib.job_worker). Molemmat voivat jakaa saman tietokannan.
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from lib.upload_spool import SpooledUpload
+
+log = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def _default_dir() -> str:
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    return os.path.join(root, "data", "jobs")
+
+
+def jobs_mode() -> str:
+    mode = os.getenv("JOBS_MODE", "inprocess").strip().lower()
+    return mode if mode in ("inprocess", "external") else "inprocess"
+
+
+# ---------------------------
+# Tallennus (SQLite)
+# ---------------------------
+
+class JobStore:
+    """
+    Jobien tila SQLitessä. Kaikki metodit ovat synkronisia ja nopeita;
+    async-puolelta ne ajetaan asyncio.to_thread:llä kuten result_cachessa.
+    """
+
+    def __init__(self, db_path: str, files_dir: str, lease_s: float = 60.0, max_attempts: int = 3, ttl_seconds: int = 0):
+        self.db_path = db_path
+        self.files_dir = files_dir
+        self.lease_s = lease_s
+        self.max_attempts = max(1, max_attempts)
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._ready = False
+        self._init_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "JobStore":
+        base = os.getenv("JOBS_DIR", "").strip() or _default_dir()
+        return cls(
+            db_path=os.getenv("JOBS_DB", "").strip() or os.path.join(base, "jobs.sqlite3"),
+            files_dir=os.path.join(base, "files"),
+            lease_s=max(5.0, _env_float("JOBS_LEASE_S", 60.0)),
+            max_attempts=_env_int("JOBS_MAX_ATTEMPTS", 3),
+            ttl_seconds=_env_int("JOBS_TTL_S", 7 * 24 * 3600),
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if not self._ready:
+                self._init_db()
+            # isolation_level=None: transaktiot hallitaan itse (BEGIN IMMEDIATE varauksessa)
+            conn = sqlite3.connect(self.db_path, timeout=10.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self) -> None:
+        with self._init_lock:
+            if self._ready:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            os.makedirs(self.files_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10.0)
+            try:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS jobs ("
+                    " id TEXT PRIMARY KEY,"
+                    " status TEXT NOT NULL,"
+                    " tenant TEXT NOT NULL,"
+                    " user_id TEXT,"
+                    " industry_type TEXT NOT NULL,"
+                    " ocr_backend TEXT,"
+                    " file_path TEXT,"
+                    " file_sha TEXT,"
+                    " file_size INTEGER,"
+                    " filename TEXT,"
+                    " content_type TEXT,"
+                    " result TEXT,"
+                    " error TEXT,"
+                    " error_status INTEGER,"
+                    " attempts INTEGER NOT NULL DEFAULT 0,"
+                    " worker TEXT,"
+                    " lease_until REAL,"
+                    " created_at REAL NOT NULL,"
+                    " started_at REAL,"
+                    " finished_at REAL)"
+                )
+                # Vanha tietokanta (ennen ocr_backendia): sarake lisätään, NULL = industryn oletus
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+                if "ocr_backend" not in columns:
+                    conn.execute("ALTER TABLE jobs ADD COLUMN ocr_backend TEXT")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+                conn.commit()
+            finally:
+                conn.close()
+            self._ready = True
+            log.info(f"Job store: {self.db_path}")
+
+    # --- jonotus ---
+
+    def submit(self, upload: SpooledUpload, itype: str, tenant: str, user_id: Optional[str] = None,
+               ocr_backend: Optional[str] = None) -> str:
+        """
+        Siirrä upload jonon kansioon ja lisää job. Upload-olion oma close()
+        ei enää löydä tiedostoa (siirretty), joten dependencyn siivous on harmiton.
+        """
+        self._conn()
+        job_id = uuid.uuid4().hex
+        suffix = os.path.splitext(upload.filename or "")[1][:10]
+        path = os.path.join(self.files_dir, job_id + suffix)
+        shutil.move(upload.path, path)  # sama levy -> rename, muuten kopio
+        try:
+            self._conn().execute(
+                "INSERT INTO jobs(id, status, tenant, user_id, industry_type, ocr_backend, file_path, file_sha,"
+                " file_size, filename, content_type, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, tenant, user_id, itype, ocr_backend, path, upload.sha256,
+                 upload.size, upload.filename, upload.content_type, time.time()),
+            )
+        except BaseException:
+            _unlink(path)
+            raise
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """
+        Varaa vanhin jonossa oleva job (tai job, jonka lease on vanhentunut).
+        BEGIN IMMEDIATE -> vain yksi prosessi kerrallaan valitsee ja päivittää.
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Kuolleen workerin jobit, joiden yritykset on käytetty -> failed
+            lost = conn.execute(
+                "SELECT id, file_path FROM jobs WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (RUNNING, now, self.max_attempts),
+            ).fetchall()
+            for row in lost:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, error_status = 500, file_path = NULL,"
+                    " lease_until = NULL, finished_at = ? WHERE id = ?",
+                    (FAILED, "Worker lost the job too many times", now, row["id"]),
+                )
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?)"
+                " ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, now),
+            ).fetchone()
+            if row is not None:
+                if row["status"] == RUNNING:
+                    log.warning(f"Job {row['id']} lease expired (worker {row['worker']}), re-claiming")
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1,"
+                    " started_at = ? WHERE id = ?",
+                    (RUNNING, worker, now + self.lease_s, now, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        for lost_row in lost:
+            _unlink(lost_row["file_path"])
+        if row is None:
+            return None
+        job = dict(row)
+        job.update(status=RUNNING, worker=worker, lease_until=now + self.lease_s,
+                   attempts=job["attempts"] + 1, started_at=now)
+        return job
+
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        """Uusi lease; False jos job ei ole enää tämän workerin (lease vanhentui ja joku muu otti)."""
+        cur = self._conn().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = ?",
+            (time.time() + self.lease_s, job_id, worker, RUNNING),
+        )
+        return cur.rowcount == 1
+
+    def complete(self, job_id: str, worker: str, result: Dict[str, Any]) -> None:
+        self._finish(job_id, worker, DONE, result=json.dumps(result, ensure_ascii=False))
+
+    def fail(self, job_id: str, worker: str, status_code: int, detail: str) -> None:
+        self._finish(job_id, worker, FAILED, error=str(detail), error_status=status_code)
+
+    def requeue(self, job_id: str, worker: str) -> None:
+        """Palauta keskeneräinen job jonoon (sammutus); yritystä ei lasketa."""
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL,"
+            " attempts = MAX(attempts - 1, 0) WHERE id = ? AND worker = ? AND status = ?",
+            (QUEUED, job_id, worker, RUNNING),
+        )
+
+    def _finish(self, job_id: str, worker: str, status: str, result: Optional[str] = None,
+                error: Optional[str] = None, error_status: Optional[int] = None) -> None:
+        conn = self._conn()
+        row = conn.execute("SELECT file_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        cur = conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, error_status = ?, file_path = NULL,"
+            " lease_until = NULL, finished_at = ? WHERE id = ? AND worker = ? AND status = ?",
+            (status, result, error, error_status, time.time(), job_id, worker, RUNNING),
+        )
+        if cur.rowcount != 1:
+            log.warning(f"Job {job_id} no longer owned by {worker}; result dropped")
+            return
+        if row is not None:
+            _unlink(row["file_path"])
+
+    # --- luku ---
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def queue_position(self, job: Dict[str, Any]) -> int:
+        """Montako jonossa olevaa jobia on tämän edellä (0 = seuraavana vuorossa)."""
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?",
+            (QUEUED, job["created_at"]),
+        ).fetchone()
+        return int(row[0])
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+    def purge(self) -> int:
+        """Poista vanhat valmiit/epäonnistuneet jobit (JOBS_TTL_S)."""
+        if not self.ttl_seconds:
+            return 0
+        cur = self._conn().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (DONE, FAILED, time.time() - self.ttl_seconds),
+        )
+        return cur.rowcount
+
+
+def _unlink(path: Optional[str]) -> None:
+    if not path:
+        return
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        log.warning(f"Could not remove job file {path}: {e}")
+
+
+def job_view(job: Dict[str, Any], position: Optional[int] = None) -> Dict[str, Any]:
+    """GET /jobs/{id} -vastaus: tila, aikaleimat ja valmiin jobin tulos/virhe."""
+    view: Dict[str, Any] = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "industry_type": job["industry_type"],
+        "filename": job["filename"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+    if position is not None:
+        view["queue_position"] = position
+    if job["status"] == DONE and job["result"]:
+        view["result"] = json.loads(job["result"])
+    if job["status"] == FAILED:
+        view["error"] = {"status": job["error_status"] or 500, "detail": job["error"]}
+    return view
+
+
+# ---------------------------
+# Workerit
+# ---------------------------
+
+async def run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Workerin runko: sama putki kuin /process-endpointissa."""
+    # Import tässä: putki tuo PyMuPDF:n, OCR:n ja OpenAI-clientin
+    from lib.analysis_pipeline import resolve_prompt, run_analysis
+
+    itype = job["industry_type"]
+    upload = SpooledUpload(job["file_path"], job["file_size"], job["file_sha"], job["filename"], job["content_type"])
+    return await run_analysis(upload, itype, resolve_prompt(itype), job["tenant"], ocr_backend=job.get("ocr_backend"))
+
+
+class JobWorkerPool:
+    """
+    N asyncio-workeria yhdessä prosessissa. Jokainen varaa jobin, ajaa sen
+    ja uusii leasea taustalla. stop() lopettaa varaamisen ja odottaa ajossa
+    olevia enintään drain_s, sitten peruu ja palauttaa ne jonoon.
+    """
+
+    def __init__(self, store: JobStore, workers: int, poll_s: float = 1.0, name: Optional[str] = None):
+        self.store = store
+        self.workers = max(1, workers)
+        self.poll_s = max(0.05, poll_s)
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+        self._wake: Optional[asyncio.Event] = None
+        self._running: Dict[str, float] = {}
+
+    @property
+    def started(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._loop(f"{self.name}/{i}"), name=f"job-worker-{i}")
+            for i in range(self.workers)
+        ]
+        log.info(f"Job workers started: {self.workers} ({self.name})")
+
+    def notify(self) -> None:
+        """Uusi job jonossa -> herätä odottavat workerit heti (saman prosessin submit)."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def stop(self, drain_s: float) -> None:
+        if not self._tasks:
+            return
+        self._stopping = True
+        self.notify()
+        busy = len(self._running)
+        if busy:
+            log.info(f"Draining {busy} running job(s), up to {drain_s:.0f}s")
+        _, pending = await asyncio.wait(self._tasks, timeout=drain_s)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+        log.info("Job workers stopped")
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "worker": self.name,
+            "workers": self.workers,
+            "running": {job_id: round(now - t, 1) for job_id, t in self._running.items()},
+            "stopping": self._stopping,
+        }
+
+    async def _loop(self, worker: str) -> None:
+        while not self._stopping:
+            try:
+                job = await asyncio.to_thread(self.store.claim, worker)
+            except sqlite3.Error as e:
+                log.warning(f"Job claim failed: {e}")
+                job = None
+            if job is None:
+                await self._idle()
+                continue
+            await self._run(worker, job)
+
+    async def _idle(self) -> None:
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=self.poll_s)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self, worker: str, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        log.info(f"Job {job_id} started by {worker} ({job['industry_type']}, attempt {job['attempts']})")
+        self._running[job_id] = time.monotonic()
+        work = asyncio.create_task(run_job(job))
+        beat = asyncio.create_task(self._heartbeat(job_id, worker, work))
+        try:
+            result = await work
+        except asyncio.CancelledError:
+            if not asyncio.current_task().cancelling():
+                return  # heartbeat perui: lease menetetty, job on jo toisella workerilla
+            work.cancel()
+            # Sammutus kesken ajon: takaisin jonoon seuraavalle prosessille
+            self.store.requeue(job_id, worker)
+            log.info(f"Job {job_id} re-queued on shutdown")
+            raise
+        except HTTPException as e:
+            await asyncio.to_thread(self.store.fail, job_id, worker, e.status_code, e.detail)
+            log.info(f"Job {job_id} failed: {e.status_code} {e.detail}")
+        except Exception:
+            log.exception(f"Job {job_id} crashed")
+            await asyncio.to_thread(self.store.fail, job_id, worker, 500, "Vision analysis failed")
+        else:
+            await asyncio.to_thread(self.store.complete, job_id, worker, result)
+            log.info(f"Job {job_id} done in {time.monotonic() - self._running[job_id]:.1f}s")
+        finally:
+            beat.cancel()
+            self._running.pop(job_id, None)
+
+    async def _heartbeat(self, job_id: str, worker: str, work: asyncio.Task) -> None:
+        interval = self.store.lease_s / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                owned = await asyncio.to_thread(self.store.heartbeat, job_id, worker)
+            except sqlite3.Error as e:
+                log.warning(f"Job {job_id} heartbeat failed: {e}")
+                continue
+            if not owned:
+                log.warning(f"Job {job_id} lease lost, abandoning")
+                work.cancel()
+                return
+
+
+job_store = JobStore.from_env()
+worker_pool = JobWorkerPool(
+    job_store,
+    workers=_env_int("JOBS_WORKERS", 2),
+    poll_s=_env_float("JOBS_POLL_S", 1.0),
+)
+
+
+async def start_workers() -> None:
+    """App startup: in-process -tilassa workerit käyntiin ja vanhat jobit siivotaan."""
+    if jobs_mode() != "inprocess" or _env_int("JOBS_WORKERS", 2) == 0:
+        return
+    purged = await asyncio.to_thread(job_store.purge)
+    if purged:
+        log.info(f"Purged {purged} old job(s)")
+    worker_pool.start()
+
+
+async def stop_workers() -> None:
+    await worker_pool.stop(_env_float("JOBS_DRAIN_S", 20.0))
+
+
+__all__ = [
+    "job_store", "worker_pool", "JobStore", "JobWorkerPool", "job_view", "jobs_mode",
+    "start_workers", "stop_workers", "QUEUED", "RUNNING", "DONE", "FAILED",
+]
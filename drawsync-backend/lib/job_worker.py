@@ -0,0 +1,56 @@
+# drawsync-backend/lib/job_worker.py
+"""
+Erillinen job-workeriprosessi (JOBS_MODE=external).
+
+Ajo backend-juuresta, esim. Railwayn omana palveluna samalla volumella:
+    python -m lib.job_worker [--workers 4]
+
+SIGTERM/SIGINT: uusia jobeja ei varata, käynnissä olevia odotetaan
+JOBS_DRAIN_S ja keskeneräiset palautetaan jonoon.
+"""
+from __future__ import annotations
+
+import os
+import signal
+import asyncio
+import logging
+import argparse
+import importlib
+
+log = logging.getLogger("job_worker")
+
+
+async def _serve(workers: int) -> None:
+    from lib.job_queue import job_store, stop_workers, worker_pool
+    from lib.concurrency import shutdown_pools
+    from lib.openai_client import aclose_clients
+
+    if workers:
+        worker_pool.workers = workers
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    await asyncio.to_thread(job_store.purge)
+    worker_pool.start()
+    await stop.wait()
+    log.info("Shutdown signal received, draining job workers")
+    await stop_workers()
+    shutdown_pools()
+    await aclose_clients()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=0, help="yhtäaikaiset jobit (oletus JOBS_WORKERS)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # main lataa .env:n ja Google-tunnukset importissa, ennen Vision-clientin importtia
+    importlib.import_module("main")
+    asyncio.run(_serve(args.workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# drawsync-backend/lib/memstats.py
+"""
+Muistimittarit: prosessin RSS nyt / huippu ja pyyntökohtainen RSS-näytteistys.
+
+Linuxissa luetaan /proc/self/statm (halpa), muualla käytetään
+resource.getrusage-arvoa.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import asyncio
+import resource
+from typing import Dict, Optional
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+MB = 1024 * 1024
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except Exception:
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    """Prosessin elinikäinen RSS-huippu (ru_maxrss: Linux KB, macOS tavuja)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def to_mb(value: int) -> float:
+    return round(value / MB, 1)
+
+
+class RssSampler:
+    """
+    Näytteistä prosessin RSS:ää taustalla pyynnön ajan.
+
+        async with RssSampler() as mem:
+            ...
+        processing_info["memory"] = mem.summary()
+
+    Huom: RSS on koko workerin, joten samanaikaiset pyynnöt näkyvät myös.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.start = 0
+        self.end = 0
+        self.peak = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            self.peak = max(self.peak, current_rss_bytes())
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self) -> "RssSampler":
+        self.start = self.peak = current_rss_bytes()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        if self._task:
+            self._task.cancel()
+        self.end = current_rss_bytes()
+        self.peak = max(self.peak, self.end)
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "rss_start_mb": to_mb(self.start),
+            "rss_end_mb": to_mb(self.end or current_rss_bytes()),
+            "rss_peak_mb": to_mb(self.peak),
+            "process_rss_peak_mb": to_mb(peak_rss_bytes()),
+        }
@@ -0,0 +1,183 @@
+# drawsync-backend/lib/model_cascade.py
+"""
+Mallikaskadi: nopea ja halvempi malli ensin, iso malli vain tarvittaessa.
+
+Kaikki piirustukset menivät OPENAI_MODEL:lle (gpt-5) riippumatta siitä, kuinka
+yksinkertainen piirustus oli. Industry-configin "model_cascade"-lohko määrää
+tasot järjestyksessä:
+
+    "model_cascade": {
+      "tiers": [
+        {"name": "fast",  "model": "gpt-5-mini", "model_env": "OPENAI_FAST_MODEL"},
+        {"name": "large", "model_env": "OPENAI_MODEL"}
+      ],
+      "min_confidence": 0.7
+    }
+
+Tason malli: ympäristömuuttuja model_env, sitten model, lopuksi OPENAI_MODEL.
+Jokaisen tason tulos arvioidaan (assess_result): virhevastaus,
+validate_and_enhance_resultin validation_error ja rakenteesta kokonaan puuttuva
+pakollinen kenttä hylkäävät tuloksen. Pakollinen kenttä, joka on mukana mutta
+tyhjä (monesta piirustuksesta tieto oikeasti puuttuu), mallin oma
+"matala"-varmuus ja pinta-alan ristiriita vain laskevat luottamusta.
+Hylätty tai alle min_confidence -> seuraava taso. Viimeisen tason tulos
+palautetaan aina.
+
+Kaskadi on valinnainen (eskalointi maksaa kaksi kutsua peräkkäin):
+  OPENAI_CASCADE=1          päälle kaikille tenanteille
+  OPENAI_CASCADE_TENANTS    pilkuilla eroteltu tenant-lista ("org:acme,org:beta")
+Muuten, tai ilman lohkoa, käytetään vain OPENAI_MODEL:ia kuten ennen.
+Endpointin "model" (OPENAI_ENDPOINTS) yliajaisi jokaisen tason mallin, joten
+kiinnitetyn mallin kanssa kaskadi ohitetaan (varoitus lokiin kerran).
+"""
+from __future__ import annotations
+
+import os
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from lib.industry_config import get_cascade_config
+from lib.industry_manager import industry_manager
+from lib.gpt_utils import OPENAI_MODEL
+from lib.openai_scheduler import scheduler
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MIN_CONFIDENCE = 0.7
+# Luottamuksen vähennykset mallin omista varmuusarvioista ja validoinnin huomioista
+LOW_CERTAINTY_PENALTY = 0.35
+MEDIUM_CERTAINTY_PENALTY = 0.1
+AREA_MISMATCH_PENALTY = 0.3
+EMPTY_FIELD_PENALTY = 0.1
+
+_pinned_warned = False
+
+
+def _enabled(tenant: Optional[str]) -> bool:
+    if os.getenv("OPENAI_CASCADE", "0").strip() == "1":
+        return True
+    tenants = {t.strip() for t in os.getenv("OPENAI_CASCADE_TENANTS", "").split(",") if t.strip()}
+    return tenant is not None and tenant in tenants
+
+
+def _pinned_model() -> Optional[str]:
+    """Endpointin kiinnittämä malli (ensimmäinen), joka tekisi tasoista samoja."""
+    global _pinned_warned
+    pinned = next((e for e in scheduler.pool.endpoints if e.model), None)
+    if pinned is None:
+        return None
+    if not _pinned_warned:
+        _pinned_warned = True
+        log.warning(f"Model cascade skipped: endpoint {pinned.name} pins model {pinned.model}")
+    return pinned.model
+
+
+def _tier_model(tier: Dict[str, Any]) -> str:
+    env_name = (tier.get("model_env") or "").strip()
+    return (os.getenv(env_name, "").strip() if env_name else "") or (tier.get("model") or "").strip() or OPENAI_MODEL
+
+
+def cascade_for(itype: str, tenant: Optional[str] = None) -> Tuple[List[Dict[str, str]], float]:
+    """([{"name", "model"}, ...], min_confidence). Aina vähintään yksi taso."""
+    cfg = get_cascade_config(itype) if _enabled(tenant) else {}
+    if cfg and _pinned_model():
+        cfg = {}
+    tiers = []
+    for i, tier in enumerate(cfg.get("tiers") or []):
+        if isinstance(tier, dict):
+            tiers.append({"name": str(tier.get("name") or f"tier{i + 1}"), "model": _tier_model(tier)})
+    if not tiers:
+        return [{"name": "default", "model": OPENAI_MODEL}], 0.0
+    try:
+        min_confidence = float(cfg.get("min_confidence", DEFAULT_MIN_CONFIDENCE))
+    except (TypeError, ValueError):
+        min_confidence = DEFAULT_MIN_CONFIDENCE
+    return tiers, min_confidence
+
+
+def cascade_signature(itype: str, tenant: Optional[str] = None) -> str:
+    """Tulosvälimuistin avaimeen: eri kaskadi -> eri tulos."""
+    tiers, min_confidence = cascade_for(itype, tenant)
+    return "cascade=" + ">".join(f"{t['name']}:{t['model']}" for t in tiers) + f"@{min_confidence}"
+
+
+# ---------------------------
+# Tuloksen arviointi
+# ---------------------------
+
+_ABSENT = object()
+
+
+def _lookup(data: Any, path: str) -> Any:
+    """Arvo pisteillä erotetusta polusta; _ABSENT, jos jokin avain puuttuu rakenteesta."""
+    for key in path.split("."):
+        if not isinstance(data, dict) or key not in data:
+            return _ABSENT
+        data = data[key]
+    return data
+
+
+def _is_blank(value: Any) -> bool:
+    if isinstance(value, str):
+        return not value.strip()
+    return value is None or (isinstance(value, (list, dict)) and not value)
+
+
+def _certainty_values(data: Any) -> List[str]:
+    """Mallin omat varmuusarviot ("varmuus", "pituus_varmuus", ...) koko rakenteesta."""
+    found = []
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if isinstance(value, str) and key.endswith("varmuus"):
+                    found.append(value.strip().lower())
+                elif isinstance(value, (dict, list)):
+                    stack.append(value)
+        elif isinstance(node, list):
+            stack.extend(node)
+    return found
+
+
+def assess_result(result: Any, itype: str) -> Tuple[float, List[str], bool]:
+    """
+    (luottamus 0..1, syyt, hylätty). hylätty=True: virhe tai rakenteesta
+    puuttuva pakollinen kenttä -> eskaloidaan luottamuksesta riippumatta.
+    Tyhjä pakollinen kenttä ("empty:...") laskee luottamusta EMPTY_FIELD_PENALTY.
+    """
+    if not isinstance(result, dict):
+        return 0.0, ["not_an_object"], True
+    if result.get("success") is False or "error" in result:
+        return 0.0, ["error"], True
+
+    reasons: List[str] = []
+    if result.get("validation_error"):
+        reasons.append("validation_error")
+    empty: List[str] = []
+    try:
+        required = industry_manager.get_validation_config(itype).get("required_fields", [])
+    except Exception as e:
+        log.warning(f"Validation config lookup failed: {e}")
+        required = []
+    for field in required:
+        value = _lookup(result, field)
+        if value is _ABSENT:
+            reasons.append(f"missing:{field}")
+        elif _is_blank(value):
+            empty.append(f"empty:{field}")
+    if reasons:
+        return 0.0, reasons, True
+
+    reasons += empty
+    confidence = 1.0 - EMPTY_FIELD_PENALTY * len(empty)
+    for value in _certainty_values(result):
+        if value.startswith("matala"):
+            confidence -= LOW_CERTAINTY_PENALTY
+            reasons.append("low_certainty")
+        elif value.startswith("keski"):
+            confidence -= MEDIUM_CERTAINTY_PENALTY
+    if any(isinstance(h, str) and h.startswith("Pinta-ala-ero") for h in result.get("huomiot") or []):
+        confidence -= AREA_MISMATCH_PENALTY
+        reasons.append("surface_area_mismatch")
+    return round(max(0.0, confidence), 2), sorted(set(reasons)), False
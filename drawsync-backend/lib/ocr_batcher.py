@@ -0,0 +1,173 @@
+# drawsync-backend/lib/ocr_batcher.py
+"""
+Vision-OCR:n mikroerät: samanaikaiset OCR-pyynnöt yhdeksi batch_annotate_images-kutsuksi.
+
+Jokainen steel-sivu teki oman Vision-kutsunsa, vaikka batch_annotate_images
+ottaa useita kuvia kerralla. Erä-ajossa ja ruuhkassa kymmenet sivut odottavat
+OCR:ää samaan aikaan, ja jokainen maksaa oman kiertoajan ja API-kutsun.
+
+OcrBatcher kerää pyyntöjä lyhyen ikkunan ajan ja lähettää ne yhtenä kutsuna:
+- ikkuna alkaa ensimmäisestä odottavasta kuvasta (VISION_BATCH_WINDOW_MS,
+  oletus 20 ms) -> lisäviive on enintään ikkunan pituus
+- erä lähtee heti, kun siinä on VISION_BATCH_MAX_IMAGES kuvaa (oletus ja
+  Visionin yläraja 16) tai VISION_BATCH_MAX_MB megatavua (oletus 8; Visionin
+  pyyntökoon raja on 10 MB). Rajan ylittävä yksittäinen kuva lähtee yksin.
+- vastaukset jaetaan takaisin odottajille järjestyksessä; kuvakohtainen virhe
+  (response.error) koskee vain omaa kuvaansa, koko kutsun virhe kaikkia erän kuvia
+- peruttu odottaja jätetään pois erästä, jos erää ei ole vielä lähetetty
+
+VISION_BATCH_WINDOW_MS=0 ohittaa keräämisen (yksi kuva per kutsu kuten ennen).
+Batcher on sidottu event looppiin; ocr_utils pitää sen loopin Vision-clientin rinnalla.
+"""
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+MAX_IMAGES_PER_CALL = 16  # Vision API:n raja batch_annotate_images-kutsulle
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def batch_settings() -> Dict[str, Any]:
+    return {
+        "window_s": _env_float("VISION_BATCH_WINDOW_MS", 20.0) / 1000.0,
+        "max_images": min(MAX_IMAGES_PER_CALL, max(1, _env_int("VISION_BATCH_MAX_IMAGES", MAX_IMAGES_PER_CALL))),
+        "max_bytes": int(_env_float("VISION_BATCH_MAX_MB", 8.0) * 1024 * 1024),
+    }
+
+
+# Lähetys: pyynnöt -> vastaukset samassa järjestyksessä
+Send = Callable[[List[Any]], Awaitable[List[Any]]]
+
+_stats: Dict[str, Any] = {
+    "calls": 0,
+    "images": 0,
+    "max_batch": 0,
+    "flush": {"window": 0, "images": 0, "bytes": 0, "close": 0},
+    "dropped_cancelled": 0,
+    "wait_ms_max": 0.0,
+}
+
+
+def batch_stats() -> Dict[str, Any]:
+    """Kutsujen ja kuvien määrä, keskimääräinen erä ja säästetyt API-kutsut."""
+    calls, images = _stats["calls"], _stats["images"]
+    return {
+        **batch_settings(),
+        "calls": calls,
+        "images": images,
+        "avg_batch": round(images / calls, 2) if calls else None,
+        "max_batch": _stats["max_batch"],
+        "calls_saved": images - calls,
+        "flush": dict(_stats["flush"]),
+        "dropped_cancelled": _stats["dropped_cancelled"],
+        "wait_ms_max": _stats["wait_ms_max"],
+    }
+
+
+class OcrBatcher:
+    """Yhden event loopin OCR-pyyntöjen kerääjä (ks. moduulin docstring)."""
+
+    def __init__(self, send: Send, window_s: float, max_images: int, max_bytes: int):
+        self._send = send
+        self.window_s = window_s
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        # (pyyntö, future, jonoon tuloaika)
+        self._pending: List[Tuple[Any, asyncio.Future, float]] = []
+        self._pending_bytes = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    @classmethod
+    def from_env(cls, send: Send) -> "OcrBatcher":
+        return cls(send, **batch_settings())
+
+    async def annotate(self, request: Any, size: int) -> Any:
+        """Yhden kuvan AnnotateImageResponse; odottaa enintään ikkunan verran erää."""
+        if self.window_s <= 0 or self.max_images <= 1:
+            _stats["calls"] += 1
+            _stats["images"] += 1
+            _stats["max_batch"] = max(_stats["max_batch"], 1)
+            return (await self._send([request]))[0]
+
+        loop = asyncio.get_running_loop()
+        if self._pending and self._pending_bytes + size > self.max_bytes:
+            self._flush("bytes")
+        future = loop.create_future()
+        self._pending.append((request, future, time.perf_counter()))
+        self._pending_bytes += size
+        if len(self._pending) >= self.max_images:
+            self._flush("images")
+        elif self._pending_bytes >= self.max_bytes:
+            self._flush("bytes")
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_s, self._flush, "window")
+        return await future
+
+    def _flush(self, reason: str) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending, self._pending_bytes = self._pending, [], 0
+        batch = [item for item in pending if not item[1].done()]
+        _stats["dropped_cancelled"] += len(pending) - len(batch)
+        if not batch:
+            return
+        _stats["flush"][reason] += 1
+        task = asyncio.get_running_loop().create_task(self._dispatch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch: List[Tuple[Any, asyncio.Future, float]]) -> None:
+        sent = time.perf_counter()
+        _stats["calls"] += 1
+        _stats["images"] += len(batch)
+        _stats["max_batch"] = max(_stats["max_batch"], len(batch))
+        _stats["wait_ms_max"] = max(_stats["wait_ms_max"], round((sent - batch[0][2]) * 1000, 1))
+        try:
+            responses = await self._send([request for request, _, _ in batch])
+        except asyncio.CancelledError:
+            for _, future, _ in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            log.warning(f"Vision batch of {len(batch)} failed: {type(e).__name__}: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        if len(responses) != len(batch):
+            log.error(f"Vision batch returned {len(responses)} responses for {len(batch)} images")
+        for i, (_, future, _) in enumerate(batch):
+            if future.done():
+                continue
+            if i < len(responses):
+                future.set_result(responses[i])
+            else:
+                future.set_exception(RuntimeError("Vision API error: missing response in batch"))
+
+    async def aclose(self) -> None:
+        """Lähetä odottavat pyynnöt ja odota keskeneräiset erät (shutdown)."""
+        if self._pending:
+            self._flush("close")
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
@@ -1,25 +1,191 @@
 # lib/ocr_image_prep.py
 import io
-from PIL import Image
+import os
+import math
+import logging
+from typing import Optional
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from lib.ink_crop import crop_to_ink
+
+log = logging.getLogger(__name__)
 
 def normalize_for_vision(
     image_bytes: bytes,
     max_long_side: int = 10_000,
     max_bytes: int = 18 * 1024 * 1024,
-    prefer_png: bool = True
+    prefer_png: bool = True,
+    crop: str = "off",
 ) -> bytes:
     """
     Varmista Google Vision -yhteensopiva kuva:
     - Muunna RGB/L (poista alfa/CMYK/erikoistilat)
+    - Rajaa tyhjät marginaalit (crop="sheet"/"content", ks. lib.ink_crop)
     - Skaalaa jos pitkä sivu > max_long_side
     - Re-enkoodaa PNG:ksi (tai tarvittaessa JPEG:ksi)
     - Pidä koko alle max_bytes
 
     Palauttaa uudet kuva-bytet.
     """
-    img = Image.open(io.BytesIO(image_bytes))
-    img.load()  # varmista, ettei jää laiskaan tilaan
+    img = decode_image(image_bytes, max_long_side)
+    img, _ = crop_to_ink(img, crop)
+
+    return encode_for_vision(img, max_long_side, max_bytes, prefer_png)
+
+# Kameran JPEG-kuvat: OCR-kuvan pitkä sivu (12–48 MP kuvia ei dekoodata täysikokoisina)
+DEFAULT_PHOTO_OCR_LONG_SIDE = 4000
+
+def photo_ocr_long_side() -> int:
+    try:
+        return max(512, int(os.getenv("PHOTO_OCR_MAX_LONG_SIDE", str(DEFAULT_PHOTO_OCR_LONG_SIDE))))
+    except ValueError:
+        return DEFAULT_PHOTO_OCR_LONG_SIDE
+
+def _open_image(source) -> Image.Image:
+    # source = tavut tai polku (levylle spoolattu upload): polusta PIL lukee tiedostoa suoraan
+    return Image.open(source if isinstance(source, str) else io.BytesIO(source))
+
+def decode_image(source, target_long_side: Optional[int] = None) -> Image.Image:
+    """
+    Dekoodaa kuva (tavut tai polku) kerran.
+
+    JPEG: draft() pyytää libjpegiltä DCT-skaalatun dekoodauksen (1/2, 1/4, 1/8)
+    lähimpään kokoon, joka on vähintään target_long_side – 48 MP kuvaa ei
+    pureta täysikokoisena vain skaalattavaksi heti alas. Loppu skaalataan
+    LANCZOSilla target_long_side-kokoon.
+
+    EXIF-orientaatio käännetään kerran ja vasta skaalauksen jälkeen (pienempi
+    kopio), joten puhelinkuvat ovat oikein päin.
+    Virheellinen kuva -> PIL:n poikkeus (kutsuja muuntaa 400-virheeksi).
+    """
+    img = _open_image(source)
+    scale = 1.0
+    if target_long_side:
+        scale = target_long_side / float(max(img.size))
+    if scale < 1.0 and img.format == "JPEG":
+        img.draft("RGB", (math.ceil(img.size[0] * scale), math.ceil(img.size[1] * scale)))
+    img.load()
+    if target_long_side and max(img.size) > target_long_side:
+        scale = target_long_side / float(max(img.size))
+        img = img.resize((max(int(img.size[0] * scale), 1), max(int(img.size[1] * scale), 1)), Image.LANCZOS)
+    ImageOps.exif_transpose(img, in_place=True)
+    return img
+
+# Enkooderin rajat: koko arvioidaan ensin pienennetystä koeversiosta (probe),
+# täysiä enkoodauksia tehdään enintään _MAX_FULL_ENCODES (+ skaalausvarmistus)
+_PROBE_PIXELS = 1_000_000
+_MAX_FULL_ENCODES = 3
+_JPEG_Q_MAX = 92
+_JPEG_Q_MIN = 60
+# Skaalausvarmistus: kuvaa pienennetään, kunnes se mahtuu, mutta lyhyt sivu
+# ei mene alle _SHRINK_MIN_SIDE px (ja joka kierros pienentää vähintään 10 %)
+_SHRINK_MIN_SIDE = 256
+_SHRINK_MAX_STEP = 0.9
+
+# Viivapiirustustila: mustavalkoinen (1-bit) tai pieni paletti (P) PNG
+LINE_ART_MODES = ("off", "auto")
+_LINE_ART_PROBE_PIXELS = 250_000
+_LINE_ART_MIN_SHARE = 0.97      # osuus pikseleistä, jonka on oltava "puhtaita" (reunojen antialiasointi sallitaan)
+_LINE_ART_MAX_CHROMA = 0.002    # yli tämän osuuden värillisiä pikseleitä -> värit säilytetään (punakynä, värikoodit)
+_LINE_ART_THRESHOLD = 176       # L-arvo, jota tummemmat -> musta
+_PALETTE_COLORS = 16
+
+def line_art_mode(value: Optional[str] = None) -> str:
+    """Konfiguraation arvo (tai VISION_LINE_ART, oletus "off") -> "off" | "auto"."""
+    value = (value or os.getenv("VISION_LINE_ART", "off")).strip().lower()
+    return value if value in LINE_ART_MODES else "off"
+
+def detect_line_art(img: Image.Image) -> Optional[str]:
+    """
+    Tunnista vähävärinen viivagrafiikka halvalla histogrammilla pienestä
+    näytteestä (NEAREST, jotta viivojen reunat eivät sumene harmaaksi).
+
+    Palauttaa "1" (mustavalkoinen), "P" (muutama väri) tai None (valokuva /
+    värikäs kuva -> normaali RGB-polku).
+    """
+    w, h = img.size
+    area = w * h
+    if area > _LINE_ART_PROBE_PIXELS:
+        shrink = math.sqrt(_LINE_ART_PROBE_PIXELS / area)
+        img = img.resize((max(int(w * shrink), 1), max(int(h * shrink), 1)), Image.NEAREST)
+    rgb = np.asarray(img.convert("RGB"), dtype=np.int16)
+
+    chroma = rgb.max(axis=2) - rgb.min(axis=2)
+    if (chroma > 48).mean() <= _LINE_ART_MAX_CHROMA:
+        # Harmaasävy: riittääkö pelkkä musta + valkoinen?
+        gray = rgb.mean(axis=2).astype(np.uint8)
+        hist = np.bincount(gray.ravel(), minlength=256)
+        extremes = (hist[:96].sum() + hist[200:].sum()) / float(hist.sum())
+        return "1" if extremes >= _LINE_ART_MIN_SHARE else None
+
+    # Värillinen: kattavatko muutamat (4-bit kvantisoidut) värit lähes kaiken?
+    q = rgb >> 4
+    keys = (q[..., 0] << 8) | (q[..., 1] << 4) | q[..., 2]
+    counts = np.bincount(keys.ravel(), minlength=4096)
+    top = np.sort(counts)[::-1][:_PALETTE_COLORS].sum() / float(counts.sum())
+    return "P" if top >= _LINE_ART_MIN_SHARE else None
+
+def to_line_art(img: Image.Image, kind: str) -> Image.Image:
+    """kind "1" -> kynnystetty mustavalkoinen, "P" -> 16 värin paletti ilman ditheröintiä."""
+    if kind == "1":
+        lut = [0 if v < _LINE_ART_THRESHOLD else 255 for v in range(256)]
+        return img.convert("L").point(lut, "1")
+    return img.convert("RGB").quantize(
+        colors=_PALETTE_COLORS, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE
+    )
+
+def _save(img: Image.Image, fmt: str, quality: int | None = None) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "PNG":
+        img.save(buf, format="PNG", optimize=True)
+    else:
+        img.save(buf, format="JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+def encode_for_vision(
+    img: Image.Image,
+    max_long_side: int = 10_000,
+    max_bytes: int = 18 * 1024 * 1024,
+    prefer_png: bool = True,
+    line_art: str = "off",
+) -> bytes:
+    """
+    Sama kuin normalize_for_vision, mutta valmiiksi dekoodatulle PIL-kuvalle.
+
+    PDF-polku antaa tänne suoraan PyMuPDF:n pikselipuskurin (ilman
+    välivaiheen PNG-enkoodausta ja -dekoodausta), joten kuva enkoodataan
+    vain kerran.
+    """
+    return encode_for_vision_ex(img, max_long_side, max_bytes, prefer_png, line_art)[0]
+
+def encode_for_vision_ex(
+    img: Image.Image,
+    max_long_side: int = 10_000,
+    max_bytes: int = 18 * 1024 * 1024,
+    prefer_png: bool = True,
+    line_art: str = "off",
+    allow_bilevel: bool = True,
+) -> tuple:
+    """
+    encode_for_vision + enkoodaustilasto.
 
+    Koko arvioidaan pienennetystä probesta (~1 MP): PNG:n täysi enkoodaus
+    tehdään vain, jos arvio mahtuu rajaan, ja JPEG-laatu haetaan
+    binäärihaulla probella ennen täysiä enkoodauksia. Täysiä enkoodauksia
+    on enintään _MAX_FULL_ENCODES; jos laatu 60 ei vielä riitä, kuvaa
+    skaalataan alas, kunnes se mahtuu max_bytes-rajaan tai lyhyt sivu on
+    _SHRINK_MIN_SIDE px (silloin palautetaan pienin versio ja varoitetaan).
+
+    line_art="auto": viivapiirustus tallennetaan 1-bit- tai palettikuvana
+    (tyypillisesti 5–10x pienempi PNG), muut kuvat RGB-polkua.
+    allow_bilevel=False käyttää mustavalkoisellekin palettia, jotta alas
+    skaalatun kuvan ohuet (harmaiksi sulaneet) viivat eivät katoa kynnystyksessä.
+
+    Palauttaa (data, stats), stats = {"format", "quality", "scale",
+    "encode_passes", "probe_passes", "line_art", "bytes"}.
+    """
     # Muunto RGB/L
     if img.mode not in ("RGB", "L"):
         img = img.convert("RGB")
@@ -32,26 +198,179 @@ def normalize_for_vision(
         new_size = (max(int(w * scale), 1), max(int(h * scale), 1))
         img = img.resize(new_size, Image.LANCZOS)
 
-    # Ensin PNG
-    buf = io.BytesIO()
+    stats = {"format": "PNG", "quality": None, "scale": 1.0, "encode_passes": 0, "probe_passes": 0, "line_art": None}
+
+    def full(fmt: str, quality: int | None = None) -> bytes:
+        stats["encode_passes"] += 1
+        return _save(img, fmt, quality)
+
+    def done(data: bytes, fmt: str, quality: int | None = None) -> tuple:
+        stats.update({"format": fmt, "quality": quality, "bytes": len(data)})
+        return data, stats
+
+    # Viivapiirustus: 1-bit/paletti-PNG, jos se mahtuu (JPEG-varapolku käyttää alkuperäistä)
+    if prefer_png and line_art == "auto":
+        kind = detect_line_art(img)
+        if kind == "1" and not allow_bilevel:
+            kind = "P"
+        if kind:
+            stats["encode_passes"] += 1
+            data = _save(to_line_art(img, kind), "PNG")
+            if len(data) <= max_bytes:
+                stats["line_art"] = kind
+                return done(data, "PNG")
+
+    # Probe: pienennetty kopio, jonka koosta ekstrapoloidaan täysi koko
+    area = img.size[0] * img.size[1]
+    probe = None
+    if area > _PROBE_PIXELS:
+        factor = math.ceil(math.sqrt(area / _PROBE_PIXELS))
+        probe = img.reduce(factor)
+        probe_ratio = area / float(probe.size[0] * probe.size[1])
+
+    def estimate(fmt: str, quality: int | None = None) -> float:
+        stats["probe_passes"] += 1
+        return len(_save(probe, fmt, quality)) * probe_ratio
+
+    # Ensin PNG (häviötön), jos arvio mahtuu – arvio on karkea, joten pieni marginaali.
+    # Jos pakkaamaton pikselidata mahtuu jo rajaan, PNG mahtuu varmasti: ei probea.
+    raw_bytes = area * len(img.getbands())
     if prefer_png:
-        img.save(buf, format="PNG", optimize=True)
-        data = buf.getvalue()
-        # Jos liian iso, tiputa JPEG:ksi
-        if len(data) > max_bytes:
-            buf = io.BytesIO()
-            img.save(buf, format="JPEG", quality=92, optimize=True)
-            data = buf.getvalue()
+        if probe is None or raw_bytes <= max_bytes or estimate("PNG") <= max_bytes * 1.25:
+            data = full("PNG")
+            if len(data) <= max_bytes:
+                return done(data, "PNG")
+
+    # JPEG: suurin laatu, jonka arvio mahtuu rajaan (binäärihaku probella)
+    quality = _JPEG_Q_MAX
+    if probe is not None:
+        lo, hi, quality = _JPEG_Q_MIN, _JPEG_Q_MAX, _JPEG_Q_MIN
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if estimate("JPEG", mid) <= max_bytes * 0.95:
+                quality, lo = mid, mid + 1
+            else:
+                hi = mid - 1
+
+    # Täydet enkoodaukset: binäärihaku [Q_MIN, quality], enintään _MAX_FULL_ENCODES
+    lo, hi = _JPEG_Q_MIN, quality
+    best = None
+    smallest = None
+    while lo <= hi and stats["encode_passes"] < _MAX_FULL_ENCODES:
+        mid = hi if best is None and smallest is None else (lo + hi + 1) // 2
+        data = full("JPEG", mid)
+        if len(data) <= max_bytes:
+            best = (data, mid)
+            lo = mid + 1
+            # Ensimmäinen (suurin) laatu mahtui -> parempaa ei ole haettavissa
+            if mid == quality:
+                break
+        else:
+            smallest = (data, mid)
+            hi = mid - 1
+    if best is not None:
+        return done(best[0], "JPEG", best[1])
+
+    # Laatu ei riitä: skaalaa alas viimeisimmän koon perusteella, kunnes mahtuu.
+    # Tavut per pikseli voivat kasvaa pienennettäessä (hienojakoinen kohina),
+    # joten yksi arvioitu skaalaus ei aina riitä.
+    if smallest is None:
+        smallest = (full("JPEG", _JPEG_Q_MIN), _JPEG_Q_MIN)
+    data, last_q = smallest
+    source, scale = img, 1.0
+    while len(data) > max_bytes:
+        short_side = min(source.size) * scale
+        if short_side <= _SHRINK_MIN_SIDE:
+            log.warning(f"JPEG still {len(data)} B > {max_bytes} B at {img.size[0]}x{img.size[1]}; returning smallest")
+            break
+        shrink = min(_SHRINK_MAX_STEP, math.sqrt(max_bytes * 0.9 / len(data)))
+        scale = max(scale * shrink, _SHRINK_MIN_SIDE / float(min(source.size)))
+        new_size = (max(int(source.size[0] * scale), 1), max(int(source.size[1] * scale), 1))
+        img = source.resize(new_size, Image.LANCZOS)
+        data = full("JPEG", last_q)
+    stats["scale"] = round(scale, 3)
+    return done(data, "JPEG", last_q)
+
+def fit_scale(width: int, height: int, max_long_side: int, max_short_side: int) -> float:
+    """Skaalauskerroin (<= 1), jolla kuva mahtuu pitkän ja lyhyen sivun rajoihin."""
+    long_side, short_side = max(width, height), min(width, height)
+    if long_side <= 0 or short_side <= 0:
+        return 1.0
+    return min(1.0, max_long_side / float(long_side), max_short_side / float(short_side))
+
+def vision_variant(img: Image.Image, limits: tuple, line_art: str = "off") -> tuple:
+    """
+    GPT-visionille menevä kuva: skaalattu mallin efektiiviseen resoluutioon
+    (vision_image_limits), jotta ylimääräisiä pikseleitä ei ladata turhaan.
+    Palauttaa (data, enkoodaustilasto).
+    """
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    w, h = img.size
+    scale = fit_scale(w, h, limits[0], limits[1])
+    if scale < 1.0:
+        img = img.resize((max(int(w * scale), 1), max(int(h * scale), 1)), Image.LANCZOS)
+    return encode_for_vision_ex(img, line_art=line_art, allow_bilevel=False)
+
+def _decode_target(source, need_ocr: bool, vision_limits: tuple | None, crop: str) -> Optional[int]:
+    """
+    Pitkä sivu, johon JPEG kannattaa dekoodata (None = täysi koko).
+    Lukee vain otsakkeen; PNG:t ym. (skannit, exportit) dekoodataan aina täysinä.
+    """
+    try:
+        head = _open_image(source)
+    except Exception:
+        return None
+    if head.format != "JPEG":
+        return None
+    w, h = head.size
+    if need_ocr:
+        target = photo_ocr_long_side()
+    elif vision_limits:
+        target = math.ceil(max(w, h) * fit_scale(w, h, vision_limits[0], vision_limits[1]))
     else:
-        img.save(buf, format="JPEG", quality=92, optimize=True)
-        data = buf.getvalue()
+        return None
+    if crop != "off":
+        target *= 2  # rajaus voi jättää vain osan arkista -> varaa resoluutiota
+    return target if target < max(w, h) else None
 
-    # Viimeinen varmistus: jos vielä iso, pienennä laatua portaittain
-    quality = 85
-    while len(data) > max_bytes and quality >= 60:
-        buf = io.BytesIO()
-        img.save(buf, format="JPEG", quality=quality, optimize=True)
-        data = buf.getvalue()
-        quality -= 5
+def prepare_image_variants(
+    source,
+    need_ocr: bool,
+    vision_limits: tuple | None,
+    line_art: str = "off",
+    crop: str = "off",
+) -> dict:
+    """
+    Dekoodaa kuva (tavut tai polku) kerran ja tuota kuluttajakohtaiset variantit:
+      - "ocr_image":    täysi resoluutio Google Visionille (vain jos need_ocr)
+      - "vision_image": mallin resoluutioon skaalattu kuva GPT:lle
+    vision_limits=None -> GPT saa saman täyden resoluution kuvan kuin ennenkin.
+    Tyhjät marginaalit rajataan ensin (crop); render["crop"] kertoo offsetin.
+
+    Kameran JPEG dekoodataan suoraan lähelle tarvittavaa kokoa (decode_image):
+    OCR:lle PHOTO_OCR_MAX_LONG_SIDE, pelkälle GPT:lle mallin kuvan koko.
+    """
+    img = decode_image(source, _decode_target(source, need_ocr, vision_limits, crop))
+    img, crop_box = crop_to_ink(img, crop)
 
-    return data
+    render = {"width": img.size[0], "height": img.size[1]}
+    if crop_box:
+        render["crop"] = crop_box
+    ocr_image = None
+    if need_ocr:
+        ocr_image, render["encode"] = encode_for_vision_ex(img, line_art=line_art)
+    if vision_limits:
+        vision_image, encode = vision_variant(img, vision_limits, line_art)
+        scale = fit_scale(img.size[0], img.size[1], vision_limits[0], vision_limits[1])
+        render["vision"] = {
+            "width": max(int(img.size[0] * scale), 1),
+            "height": max(int(img.size[1] * scale), 1),
+            "bytes": len(vision_image),
+            "encode": encode,
+        }
+    elif ocr_image is not None:
+        vision_image = ocr_image
+    else:
+        vision_image, render["encode"] = encode_for_vision_ex(img, line_art=line_art)
+    return {"ocr_image": ocr_image, "vision_image": vision_image, "render": render}
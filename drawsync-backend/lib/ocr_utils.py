@@ -1,17 +1,201 @@
 # lib/ocr_utils.py
+"""
+Google Vision OCR (DOCUMENT_TEXT_DETECTION).
+
+Clientit ovat prosessin yhteisiä ja luodaan laiskasti: uusi
+ImageAnnotatorClient jokaisella kutsulla toisti tunnusten latauksen, gRPC-kanavan
+ja TLS-kättelyn jokaisella steel-uploadilla.
+- synkroninen client: yksi per prosessi (lukko), luodaan uudelleen forkin jälkeen
+  (gRPC-kanava ei kestä forkkia; PID-tarkistus + os.register_at_fork)
+- async-client: yksi per event loop (grpc.aio-kanava on sidottu looppiin)
+- warm_vision_clients() app startupissa: client + kanavan yhteys valmiiksi
+  (VISION_WARMUP=0 ohittaa)
+- ocr_stats(): kylmien (uusi client) ja lämpimien kutsujen latenssit (/metrics/ocr)
+- async-kutsut kulkevat loopin OcrBatcherin kautta (lib/ocr_batcher.py):
+  samanaikaiset kuvat lähtevät yhtenä batch_annotate_images-kutsuna
+
+OCR-backendit (extract_text_detailed_async, valinta ocr_backend_for):
+  vision       Google Vision (oletus)
+  tesseract    paikallinen Tesseract (valinnainen pytesseract + tesseract-binääri);
+               ei verkkoa eikä kutsukohtaista maksua, toimii offline-CI:ssä
+  local_first  Tesseract ensin, Vision vain jos laatu on "poor" (tai Tesseract
+               ei ole käytettävissä)
+Kaikki palauttavat saman detailed-muodon (status, text, text_length,
+confidence, quality, words_found, words = sanataulukko sijainteineen,
+lib/ocr_words.py) + "engine", jota create_steel_prompt_with_ocr käyttää.
+"""
 import os
 import io
-from typing import Dict, Any, Union
+import time
+import asyncio
+import logging
+import threading
+import functools
+from collections import deque
+from typing import Dict, Any, Optional, Union
 
 from google.cloud import vision
 from dotenv import load_dotenv
 from PIL import Image
 
+# Paikallinen OCR (valinnainen)
+try:
+    import pytesseract
+except Exception:
+    pytesseract = None
+
 load_dotenv()
 
+from lib.concurrency import run_cpu
+from lib.ocr_batcher import OcrBatcher, batch_stats
+from lib.ocr_words import WordTable
+
 # Älä yliaja ympäristöä, jos käyttäjä on jo asettanut avaimen
 os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", "creds/gcp_key.json")
 
+log = logging.getLogger(__name__)
+
+# ---------------------------
+# Jaetut clientit
+# ---------------------------
+
+_sync_lock = threading.Lock()
+_sync_client: Optional[vision.ImageAnnotatorClient] = None
+_sync_pid: Optional[int] = None
+_sync_warm: Optional[int] = None  # PID, jonka sync-client on jo tehnyt ensimmäisen kutsun
+
+
+class _AsyncState:
+    """Async-client on sidottu luontiloopin gRPC-kanavaan -> yksi tila per loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        started = time.perf_counter()
+        self.loop = loop
+        self.pid = os.getpid()
+        self.client = vision.ImageAnnotatorAsyncClient()
+        _stats["client_init_ms"].append(round((time.perf_counter() - started) * 1000, 1))
+        self.warm = False  # ensimmäinen kutsu = kylmä (kanavan yhteys + TLS)
+        self.batcher = OcrBatcher.from_env(self.send)
+
+    async def send(self, requests: list) -> list:
+        """Yksi batch_annotate_images-kutsu (1..16 kuvaa); latenssi kutsua kohden."""
+        started = time.perf_counter()
+        try:
+            batch = await self.client.batch_annotate_images(requests=requests)
+        except Exception:
+            _stats["errors"] += 1
+            raise
+        _record((time.perf_counter() - started) * 1000, not self.warm)
+        self.warm = True
+        return list(batch.responses)
+
+
+_async_state: Optional[_AsyncState] = None
+
+_stats: Dict[str, Any] = {
+    "client_init_ms": deque(maxlen=20),
+    "cold_ms": deque(maxlen=20),
+    "warm_ms": deque(maxlen=500),
+    "errors": 0,
+    # extract_text_detailed_async: tulokset moottoreittain + local_first-paluut Visioniin
+    "engines": {"vision": 0, "tesseract": 0, "local_first_fallbacks": 0},
+}
+
+
+def _reset_after_fork() -> None:
+    # Lapsiprosessi ei saa käyttää vanhemman gRPC-kanavia; ei suljeta, vain unohdetaan
+    global _sync_client, _sync_pid, _async_state, _sync_lock
+    _sync_client = None
+    _sync_pid = None
+    _async_state = None
+    _sync_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_vision_client() -> vision.ImageAnnotatorClient:
+    """Prosessin yhteinen synkroninen Vision-client (luodaan ensimmäisellä kutsulla)."""
+    global _sync_client, _sync_pid
+    pid = os.getpid()
+    if _sync_client is None or _sync_pid != pid:
+        with _sync_lock:
+            if _sync_client is None or _sync_pid != pid:
+                started = time.perf_counter()
+                _sync_client = vision.ImageAnnotatorClient()
+                _sync_pid = pid
+                _stats["client_init_ms"].append(round((time.perf_counter() - started) * 1000, 1))
+    return _sync_client
+
+
+def _get_async_state() -> _AsyncState:
+    global _async_state
+    loop = asyncio.get_running_loop()
+    state = _async_state
+    if state is None or state.loop is not loop or state.pid != os.getpid():
+        state = _async_state = _AsyncState(loop)
+    return state
+
+
+def get_vision_async_client() -> vision.ImageAnnotatorAsyncClient:
+    """Nykyisen event loopin yhteinen async Vision-client."""
+    return _get_async_state().client
+
+
+def _record(ms: float, cold: bool) -> None:
+    _stats["cold_ms" if cold else "warm_ms"].append(round(ms, 1))
+    if cold:
+        log.info(f"Vision OCR cold call: {ms:.0f} ms")
+
+
+def ocr_stats() -> Dict[str, Any]:
+    """Kylmät (uusi client/kanava) vs. lämpimät kutsut: viimeisimmät ja jakauma."""
+    warm = sorted(_stats["warm_ms"])
+    return {
+        "client_init_ms": list(_stats["client_init_ms"]),
+        "cold_ms": list(_stats["cold_ms"]),
+        "warm_count": len(warm),
+        "warm_ms_p50": warm[len(warm) // 2] if warm else None,
+        "warm_ms_p95": warm[max(0, int(len(warm) * 0.95) - 1)] if warm else None,
+        "warm_ms_max": warm[-1] if warm else None,
+        "errors": _stats["errors"],
+        "engines": dict(_stats["engines"]),
+        "batching": batch_stats(),
+    }
+
+
+async def warm_vision_clients(timeout_s: float = 10.0) -> None:
+    """
+    App startup: luo loopin async-client ja avaa gRPC-kanavan yhteys etukäteen,
+    jolloin ensimmäinen steel-upload ei maksa kättelyä. Virhe (ei tunnuksia,
+    ei verkkoa) vain lokitetaan – OCR yrittää silti normaalisti.
+    """
+    if os.getenv("VISION_WARMUP", "1").strip() == "0":
+        return
+    started = time.perf_counter()
+    try:
+        state = _get_async_state()
+        channel = state.client.transport.grpc_channel
+        await asyncio.wait_for(channel.channel_ready(), timeout=timeout_s)
+        state.warm = True
+        log.info(f"Vision client warmed in {(time.perf_counter() - started) * 1000:.0f} ms")
+    except Exception as e:
+        log.warning(f"Vision client warmup skipped: {type(e).__name__}: {e}")
+
+
+async def aclose_vision_clients() -> None:
+    """Sulje loopin async-clientin kanava (app shutdown)."""
+    global _async_state
+    state = _async_state
+    _async_state = None
+    if state is not None and state.loop is asyncio.get_running_loop():
+        try:
+            await state.batcher.aclose()
+            await state.client.transport.close()
+        except Exception as e:
+            log.debug(f"Vision client close failed: {e}")
+
 def _pil_verify(image_bytes: bytes) -> None:
     """Tarkista, että kuva on ehjä ennen Vision-kutsua (lokittaa jos ongelma)."""
     try:
@@ -23,30 +207,66 @@ def _pil_verify(image_bytes: bytes) -> None:
         # ei kaadeta vielä, Vision voi silti onnistua normalisoinnin jälkeen
         print(f"⚠️ Pre-Vision PIL verify failed: {e}")
 
-def _summarize_confidence(full) -> Dict[str, Any]:
-    """Laske karkea keskim. luottamus ja sanamäärä, jos data saatavilla."""
-    try:
-        pages = getattr(full, "pages", []) or []
-        word_count = 0
-        conf_sum = 0.0
+def _quality(avg_conf: float) -> str:
+    return "good" if avg_conf >= 0.80 else ("fair" if avg_conf >= 0.60 else "poor")
 
-        for page in pages:
+def _vision_words(full) -> WordTable:
+    """Visionin sivut -> lohkot -> kappaleet -> sanat yhdeksi sanataulukoksi (sijainnit säilyvät)."""
+    rows = []
+    try:
+        for page in getattr(full, "pages", []) or []:
             for block in getattr(page, "blocks", []) or []:
                 for para in getattr(block, "paragraphs", []) or []:
                     for word in getattr(para, "words", []) or []:
-                        word_count += 1
-                        # Vision palauttaa confidence 0..1 tai 0..100
-                        c = getattr(word, "confidence", 0.0) or 0.0
-                        # normalisoi tarvittaessa
+                        text = "".join(getattr(sym, "text", "") for sym in getattr(word, "symbols", []) or [])
+                        vertices = getattr(getattr(word, "bounding_box", None), "vertices", []) or []
+                        xs = [v.x for v in vertices] or [0]
+                        ys = [v.y for v in vertices] or [0]
+                        # Vision palauttaa confidence 0..1 tai 0..100 -> normalisoi tarvittaessa
+                        c = float(getattr(word, "confidence", 0.0) or 0.0)
                         if c > 1.0:
                             c = c / 100.0
-                        conf_sum += float(c)
+                        rows.append((text, min(xs), min(ys), max(xs), max(ys), c))
+    except Exception as e:
+        log.debug(f"Vision word table failed: {e}")
+    return WordTable.from_words(rows)
 
-        avg_conf = (conf_sum / word_count) if word_count > 0 else 0.0
-        quality = "good" if avg_conf >= 0.80 else ("fair" if avg_conf >= 0.60 else "poor")
-        return {"avg_conf": avg_conf, "words": word_count, "quality": quality}
-    except Exception:
-        return {"avg_conf": 0.0, "words": 0, "quality": "unknown"}
+def _summarize_confidence(words: WordTable) -> Dict[str, Any]:
+    """Keskim. luottamus, sanamäärä ja laatuluokka sanataulukosta."""
+    avg_conf = words.mean_conf()
+    return {"avg_conf": avg_conf, "words": len(words), "quality": _quality(avg_conf)}
+
+def _log_payload(image_bytes: bytes) -> None:
+    if not isinstance(image_bytes, (bytes, bytearray)):
+        raise TypeError("image_bytes pitää olla bytes/bytearray")
+
+    # Pieni debug: tavujen koko + header
+    sig = bytes(image_bytes[:8])
+    print(f"🔎 Vision payload: {len(image_bytes)} B, header={sig}")
+
+def _result_from_response(response, return_detailed: bool) -> Union[str, Dict[str, Any]]:
+    """Muunna Visionin AnnotateImageResponse tekstiksi tai detailed-dictiksi."""
+    if response.error.message:
+        # Nosta selkeä virhe; kutsuva koodi voi ottaa kiinni ja palauttaa oman muodon
+        raise RuntimeError(f"Vision API error: {response.error.message}")
+
+    full = response.full_text_annotation
+    text = full.text if full and getattr(full, "text", None) else ""
+
+    if not return_detailed:
+        return text
+
+    words = _vision_words(full)
+    summary = _summarize_confidence(words)
+    return {
+        "status": "success",
+        "text": text,
+        "text_length": len(text),
+        "confidence": summary["avg_conf"],
+        "quality": summary["quality"],
+        "words_found": summary["words"],
+        "words": words,
+    }
 
 def extract_text_from_image_bytes(image_bytes: bytes, return_detailed: bool = False) -> Union[str, Dict[str, Any]]:
     """
@@ -59,33 +279,131 @@ def extract_text_from_image_bytes(image_bytes: bytes, return_detailed: bool = Fa
     Returns:
         str tai dict
     """
-    if not isinstance(image_bytes, (bytes, bytearray)):
-        raise TypeError("image_bytes pitää olla bytes/bytearray")
-
-    # Pieni debug: tavujen koko + header
-    sig = bytes(image_bytes[:8])
-    print(f"🔎 Vision payload: {len(image_bytes)} B, header={sig}")
+    _log_payload(image_bytes)
 
     # Tarkistus PIL:llä (ei pakollinen, mutta hyödyllinen logeille)
     _pil_verify(image_bytes)
 
-    client = vision.ImageAnnotatorClient()
+    global _sync_warm
+    client = get_vision_client()
     image = vision.Image(content=image_bytes)
 
     # document_text_detection on parempi teknisille piirustuksille
-    response = client.document_text_detection(image=image)
+    started = time.perf_counter()
+    try:
+        response = client.document_text_detection(image=image)
+    except Exception:
+        _stats["errors"] += 1
+        raise
+    cold = _sync_warm != _sync_pid
+    _sync_warm = _sync_pid
+    _record((time.perf_counter() - started) * 1000, cold)
 
-    if response.error.message:
-        # Nosta selkeä virhe; kutsuva koodi voi ottaa kiinni ja palauttaa oman muodon
-        raise RuntimeError(f"Vision API error: {response.error.message}")
+    return _result_from_response(response, return_detailed)
 
-    full = response.full_text_annotation
-    text = full.text if full and getattr(full, "text", None) else ""
+async def extract_text_from_image_bytes_async(
+    image_bytes: bytes,
+    return_detailed: bool = False,
+    verify: bool = True,
+) -> Union[str, Dict[str, Any]]:
+    """
+    Async-versio extract_text_from_image_bytes:sta (loopin jaettu ImageAnnotatorAsyncClient).
+
+    Async-clientissa ei ole document_text_detection-apuria, joten sama
+    DOCUMENT_TEXT_DETECTION-pyyntö tehdään batch_annotate_images:lla; loopin
+    OcrBatcher yhdistää samanaikaiset kuvat samaan kutsuun.
+    PIL-tarkistus ajetaan CPU-poolissa, ettei dekoodaus blokkaa looppia.
+    verify=False ohittaa sen, kun kuva on juuri enkoodattu itse (ei uutta dekoodausta).
+    """
+    _log_payload(image_bytes)
+    if verify:
+        await run_cpu(_pil_verify, image_bytes)
+
+    state = _get_async_state()
+    request = vision.AnnotateImageRequest(
+        image=vision.Image(content=bytes(image_bytes)),
+        features=[vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)],
+    )
+    response = await state.batcher.annotate(request, len(image_bytes))
+
+    return _result_from_response(response, return_detailed)
+
+# Yhteensopivuus-wrapper vanhoille kutsuille
+def extract_text_simple(image_bytes: bytes) -> str:
+    """Palauttaa vain täystekstin."""
+    return extract_text_from_image_bytes(image_bytes, return_detailed=False)
+
+# ---------------------------
+# OCR-backendit
+# ---------------------------
+
+OCR_BACKENDS = ("vision", "tesseract", "local_first")
+
+
+def ocr_backend_for(itype: str, requested: Optional[str] = None) -> str:
+    """
+    Backend: pyynnön ocr_backend > OCR_BACKEND-ympäristömuuttuja > industry-configin
+    "ocr_backend" > "vision". Tuntematon nimi -> ValueError.
+    """
+    backend = (requested or os.getenv("OCR_BACKEND", "")).strip().lower()
+    if not backend:
+        from lib.industry_config import get_industry_block
+        try:
+            backend = str(get_industry_block(itype).get("ocr_backend") or "vision").strip().lower()
+        except Exception:
+            backend = "vision"
+    if backend not in OCR_BACKENDS:
+        raise ValueError(f"Unknown OCR backend '{backend}'. Available: {', '.join(OCR_BACKENDS)}")
+    return backend
+
+
+@functools.lru_cache(maxsize=1)
+def tesseract_available() -> bool:
+    """pytesseract asennettu ja tesseract-binääri löytyy (tarkistetaan kerran)."""
+    if pytesseract is None:
+        return False
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
 
-    if not return_detailed:
-        return text
 
-    summary = _summarize_confidence(full or {})
+def _tesseract_detailed(image_bytes: bytes) -> Dict[str, Any]:
+    """
+    Synkroninen Tesseract-OCR (CPU-poolissa). Sanojen luottamus 0..100 -> 0..1,
+    teksti kootaan riveittäin kuten Visionin full_text_annotation.
+    OCR_TESSERACT_LANG (oletus eng), OCR_TESSERACT_CONFIG (oletus --psm 11:
+    hajanainen teksti, sopii piirustuksille).
+    """
+    if pytesseract is None:
+        raise RuntimeError("pytesseract not installed")
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        data = pytesseract.image_to_data(
+            img,
+            lang=os.getenv("OCR_TESSERACT_LANG", "eng"),
+            config=os.getenv("OCR_TESSERACT_CONFIG", "--psm 11"),
+            output_type=pytesseract.Output.DICT,
+        )
+
+    lines: Dict[tuple, list] = {}
+    rows = []
+    for i, word in enumerate(data.get("text", [])):
+        word = (word or "").strip()
+        try:
+            conf = float(data["conf"][i])
+        except (TypeError, ValueError):
+            conf = -1.0
+        if not word or conf < 0:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+        x, y = data["left"][i], data["top"][i]
+        rows.append((word, x, y, x + data["width"][i], y + data["height"][i], conf / 100.0))
+
+    text = "\n".join(" ".join(words) for _, words in sorted(lines.items()))
+    words = WordTable.from_words(rows)
+    summary = _summarize_confidence(words)
     return {
         "status": "success",
         "text": text,
@@ -93,9 +411,53 @@ def extract_text_from_image_bytes(image_bytes: bytes, return_detailed: bool = Fa
         "confidence": summary["avg_conf"],
         "quality": summary["quality"],
         "words_found": summary["words"],
+        "words": words,
     }
 
-# Yhteensopivuus-wrapper vanhoille kutsuille
-def extract_text_simple(image_bytes: bytes) -> str:
-    """Palauttaa vain täystekstin."""
-    return extract_text_from_image_bytes(image_bytes, return_detailed=False)
+
+async def extract_text_detailed_async(
+    image_bytes: bytes,
+    backend: str = "vision",
+    verify: bool = True,
+) -> Dict[str, Any]:
+    """
+    OCR valitulla backendillä -> detailed-dict + "engine" ("vision" | "tesseract").
+    local_first lisää "fallback"-tiedon, kun Tesseractin tulos ei kelvannut.
+    """
+    if backend == "vision":
+        result = await extract_text_from_image_bytes_async(image_bytes, return_detailed=True, verify=verify)
+        _stats["engines"]["vision"] += 1
+        return {**result, "engine": "vision"}
+
+    if backend == "tesseract":
+        result = await run_cpu(_tesseract_detailed, bytes(image_bytes))
+        _stats["engines"]["tesseract"] += 1
+        return {**result, "engine": "tesseract"}
+
+    if backend == "local_first":
+        started = time.perf_counter()
+        local = None
+        # Ensimmäinen tarkistus käynnistää tesseract-prosessin -> ei loopissa
+        if not await run_cpu(tesseract_available):
+            reason = "unavailable"
+        else:
+            try:
+                local = await extract_text_detailed_async(image_bytes, "tesseract")
+                if local["quality"] != "poor" and local["text"]:
+                    return local
+                reason = "poor"
+            except Exception as e:
+                log.warning(f"Local OCR failed, using Vision: {type(e).__name__}: {e}")
+                reason = "error"
+        fallback = {
+            "from": "tesseract",
+            "reason": reason,
+            "local_confidence": local["confidence"] if local else None,
+            "local_ms": round((time.perf_counter() - started) * 1000),
+        }
+        _stats["engines"]["local_first_fallbacks"] += 1
+        result = await extract_text_detailed_async(image_bytes, "vision", verify=verify)
+        result["fallback"] = fallback
+        return result
+
+    raise ValueError(f"Unknown OCR backend '{backend}'")
@@ -0,0 +1,162 @@
+# drawsync-backend/lib/ocr_words.py
+"""
+OCR:n sanataulukko ja tilaindeksi.
+
+OCR-backendit palauttivat vain tekstin ja keskimääräisen luottamuksen; sanojen
+sijainnit heitettiin pois, joten steel-linkitys joutui päättelemään yhteydet
+tekstirivien numeroista. WordTable säilyttää jokaisen sanan sarakkeina:
+
+  text   list[str]
+  boxes  float32 (n, 4)  x0, y0, x1, y1 sivun pikseleinä (PDF: pisteinä)
+  conf   float64 (n,)    0..1 (tarkka: laatuluokan rajat 0.80 / 0.60)
+
+GridIndex jakaa sivun tasaisiin ruutuihin (oletus 4 × sanojen mediaanikorkeus)
+ja hakee tietyn etäisyyden sisällä olevat laatikot käymättä kaikkia läpi.
+Tiheälläkin arkilla (tuhansia sanoja) haku koskee vain muutamaa ruutua.
+"""
+from __future__ import annotations
+
+import math
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Ruudun koko rivikorkeuksina; haku käy läpi ruudut, joihin säde ulottuu
+CELL_LINE_HEIGHTS = 4.0
+
+
+def gap_distance(boxes: np.ndarray, box: Sequence[float]) -> np.ndarray:
+    """Laatikoiden lyhin etäisyys boxiin (0, jos leikkaavat)."""
+    x0, y0, x1, y1 = box
+    dx = np.maximum(0.0, np.maximum(boxes[:, 0] - x1, x0 - boxes[:, 2]))
+    dy = np.maximum(0.0, np.maximum(boxes[:, 1] - y1, y0 - boxes[:, 3]))
+    return np.hypot(dx, dy)
+
+
+class GridIndex:
+    """Tasaruudukko laatikoille: ruutu -> laatikoiden indeksit."""
+
+    def __init__(self, boxes: np.ndarray, cell: float):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.cell = max(float(cell), 1.0)
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        coords = np.floor(self.boxes / self.cell).astype(np.int64).tolist()
+        for i, (cx0, cy0, cx1, cy1) in enumerate(coords):
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    self._cells.setdefault((cx, cy), []).append(i)
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def query(self, box: Sequence[float], radius: float) -> Tuple[np.ndarray, np.ndarray]:
+        """(indeksit, etäisyydet) laatikoille, joiden etäisyys boxiin <= radius, lähin ensin."""
+        x0, y0, x1, y1 = box
+        cx0, cy0 = math.floor((x0 - radius) / self.cell), math.floor((y0 - radius) / self.cell)
+        cx1, cy1 = math.floor((x1 + radius) / self.cell), math.floor((y1 + radius) / self.cell)
+        found = set()
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                hit = self._cells.get((cx, cy))
+                if hit:
+                    found.update(hit)
+        if not found:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        idx = np.fromiter(found, dtype=np.int64, count=len(found))
+        dist = gap_distance(self.boxes[idx], box)
+        keep = dist <= radius
+        idx, dist = idx[keep], dist[keep]
+        order = np.lexsort((idx, dist))
+        return idx[order], dist[order]
+
+
+class WordTable:
+    """OCR-sanat sarakkeina (ks. moduulin docstring). Tyhjä taulukko = ei sijainteja."""
+
+    __slots__ = ("text", "boxes", "conf", "_index", "_rows")
+
+    def __init__(self, text: Sequence[str], boxes, conf):
+        self.text = list(text)
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=np.float64).reshape(-1)
+        if not (len(self.text) == len(self.boxes) == len(self.conf)):
+            raise ValueError("WordTable columns must have equal length")
+        self._index: Optional[GridIndex] = None
+        self._rows: Optional[List[List[int]]] = None
+
+    @classmethod
+    def from_words(cls, words: Iterable[Tuple[str, float, float, float, float, float]]) -> "WordTable":
+        """[(teksti, x0, y0, x1, y1, luottamus), ...] -> WordTable."""
+        text, boxes, conf = [], [], []
+        for word, x0, y0, x1, y1, c in words:
+            text.append(word)
+            boxes.append((min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)))
+            conf.append(c)
+        return cls(text, boxes, conf)
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    def __getstate__(self):
+        # Välimuistit (indeksi, rivit) rakennetaan uudelleen vastaanottajalla
+        return {"text": self.text, "boxes": self.boxes, "conf": self.conf}
+
+    def __setstate__(self, state) -> None:
+        self.text, self.boxes, self.conf = state["text"], state["boxes"], state["conf"]
+        self._index = None
+        self._rows = None
+
+    def mean_conf(self) -> float:
+        return float(self.conf.mean()) if len(self.conf) else 0.0
+
+    def line_height(self) -> float:
+        """Sanojen mediaanikorkeus (etäisyyksien mittayksikkö)."""
+        if not len(self.boxes):
+            return 1.0
+        heights = self.boxes[:, 3] - self.boxes[:, 1]
+        heights = heights[heights > 0]
+        return float(np.median(heights)) if len(heights) else 1.0
+
+    def bbox(self, indices: Sequence[int]) -> Optional[Tuple[float, float, float, float]]:
+        """Sanojen yhteinen laatikko."""
+        if not len(indices):
+            return None
+        sel = self.boxes[list(indices)]
+        return (float(sel[:, 0].min()), float(sel[:, 1].min()), float(sel[:, 2].max()), float(sel[:, 3].max()))
+
+    def index(self) -> GridIndex:
+        if self._index is None:
+            self._index = GridIndex(self.boxes, CELL_LINE_HEIGHTS * self.line_height())
+        return self._index
+
+    def near(self, box: Sequence[float], radius: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Sanat radiuksen sisällä boxista (indeksit, etäisyydet), lähin ensin."""
+        return self.index().query(box, radius)
+
+    def rows(self) -> List[List[int]]:
+        """
+        Visuaaliset rivit ylhäältä alas, sanat vasemmalta oikealle. Sana kuuluu
+        riviin, jos sen pystykeskipiste on puolen rivikorkeuden sisällä rivin
+        keskiarvosta (taulukon rivi tai saman korkeuden teksti koko arkilla).
+        """
+        if self._rows is None:
+            rows: List[List[int]] = []
+            if len(self.boxes):
+                tolerance = 0.5 * self.line_height()
+                centers = (self.boxes[:, 1] + self.boxes[:, 3]) / 2.0
+                current: List[int] = []
+                total = 0.0
+                for i in np.argsort(centers, kind="stable").tolist():
+                    if current and abs(centers[i] - total / len(current)) > tolerance:
+                        rows.append(current)
+                        current, total = [], 0.0
+                    current.append(i)
+                    total += float(centers[i])
+                rows.append(current)
+                x0 = self.boxes[:, 0]
+                rows = [sorted(row, key=lambda i: x0[i]) for row in rows]
+            self._rows = rows
+        return self._rows
+
+    def row_texts(self) -> List[str]:
+        return [" ".join(self.text[i] for i in row) for row in self.rows()]
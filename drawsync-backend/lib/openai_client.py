@@ -0,0 +1,371 @@
+# drawsync-backend/lib/openai_client.py
+"""
+Jaettu async OpenAI -client: yhteyspooli, aikarajat ja oma uudelleenyrityspolitiikka.
+
+- Yksi httpx.AsyncClient per event loop (HTTP/2, jos h2 on asennettu), joten
+  TLS-yhteydet käytetään uudelleen kutsujen välillä.
+- SDK:n omat retryt on pois päältä (max_retries=0); call_with_retries
+  yrittää uudelleen vain ohimeneviä virheitä (429, 408/409, 5xx, yhteys/timeout)
+  eksponentiaalisella full-jitter-backoffilla ja noudattaa Retry-After-otsaketta.
+- Jokaisella kutsulla on kokonaisdeadline (OPENAI_DEADLINE_S), joka kattaa
+  jonotuksen, yritykset ja odotukset – backoffia ei nukuta deadlinen yli.
+- Prosessin laajuinen rinnakkaisuusraja (OPENAI_MAX_CONCURRENCY): ylimenevät
+  kutsut jonottavat vuoroaan sen sijaan, että ne ajaisivat rate limittiin.
+- Ennen jokaista yritystä vuoro haetaan rate limit -ajoittajalta
+  (lib/openai_scheduler.py), joka valitsee myös endpointin poolista
+  (lib/openai_pool.py, OPENAI_ENDPOINTS). Uudelleenyritys voi siis osua
+  eri endpointille kuin epäonnistunut yritys.
+"""
+from __future__ import annotations
+
+import os
+import time
+import random
+import asyncio
+import logging
+import email.utils
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+from lib.openai_pool import Endpoint
+from lib.openai_scheduler import QueueTimeout, scheduler
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class OpenAIDeadlineExceeded(TimeoutError):
+    """Kutsu ei valmistunut kokonaisdeadlinen (jonotus + yritykset) sisällä."""
+
+
+# ---------------------------
+# Asetukset
+# ---------------------------
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def request_timeout() -> float:
+    """Yhden HTTP-yrityksen aikaraja (OPENAI_TIMEOUT_S)."""
+    return _env_float("OPENAI_TIMEOUT_S", 120.0)
+
+
+def call_deadline() -> float:
+    """Koko kutsun aikaraja retryineen (OPENAI_DEADLINE_S)."""
+    return _env_float("OPENAI_DEADLINE_S", 180.0)
+
+
+def max_retries() -> int:
+    return _env_int("OPENAI_MAX_RETRIES", 4)
+
+
+def max_concurrency() -> int:
+    return max(1, _env_int("OPENAI_MAX_CONCURRENCY", 8))
+
+
+def _http2_enabled() -> bool:
+    if os.getenv("OPENAI_HTTP2", "1").strip() == "0":
+        return False
+    try:
+        import h2  # noqa: F401  (httpx[http2])
+        return True
+    except ImportError:
+        return False
+
+
+# ---------------------------
+# Client + rinnakkaisuusraja (event loop -kohtaiset)
+# ---------------------------
+
+class _LoopState:
+    """
+    httpx-yhteydet ja Semaphore on sidottu event looppiin -> yksi tila per loop.
+    Endpointien AsyncOpenAI-clientit jakavat saman yhteyspoolin.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        http2 = _http2_enabled()
+        self.http = httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(request_timeout(), connect=_env_float("OPENAI_CONNECT_TIMEOUT_S", 10.0)),
+            limits=httpx.Limits(
+                max_connections=_env_int("OPENAI_MAX_CONNECTIONS", 20),
+                max_keepalive_connections=_env_int("OPENAI_MAX_KEEPALIVE", 10),
+            ),
+        )
+        self.clients: Dict[str, AsyncOpenAI] = {}
+        self.limit = max_concurrency()
+        self.semaphore = asyncio.Semaphore(self.limit)
+        log.info(f"OpenAI async client ready (http2={http2}, max_concurrency={self.limit})")
+
+    def client_for(self, endpoint: Endpoint) -> AsyncOpenAI:
+        client = self.clients.get(endpoint.name)
+        if client is None:
+            client = self.clients[endpoint.name] = AsyncOpenAI(
+                api_key=endpoint.api_key,
+                base_url=endpoint.base_url,
+                http_client=self.http,
+                max_retries=0,
+                timeout=request_timeout(),
+            )
+        return client
+
+
+_state: Optional[_LoopState] = None
+_stats: Dict[str, int] = {"calls": 0, "retries": 0, "failures": 0, "deadline_exceeded": 0, "in_flight": 0, "waiting": 0}
+
+
+def _get_state() -> _LoopState:
+    global _state
+    loop = asyncio.get_running_loop()
+    if _state is None or _state.loop is not loop:
+        _state = _LoopState(loop)
+    return _state
+
+
+def get_async_client(endpoint: Optional[Endpoint] = None) -> AsyncOpenAI:
+    """Jaettu AsyncOpenAI nykyiselle event loopille (oletus: poolin ensimmäinen endpoint)."""
+    return _get_state().client_for(endpoint or scheduler.pool.primary)
+
+
+def client_stats() -> Dict[str, int]:
+    return dict(_stats)
+
+
+async def aclose_clients() -> None:
+    """Sulje yhteyspooli (app shutdown)."""
+    global _state
+    if _state is not None and _state.loop is asyncio.get_running_loop():
+        await _state.http.aclose()
+    _state = None
+
+
+# ---------------------------
+# Retry-politiikka
+# ---------------------------
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        if exc.status_code == 429 and getattr(exc, "code", None) == "insufficient_quota":
+            return False  # kiintiö loppu – uudelleenyritys ei auta
+        return exc.status_code in RETRYABLE_STATUS
+    return False
+
+
+def is_endpoint_failure(exc: BaseException) -> bool:
+    """Endpointin (ei pyynnön) vika: yhteys, timeout, 5xx tai hylätty avain -> terveyslaskuriin."""
+    if isinstance(exc, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code >= 500 or exc.status_code in (401, 403)
+    return False
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Retry-After(-ms) vastauksen otsakkeista sekunteina, jos annettu."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)  # HTTP-date
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """
+    Full jitter: satunnainen 0..min(max, base * 2^attempt).
+    Retry-After on alaraja (+ pieni jitter, ettei kaikki palaa samalla hetkellä).
+    """
+    base = _env_float("OPENAI_BACKOFF_BASE_S", 0.5)
+    cap = _env_float("OPENAI_BACKOFF_MAX_S", 20.0)
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after + random.uniform(0, 0.25))
+    return delay
+
+
+async def _acquire(semaphore: asyncio.Semaphore, timeout: float) -> None:
+    _stats["waiting"] += 1
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout=timeout)
+    finally:
+        _stats["waiting"] -= 1
+
+
+async def call_with_retries(
+    fn: Callable[[Endpoint], Awaitable[T]],
+    deadline_s: Optional[float] = None,
+    op: str = "openai",
+    tenant: Optional[str] = None,
+    cost: int = 0,
+) -> T:
+    """
+    Aja fn(endpoint) rate limit -vuoron ja rinnakkaisuusrajan alla, uudelleenyritä
+    ohimenevät virheet. Ei-ohimenevät virheet nousevat heti; deadline ->
+    OpenAIDeadlineExceeded, jonon aikaraja -> QueueTimeout.
+
+    tenant/cost: kenen jonoon kutsu menee ja arvioitu token-kulu (0 = vain pyyntö).
+    """
+    state = _get_state()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (deadline_s if deadline_s is not None else call_deadline())
+    attempt = 0
+    _stats["calls"] += 1
+
+    while True:
+        remaining = deadline - loop.time()
+        endpoint: Optional[Endpoint] = None
+        granted_at = started = time.monotonic()
+        try:
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            endpoint, granted_at = await scheduler.acquire(tenant, cost, timeout=remaining)
+            await _acquire(state.semaphore, max(deadline - loop.time(), 0.001))
+            _stats["in_flight"] += 1
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(fn(endpoint), timeout=max(deadline - loop.time(), 0.001))
+            finally:
+                _stats["in_flight"] -= 1
+                state.semaphore.release()
+            scheduler.release(endpoint, granted_at, time.monotonic() - started, healthy=True)
+            return result
+        except QueueTimeout:
+            _stats["failures"] += 1
+            raise
+        except asyncio.TimeoutError:
+            if endpoint is not None:
+                # Deadline ehti ennen vastausta (esim. rinnakkaisuusjonossa): varaus takaisin
+                endpoint.state.refund(cost)
+                scheduler.cancel(endpoint, granted_at)
+            _stats["deadline_exceeded"] += 1
+            raise OpenAIDeadlineExceeded(f"{op}: deadline exceeded after {attempt + 1} attempt(s)")
+        except asyncio.CancelledError:
+            if endpoint is not None:
+                # Peruttu kutsu ei kuluta arvioitua määrää: varaus takaisin bucketiin
+                endpoint.state.refund(cost)
+                scheduler.cancel(endpoint, granted_at)
+            raise
+        except Exception as e:
+            if endpoint is not None:
+                if isinstance(e, openai.APIStatusError):
+                    if e.status_code == 429:
+                        scheduler.observe_rate_limited(endpoint, e.response.headers)
+                    else:
+                        scheduler.observe_headers(endpoint, e.response.headers)
+                failed = is_endpoint_failure(e)
+                scheduler.release(endpoint, granted_at, None if failed else time.monotonic() - started, healthy=not failed)
+            if not is_retryable(e) or attempt >= max_retries():
+                _stats["failures"] += 1
+                raise
+            delay = backoff_delay(attempt, retry_after_seconds(e))
+            if loop.time() + delay >= deadline:
+                _stats["failures"] += 1
+                log.warning(f"{op}: not retrying {type(e).__name__}, backoff {delay:.1f}s would pass the deadline")
+                raise
+            attempt += 1
+            _stats["retries"] += 1
+            where = f" on {endpoint.name}" if endpoint is not None else ""
+            log.warning(f"{op}: {type(e).__name__} ({getattr(e, 'status_code', '-')}){where}, retry {attempt} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+async def chat_completion(
+    deadline_s: Optional[float] = None,
+    tenant: Optional[str] = None,
+    estimated_tokens: Optional[int] = None,
+    **kwargs: Any,
+):
+    """
+    client.chat.completions.create(**kwargs) jaetulla clientilla + retry-politiikalla.
+
+    Raakavastauksen rate limit -otsakkeet syötetään ajoittajalle ja arvion
+    ja toteutuneen usage.total_tokens -määrän erotus tasataan vastanneen
+    endpointin token-bucketiin. Endpointin `model` yliajaa kwargs["model"]:n.
+    """
+    state = _get_state()
+    cost = int(estimated_tokens or 0)
+
+    async def _create(endpoint: Endpoint):
+        params = dict(kwargs, model=endpoint.model) if endpoint.model else kwargs
+        raw = await state.client_for(endpoint).chat.completions.with_raw_response.create(**params)
+        scheduler.observe_headers(endpoint, raw.headers)
+        completion = raw.parse()
+        usage = getattr(completion, "usage", None)
+        scheduler.settle(endpoint, cost, getattr(usage, "total_tokens", None))
+        return completion
+
+    return await call_with_retries(_create, deadline_s, op="chat.completions", tenant=tenant, cost=cost)
+
+
+async def chat_completion_stream(
+    on_delta: Callable[[str, bool], None],
+    deadline_s: Optional[float] = None,
+    tenant: Optional[str] = None,
+    estimated_tokens: Optional[int] = None,
+    **kwargs: Any,
+) -> str:
+    """
+    Striimattu chat completion: on_delta(teksti, reset) jokaiselle palalle,
+    palauttaa koko vastaustekstin. reset=True yrityksen ensimmäisellä palalla –
+    uudelleenyritys aloittaa vastauksen alusta, joten kuluttaja tyhjentää
+    puskurinsa. Rate limit, retryt ja deadline kuten chat_completion:ssa.
+    """
+    state = _get_state()
+    cost = int(estimated_tokens or 0)
+
+    async def _stream(endpoint: Endpoint) -> str:
+        params = dict(kwargs, model=endpoint.model) if endpoint.model else dict(kwargs)
+        params.update(stream=True, stream_options={"include_usage": True})
+        raw = await state.client_for(endpoint).chat.completions.with_raw_response.create(**params)
+        scheduler.observe_headers(endpoint, raw.headers)
+        parts = []
+        total_tokens = None
+        async for chunk in raw.parse():
+            if chunk.usage is not None:
+                total_tokens = chunk.usage.total_tokens
+            for choice in chunk.choices:
+                delta = choice.delta.content if choice.delta else None
+                if delta:
+                    on_delta(delta, not parts)
+                    parts.append(delta)
+        scheduler.settle(endpoint, cost, total_tokens)
+        return "".join(parts)
+
+    return await call_with_retries(_stream, deadline_s, op="chat.completions.stream", tenant=tenant, cost=cost)
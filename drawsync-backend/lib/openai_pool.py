@@ -0,0 +1,400 @@
+# drawsync-backend/lib/openai_pool.py
+"""
+OpenAI-yhteensopivien endpointien (base URL + avain) pooli.
+
+Jokaisella endpointilla on oma rate limit -tila (RPM/TPM-bucketit otsakkeista),
+liukuva latenssiarvio (EWMA) ja terveystila. Ajoittaja (lib/openai_scheduler.py)
+valitsee kutsulle endpointin, jolla on tilaa bucketeissa ja paras arvioitu
+vasteaika; peräkkäin epäonnistuva endpoint poistetaan kierrosta ja sitä
+koetetaan myöhemmin yhdellä kutsulla (half-open).
+
+Asetus OPENAI_ENDPOINTS (JSON-lista), esim.:
+
+    [{"name": "primary", "api_key_env": "OPENAI_API_KEY", "tpm": 200000},
+     {"name": "proxy", "base_url": "http://10.0.0.5:8080/v1", "api_key": "x", "model": "gpt-5"}]
+
+Kentät: name, base_url (puuttuu = SDK:n oletus), api_key tai api_key_env,
+rpm, tpm (oletus OPENAI_RPM_LIMIT / OPENAI_TPM_LIMIT), model (yliajaa mallin).
+Ilman asetusta pooli on yksi endpoint: OPENAI_API_KEY + OPENAI_BASE_URL.
+"""
+from __future__ import annotations
+
+import os
+import re
+import json
+import time
+import logging
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+# ---------------------------
+# Rate limit -tila
+# ---------------------------
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT_S = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """x-ratelimit-reset-* ("1s", "6m0s", "120ms") -> sekunnit."""
+    if not value:
+        return None
+    parts = _DURATION.findall(value.strip())
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(n) * _UNIT_S[u] for n, u in parts)
+
+
+class TokenBucket:
+    """Täyttyy tasaisesti limit/60 per sekunti (minuuttiraja), enintään limit."""
+
+    def __init__(self, limit: float):
+        self.limit = max(limit, 1.0)
+        self.level = self.limit
+        self.updated = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self.limit / 60.0
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.limit, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        """Sekunnit, kunnes amount on saatavilla (0 = heti)."""
+        amount = min(amount, self.limit)  # isompi kuin koko bucket: odota täyteen
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def sync(self, limit: Optional[float], remaining: Optional[float], now: float) -> None:
+        """
+        Palvelimen otsakkeet: raja sellaisenaan, jäljellä oleva määrä vain
+        laskee tasoa. Vastauksen hetkellä lennossa olevat omat varaukset eivät
+        vielä näy palvelimen luvussa, joten sillä ei nosteta tasoa.
+        """
+        self.refill(now)
+        if limit:
+            self.limit = max(limit, 1.0)
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+        self.level = min(self.level, self.limit)
+
+
+class RateLimitState:
+    """Pyyntö- ja token-bucketit (RPM/TPM), päivitetään vastausten otsakkeista."""
+
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.last_headers_at: Optional[float] = None
+        self.reset_s: Dict[str, Optional[float]] = {}
+
+    @classmethod
+    def from_env(cls, rpm: Optional[float] = None, tpm: Optional[float] = None) -> "RateLimitState":
+        return cls(
+            rpm if rpm is not None else _env_float("OPENAI_RPM_LIMIT", 500),
+            tpm if tpm is not None else _env_float("OPENAI_TPM_LIMIT", 200_000),
+        )
+
+    def wait_for(self, cost: int) -> float:
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return max(self.requests.wait_for(1), self.tokens.wait_for(cost))
+
+    def take(self, cost: int) -> None:
+        self.requests.level -= 1
+        self.tokens.level -= cost
+
+    def refund(self, amount: float) -> None:
+        """Arvion ja toteutuneen kulutuksen erotus takaisin (tai lisäveloitus, jos negatiivinen)."""
+        self.tokens.level = min(self.tokens.limit, self.tokens.level + amount)
+
+    def observe_headers(self, headers: Optional[Mapping[str, str]]) -> None:
+        if not headers:
+            return
+
+        def num(name: str) -> Optional[float]:
+            try:
+                value = headers.get(name)
+                return float(value) if value is not None else None
+            except ValueError:
+                return None
+
+        if headers.get("x-ratelimit-remaining-requests") is None and headers.get("x-ratelimit-remaining-tokens") is None:
+            return
+        now = time.monotonic()
+        self.requests.sync(num("x-ratelimit-limit-requests"), num("x-ratelimit-remaining-requests"), now)
+        self.tokens.sync(num("x-ratelimit-limit-tokens"), num("x-ratelimit-remaining-tokens"), now)
+        self.reset_s = {
+            "requests": parse_reset(headers.get("x-ratelimit-reset-requests")),
+            "tokens": parse_reset(headers.get("x-ratelimit-reset-tokens")),
+        }
+        self.last_headers_at = time.time()
+
+    def observe_rate_limited(self, headers: Optional[Mapping[str, str]]) -> None:
+        """
+        429: loppuun kuluneet bucketit pidetään tyhjinä reset-otsakkeen ajan,
+        jotta jonossa odottavat eivät aja samaan rajaan. Ilman otsakkeita
+        tyhjennetään pyyntöbucket.
+        """
+        if not headers or headers.get("x-ratelimit-remaining-requests") is None:
+            self.requests.level = min(self.requests.level, 0.0)
+            return
+        self.observe_headers(headers)
+        for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+            reset = self.reset_s.get(kind)
+            if reset and headers.get(f"x-ratelimit-remaining-{kind}") in ("0", "0.0"):
+                bucket.level = min(bucket.level, -reset * bucket.rate)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return {
+            "requests": {"limit": self.requests.limit, "available": round(self.requests.level, 1)},
+            "tokens": {"limit": self.tokens.limit, "available": round(self.tokens.level)},
+            "reset_s": self.reset_s,
+            "last_headers_at": self.last_headers_at,
+        }
+
+
+
+# ---------------------------
+# Endpoint + terveys
+# ---------------------------
+
+class Endpoint:
+    """
+    Yksi base URL + avain. Terveys: OPENAI_EJECT_AFTER peräkkäistä virhettä
+    (yhteys, timeout, 5xx, 401/403) -> pois kierrosta OPENAI_EJECT_S, jonka
+    jälkeen yksi koekutsu; epäonnistunut koe tuplaa tauon (max OPENAI_EJECT_MAX_S).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        api_key: Optional[str],
+        base_url: Optional[str] = None,
+        model: Optional[str] = None,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+    ):
+        self.name = name
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.state = RateLimitState.from_env(rpm, tpm)
+        self.latency_s: Optional[float] = None  # EWMA, None = ei vielä mitattu
+        self.in_flight = 0
+        self.failures = 0  # peräkkäiset
+        self.ejected_until: Optional[float] = None
+        self.eject_s = 0.0
+        self.probing = False
+        self.probe_started_at = 0.0
+        self.counters = {"calls": 0, "errors": 0, "ejections": 0}
+
+    def available(self, now: float) -> bool:
+        if self.ejected_until is None:
+            return True
+        return now >= self.ejected_until and not self.probing
+
+    def score(self) -> float:
+        """
+        Pienempi = parempi: arvioitu vasteaika jonon kanssa, jaettuna vapaalla
+        token-kiintiöllä. Mittaamaton endpoint (None) saa ensimmäisen kutsun.
+        """
+        latency = self.latency_s if self.latency_s is not None else 0.0
+        tokens = self.state.tokens
+        spare = max(tokens.level, 0.0) / tokens.limit
+        return latency * (1 + self.in_flight) / (0.5 + 0.5 * spare)
+
+    def start(self) -> float:
+        """Vuoro myönnetty. Palauttaa aloitusajan, joka annetaan finish()/cancel():lle."""
+        now = time.monotonic()
+        self.in_flight += 1
+        self.counters["calls"] += 1
+        if self.ejected_until is not None:
+            self.probing = True
+            self.probe_started_at = now
+            log.info(f"OpenAI endpoint {self.name}: probing after ejection")
+        return now
+
+    def _is_probe(self, started_at: float) -> bool:
+        # Ennen poistoa lähteneet kutsut ovat vanhempia kuin koekutsu
+        return self.probing and started_at >= self.probe_started_at
+
+    def finish(self, started_at: float, latency_s: Optional[float], healthy: bool) -> None:
+        """Kutsu päättyi: healthy=False laskee endpointin virheeksi (ei 4xx-pyyntövirheitä)."""
+        self.in_flight = max(0, self.in_flight - 1)
+        probe = self._is_probe(started_at)
+        if probe:
+            self.probing = False
+        elif self.ejected_until is not None:
+            # Ennen poistoa lähteneen kutsun tulos ei muuta poistoa kumpaankaan suuntaan
+            if not healthy:
+                self.counters["errors"] += 1
+            return
+        if healthy:
+            if probe:
+                log.info(f"OpenAI endpoint {self.name}: back in rotation")
+            self.failures = 0
+            self.ejected_until = None
+            self.eject_s = 0.0
+            if latency_s is not None:
+                alpha = _env_float("OPENAI_LATENCY_EWMA_ALPHA", 0.3)
+                self.latency_s = latency_s if self.latency_s is None else (1 - alpha) * self.latency_s + alpha * latency_s
+            return
+        self.failures += 1
+        self.counters["errors"] += 1
+        if probe or self.failures >= max(1, _env_int("OPENAI_EJECT_AFTER", 3)):
+            self._eject()
+
+    def cancel(self, started_at: float) -> None:
+        """Kutsu keskeytettiin ennen vastausta: ei mittausta kumpaankaan suuntaan."""
+        self.in_flight = max(0, self.in_flight - 1)
+        if self._is_probe(started_at):
+            self.probing = False
+
+    def _eject(self) -> None:
+        base = _env_float("OPENAI_EJECT_S", 30.0)
+        self.eject_s = min(_env_float("OPENAI_EJECT_MAX_S", 300.0), self.eject_s * 2 if self.eject_s else base)
+        self.ejected_until = time.monotonic() + self.eject_s
+        self.counters["ejections"] += 1
+        log.warning(f"OpenAI endpoint {self.name} ejected for {self.eject_s:.1f}s after {self.failures} failure(s)")
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "model": self.model,
+            "latency_s": round(self.latency_s, 3) if self.latency_s is not None else None,
+            "in_flight": self.in_flight,
+            "consecutive_failures": self.failures,
+            "ejected_for_s": round(self.ejected_until - now, 1) if self.ejected_until else 0.0,
+            **self.counters,
+            "rate_limits": self.state.snapshot(),
+        }
+
+
+class EndpointPool:
+    def __init__(self, endpoints: List[Endpoint]):
+        if not endpoints:
+            raise ValueError("OpenAI endpoint pool is empty")
+        names = [e.name for e in endpoints]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate OpenAI endpoint names: {names}")
+        self.endpoints = endpoints
+
+    @classmethod
+    def from_env(cls) -> "EndpointPool":
+        raw = os.getenv("OPENAI_ENDPOINTS", "").strip()
+        if not raw:
+            return cls([Endpoint("default", os.getenv("OPENAI_API_KEY"), os.getenv("OPENAI_BASE_URL") or None)])
+        try:
+            pool = cls.from_config(json.loads(raw))
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid OPENAI_ENDPOINTS: {e}") from e
+        log.info(f"OpenAI endpoint pool: {', '.join(e.name for e in pool.endpoints)}")
+        return pool
+
+    @classmethod
+    def from_config(cls, items: List[Dict[str, Any]]) -> "EndpointPool":
+        """Pooli OPENAI_ENDPOINTS-muotoisesta listasta (ks. moduulin docstring)."""
+        if not isinstance(items, list):
+            raise ValueError("expected a JSON list")
+        return cls([_endpoint_from_config(item, i) for i, item in enumerate(items)])
+
+    @property
+    def primary(self) -> Endpoint:
+        return self.endpoints[0]
+
+    def pick(self, cost: int) -> Tuple[Optional[Endpoint], float]:
+        """
+        Endpoint, jolla on heti tilaa ja pienin score(); muuten (None, odotus
+        sekunteina), kun seuraava endpoint vapautuu. Pois kierrosta ollut
+        endpoint, jonka tauko on ohi, saa etusijan: sen koekutsu on oikea kutsu,
+        joka epäonnistuessaan yritetään uudelleen toisella endpointilla.
+        """
+        now = time.monotonic()
+        best: Optional[Endpoint] = None
+        wait = float("inf")
+        for endpoint in self.endpoints:
+            if not endpoint.available(now):
+                if endpoint.ejected_until is not None and not endpoint.probing:
+                    wait = min(wait, endpoint.ejected_until - now)
+                continue
+            endpoint_wait = endpoint.state.wait_for(cost)
+            if endpoint_wait > 0:
+                wait = min(wait, endpoint_wait)
+            elif endpoint.ejected_until is not None:
+                return endpoint, 0.0
+            elif best is None or endpoint.score() < best.score():
+                best = endpoint
+        if best is not None:
+            return best, 0.0
+        # Kaikki koekutsussa -> katsotaan tilanne uudelleen hetken päästä
+        return None, wait if wait != float("inf") else 1.0
+
+    def get(self, name: str) -> Endpoint:
+        for endpoint in self.endpoints:
+            if endpoint.name == name:
+                return endpoint
+        raise KeyError(name)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [e.snapshot() for e in self.endpoints]
+
+
+def _endpoint_from_config(item: Dict[str, Any], index: int) -> Endpoint:
+    if not isinstance(item, dict):
+        raise ValueError(f"endpoint #{index} is not an object")
+    api_key = item.get("api_key")
+    if not api_key and item.get("api_key_env"):
+        api_key = os.getenv(str(item["api_key_env"]))
+    if not api_key:
+        api_key = os.getenv("OPENAI_API_KEY")
+    rpm, tpm = item.get("rpm"), item.get("tpm")
+    return Endpoint(
+        name=str(item.get("name") or f"endpoint-{index}"),
+        api_key=api_key,
+        base_url=item.get("base_url") or None,
+        model=item.get("model") or None,
+        rpm=float(rpm) if rpm is not None else None,
+        tpm=float(tpm) if tpm is not None else None,
+    )
+
+
+# Oletuspooli luodaan ensimmäisellä käytöllä eikä importissa, jotta testit ja
+# benchmarkit voivat rakentaa poolin omasta konfiguraatiostaan (from_config)
+_default_pool: Optional[EndpointPool] = None
+
+
+def default_pool() -> EndpointPool:
+    """Prosessin pooli OPENAI_ENDPOINTS / OPENAI_API_KEY -asetuksista."""
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = EndpointPool.from_env()
+    return _default_pool
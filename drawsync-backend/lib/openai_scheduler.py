@@ -0,0 +1,223 @@
+# drawsync-backend/lib/openai_scheduler.py
+"""
+OpenAI-kutsujen ajoitus rate limitien mukaan.
+
+Kun usea organisaatio lataa piirustuksia samaan aikaan, yhteiset RPM/TPM-rajat
+täyttyvät ja kutsut kaatuivat 429:ään. Ajoittaja:
+
+- pitää token bucketit pyynnöille ja tokeneille endpointeittain
+  (lib/openai_pool.py); tasot päivitetään vastausten x-ratelimit-* -otsakkeista
+- arvioi kutsun token-kulun etukäteen (prompt + kuvan tiilit + vastausvara)
+- jonottaa kutsut org-kohtaisiin jonoihin ja jakaa vuorot round-robinina,
+  jolloin yksi iso erä ei tukki muiden organisaatioiden kutsuja
+- myöntää vuoron endpointille, jolla on tilaa ja paras vasteaika
+- kutsuja odottaa enintään OPENAI_QUEUE_MAX_WAIT_S, sitten QueueTimeout
+
+Jonon syvyys, odotusajat ja endpointien tila näkyvät metrics()-funktiosta
+(/metrics/openai).
+"""
+from __future__ import annotations
+
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Mapping, Optional, Tuple
+
+from lib.openai_pool import Endpoint, EndpointPool, default_pool
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+# OpenAI-kuvatokenit: 85 pohja + 170 per 512 px tiili (detail=high), low = 85
+IMAGE_BASE_TOKENS = 85
+IMAGE_TILE_TOKENS = 170
+CHARS_PER_TOKEN = 4
+
+
+class QueueTimeout(TimeoutError):
+    """Kutsu ei saanut vuoroa rate limit -jonosta sallitussa ajassa."""
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+# ---------------------------
+# Token-arvio
+# ---------------------------
+
+def image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """OpenAI:n julkaisema kuvatokenien kaava (sovitus 2048 -> lyhyt sivu 768 -> 512 px tiilet)."""
+    if detail == "low" or width <= 0 or height <= 0:
+        return IMAGE_BASE_TOKENS
+    scale = min(1.0, 2048.0 / max(width, height))
+    w, h = width * scale, height * scale
+    scale = min(1.0, 768.0 / min(w, h))
+    w, h = w * scale, h * scale
+    return IMAGE_BASE_TOKENS + IMAGE_TILE_TOKENS * math.ceil(w / 512) * math.ceil(h / 512)
+
+
+def estimate_tokens(prompt_chars: int, image_size: Optional[tuple] = None, detail: str = "high") -> int:
+    """Arvioitu kokonaiskulu: prompt (~4 merkkiä/token) + kuva + vastausvara (OPENAI_EST_OUTPUT_TOKENS)."""
+    tokens = math.ceil(prompt_chars / CHARS_PER_TOKEN)
+    if image_size:
+        tokens += image_tokens(image_size[0], image_size[1], detail)
+    return tokens + int(_env_float("OPENAI_EST_OUTPUT_TOKENS", 1500))
+
+
+# ---------------------------
+# Reilu jono
+# ---------------------------
+
+class _Waiter:
+    __slots__ = ("tenant", "cost", "future", "enqueued")
+
+    def __init__(self, tenant: str, cost: int, future: asyncio.Future):
+        self.tenant = tenant
+        self.cost = cost
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class OpenAIScheduler:
+    """
+    Org-kohtaiset FIFO-jonot, vuorot round-robinina. Jonon kärki odottaa,
+    kunnes jollain endpointilla on tilaa (ei ohituksia -> iso kutsu ei nälkiinny).
+    """
+
+    def __init__(self, pool: Optional[EndpointPool] = None, max_wait_s: Optional[float] = None):
+        self._pool = pool  # None = default_pool() ensimmäisellä käytöllä
+        self.max_wait_s = max_wait_s if max_wait_s is not None else _env_float("OPENAI_QUEUE_MAX_WAIT_S", 60.0)
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._waits: Deque[float] = deque(maxlen=500)
+        self._counters = {"granted": 0, "queued": 0, "timeouts": 0, "rate_limited": 0}
+
+    @property
+    def pool(self) -> EndpointPool:
+        if self._pool is None:
+            self._pool = default_pool()
+        return self._pool
+
+    # --- julkinen rajapinta ---
+
+    async def acquire(self, tenant: Optional[str], cost: int, timeout: Optional[float] = None) -> Tuple[Endpoint, float]:
+        """
+        Odota vuoroa ja varaa 1 pyyntö + cost tokenia valitulta endpointilta.
+        Palauttaa (endpoint, aloitusaika); kutsujan on ilmoitettava lopputulos
+        release()/cancel():lla samalla aloitusajalla.
+        Aikaraja (min(timeout, max_wait_s)) -> QueueTimeout.
+        """
+        tenant = tenant or DEFAULT_TENANT
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(tenant, cost, loop.create_future())
+        self._queues.setdefault(tenant, deque()).append(waiter)
+        self._pump()
+        if not waiter.future.done():
+            self._counters["queued"] += 1
+
+        limit = self.max_wait_s if timeout is None else min(timeout, self.max_wait_s)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=limit)
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                self._remove(waiter)
+                self._counters["timeouts"] += 1
+                raise QueueTimeout(f"OpenAI rate limit queue: no slot within {limit:.0f}s ({tenant})")
+        except asyncio.CancelledError:
+            if not waiter.future.done():
+                self._remove(waiter)
+            elif not waiter.future.cancelled():
+                # Vuoro ehdittiin myöntää: palauta varaus
+                endpoint, started_at = waiter.future.result()
+                endpoint.state.refund(cost)
+                self.cancel(endpoint, started_at)
+            raise
+
+        self._waits.append(time.monotonic() - waiter.enqueued)
+        return waiter.future.result()
+
+    def release(self, endpoint: Endpoint, started_at: float, latency_s: Optional[float], healthy: bool) -> None:
+        """Kutsu valmis: latenssi EWMA:han, healthy=False kasvattaa virhelaskuria."""
+        endpoint.finish(started_at, latency_s, healthy)
+        self._pump()
+
+    def cancel(self, endpoint: Endpoint, started_at: float) -> None:
+        endpoint.cancel(started_at)
+        self._pump()
+
+    def observe_headers(self, endpoint: Endpoint, headers: Optional[Mapping[str, str]]) -> None:
+        endpoint.state.observe_headers(headers)
+        self._pump()
+
+    def observe_rate_limited(self, endpoint: Endpoint, headers: Optional[Mapping[str, str]]) -> None:
+        self._counters["rate_limited"] += 1
+        endpoint.state.observe_rate_limited(headers)
+
+    def settle(self, endpoint: Endpoint, estimated: int, actual: Optional[int]) -> None:
+        """Korjaa token-bucket toteutuneella kulutuksella (usage.total_tokens)."""
+        if actual is not None:
+            endpoint.state.refund(estimated - actual)
+            self._pump()
+
+    def metrics(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        waits = sorted(self._waits)
+        oldest = [q[0].enqueued for q in self._queues.values() if q]
+        return {
+            "queue_depth": sum(len(q) for q in self._queues.values()),
+            "queue_depth_by_tenant": {t: len(q) for t, q in self._queues.items() if q},
+            "oldest_wait_s": round(now - min(oldest), 3) if oldest else 0.0,
+            "wait_s_avg": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "wait_s_p95": round(waits[int(len(waits) * 0.95) - 1 if len(waits) > 1 else 0], 3) if waits else 0.0,
+            "wait_s_max": round(waits[-1], 3) if waits else 0.0,
+            "max_wait_s": self.max_wait_s,
+            **self._counters,
+            "endpoints": self.pool.snapshot(),
+        }
+
+    # --- sisäiset ---
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = self._queues.get(waiter.tenant)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+        if queue is not None and not queue:
+            self._queues.pop(waiter.tenant, None)
+        self._pump()
+
+    def _pump(self) -> None:
+        """Myönnä vuoroja round-robinina niin kauan kuin jollain endpointilla on tilaa."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queues:
+            tenant, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            if waiter.future.done():  # peruttu odottaja
+                queue.popleft()
+                if not queue:
+                    self._queues.pop(tenant)
+                continue
+            endpoint, wait = self.pool.pick(waiter.cost)
+            if endpoint is None:
+                loop = asyncio.get_running_loop()
+                self._timer = loop.call_later(min(max(wait, 0.001), 1.0), self._pump)
+                return
+            endpoint.state.take(waiter.cost)
+            queue.popleft()
+            waiter.future.set_result((endpoint, endpoint.start()))
+            self._counters["granted"] += 1
+            # Reiluus: palvellun orgin jono kiertää viimeiseksi
+            self._queues.pop(tenant)
+            if queue:
+                self._queues[tenant] = queue
+
+
+scheduler = OpenAIScheduler()
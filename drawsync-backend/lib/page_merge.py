@@ -0,0 +1,143 @@
+# drawsync-backend/lib/page_merge.py
+"""
+Monisivuisen PDF:n sivukohtaisten GPT-tulosten yhdistäminen yhdeksi
+industry-vastaukseksi.
+
+- listarivit (materiaalilista, toleranssit, koneistusoperaatiot, reiät)
+  yhdistetään ja jokaiseen lisätään "sivu" (mistä sivusta rivi tuli)
+- dict-kentissä ensimmäinen ei-tyhjä arvo voittaa, myöhemmät sivut
+  täydentävät puuttuvia arvoja
+- huomiot yhdistetään sivuviitteellä
+- yhteenvedot lasketaan uudelleen industry-validoinnilla
+"""
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, List, Tuple
+
+from lib.gpt_utils import validate_and_enhance_result
+
+logger = logging.getLogger(__name__)
+
+# Kentät, joiden listarivit yhdistetään sivuviitteellä
+_ROW_LIST_FIELDS = {"materiaalilista", "toleranssit", "koneistusoperaatiot", "reiät"}
+# Kentät, joita ei yhdistetä sisällöllisesti
+_META_FIELDS = {"processing_info", "industry_type", "success", "error", "huomiot", "yhteenveto"}
+
+
+def is_empty(value: Any) -> bool:
+    """Puuttuva arvo: None, tyhjä merkkijono/lista/dict, "null" tai numero 0."""
+    if value is None:
+        return True
+    if isinstance(value, (str, list, dict)) and len(value) == 0:
+        return True
+    if isinstance(value, str) and value.strip().lower() in ("", "null"):
+        return True
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value == 0
+
+
+def _tag_rows(rows: list, page: int) -> list:
+    out = []
+    for row in rows:
+        if isinstance(row, dict):
+            row = {**row, "sivu": page}
+        out.append(row)
+    return out
+
+
+def _merge_into(target: Dict[str, Any], source: Dict[str, Any], page: int) -> None:
+    for key, value in source.items():
+        if key in _ROW_LIST_FIELDS and isinstance(value, list):
+            target.setdefault(key, [])
+            target[key].extend(_tag_rows(value, page))
+        elif isinstance(value, dict):
+            current = target.get(key)
+            if not isinstance(current, dict):
+                current = target[key] = {}
+            _merge_into(current, value, page)
+        elif is_empty(target.get(key)) and not is_empty(value):
+            target[key] = value
+        else:
+            target.setdefault(key, value)
+
+
+def _page_entry(page: int, result: Dict[str, Any]) -> Dict[str, Any]:
+    info = result.get("processing_info") or {}
+    entry = {
+        "page": page,
+        "success": result.get("success") is not False,
+        "processing_time": info.get("processing_time"),
+    }
+    for key in ("render", "ocr_source", "model_tier", "confidence", "cascade"):
+        if info.get(key) is not None:
+            entry[key] = info[key]
+    return entry
+
+
+def merge_page_results(pages: List[Tuple[int, Dict[str, Any]]], industry_type: str) -> Dict[str, Any]:
+    """
+    Yhdistä [(sivunumero, tulos), ...] yhdeksi vastaukseksi.
+
+    Yksisivuinen tulos palautetaan sellaisenaan (vain sivumeta lisätään),
+    jotta vanhat vastaukset eivät muutu.
+    """
+    if not pages:
+        raise ValueError("No page results to merge")
+
+    page_info = [_page_entry(page, result) for page, result in pages]
+
+    if len(pages) == 1:
+        result = pages[0][1]
+        info = result.setdefault("processing_info", {})
+        info["page_count"] = 1
+        info["pages"] = page_info
+        return result
+
+    ok = [(page, r) for page, r in pages if r.get("success") is not False]
+    failed = [(page, r) for page, r in pages if r.get("success") is False]
+
+    if not ok:
+        # Kaikki sivut epäonnistuivat -> palauta ensimmäinen virherakenne
+        merged = pages[0][1]
+    else:
+        merged: Dict[str, Any] = {}
+        for page, result in ok:
+            content = {k: v for k, v in result.items() if k not in _META_FIELDS}
+            _merge_into(merged, content, page)
+        merged["industry_type"] = industry_type
+        merged["yhteenveto"] = {}
+        merged["processing_info"] = dict(ok[0][1].get("processing_info") or {})
+        # Mallikaskadi: koko tuloksen taso = pisimmälle eskaloitu sivu, luottamus = heikoin sivu
+        infos = [r.get("processing_info") or {} for _, r in ok]
+        deepest = max(infos, key=lambda i: len(i.get("cascade") or []))
+        for key in ("model_tier", "model_used"):
+            if key in deepest:
+                merged["processing_info"][key] = deepest[key]
+        merged["processing_info"].pop("cascade", None)
+        confidences = [i["confidence"] for i in infos if isinstance(i.get("confidence"), (int, float))]
+        if confidences:
+            merged["processing_info"]["confidence"] = min(confidences)
+
+    notes: List[str] = []
+    for page, result in pages:
+        for note in result.get("huomiot") or []:
+            notes.append(f"[s. {page}] {note}")
+    for page, result in failed:
+        notes.append(f"[s. {page}] Sivun analyysi epäonnistui: {result.get('error', 'tuntematon virhe')}")
+    merged["huomiot"] = notes
+
+    if ok:
+        merged = validate_and_enhance_result(merged, industry_type)
+        # Validointi voi lisätä jo olemassa olevia huomioita uudelleen
+        merged["huomiot"] = list(dict.fromkeys(merged.get("huomiot") or []))
+
+    info = merged.setdefault("processing_info", {})
+    times = [p["processing_time"] for p in page_info if isinstance(p["processing_time"], (int, float))]
+    if times:
+        # Sivut analysoidaan rinnakkain: seinäkelloaika = hitain sivu
+        info["processing_time"] = max(times)
+    info["page_count"] = len(pages)
+    info["pages"] = page_info
+
+    logger.info(f"Merged {len(pages)} page results for {industry_type} ({len(failed)} failed)")
+    return merged
@@ -0,0 +1,141 @@
+# drawsync-backend/lib/partial_json.py
+"""
+Keskeneräisen JSON-tekstin jäsennys GPT-striimausta varten.
+
+Malli kirjoittaa vastauksen objektin kerrallaan ({"perustiedot": {...},
+"materiaalilista": [...]}). parse_partial_json palauttaa tähänastisen tekstin
+parhaan jäsennettävän tulkinnan (avoimet merkkijonot, listat ja objektit
+suljetaan, keskeneräinen avain/luku jätetään pois) sekä listan ylätason
+avaimista, joiden arvo on jo kokonaan kirjoitettu. UI voi näyttää valmiin
+"perustiedot"-lohkon ennen kuin "materiaalilista" on valmis.
+"""
+from __future__ import annotations
+
+import re
+import json
+from typing import Any, List, Optional, Tuple
+
+_CLOSER = {"{": "}", "[": "]"}
+# Keskeneräinen \u-escape merkkijonon lopussa ("\u12")
+_TRAILING_UNICODE = re.compile(r"\\u[0-9a-fA-F]{0,3}$")
+
+
+def _closers(stack: List[str]) -> str:
+    return "".join(_CLOSER[c] for c in reversed(stack))
+
+
+class PartialJsonParser:
+    """
+    Inkrementaalinen versio: feed() käy läpi vain uuden palan, joten koko
+    striimin jäsennys on O(n) eikä O(n²). value() rakentaa tulkinnan
+    tähänastisesta tekstistä (json.loads, C-toteutus) vain kun sitä pyydetään.
+    """
+
+    def __init__(self) -> None:
+        self._chunks: List[str] = []
+        self._length = 0
+        self._stack: List[str] = []
+        self._expect_key: List[bool] = []  # per objekti: onko seuraava merkkijono avain
+        self._in_str = self._escape = self._str_is_key = False
+        self._key_chars: List[str] = []
+        self._safe_cut, self._safe_closers = 0, ""
+        self._top_key: Optional[str] = None
+        self._stopped = False  # ylimääräinen sulku: loppua ei enää tulkita
+        self.completed: List[str] = []
+
+    def feed(self, chunk: str) -> None:
+        self._chunks.append(chunk)
+        offset = self._length
+        self._length += len(chunk)
+        if self._stopped:
+            return
+        stack, expect_key = self._stack, self._expect_key
+        for j, c in enumerate(chunk):
+            i = offset + j
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_str = False
+                    if self._str_is_key:
+                        if len(stack) == 1:
+                            try:
+                                self._top_key = json.loads("".join(self._key_chars) + '"')
+                            except ValueError:
+                                self._top_key = None
+                    else:
+                        self._safe_cut, self._safe_closers = i + 1, _closers(stack)
+                    continue
+                if self._str_is_key:
+                    self._key_chars.append(c)
+                continue
+
+            if c == '"':
+                self._in_str = True
+                self._str_is_key = bool(stack) and stack[-1] == "{" and expect_key[-1]
+                self._key_chars = ['"'] if self._str_is_key and len(stack) == 1 else []
+            elif c in "{[":
+                stack.append(c)
+                expect_key.append(c == "{")
+                self._safe_cut, self._safe_closers = i + 1, _closers(stack)
+            elif c in "}]":
+                if not stack:
+                    self._stopped = True
+                    return
+                stack.pop()
+                expect_key.pop()
+                if not stack and self._top_key is not None:
+                    self.completed.append(self._top_key)  # viimeinen ylätason avain sulkeutui
+                    self._top_key = None
+                self._safe_cut, self._safe_closers = i + 1, _closers(stack)
+            elif c == ",":
+                if stack and stack[-1] == "{":
+                    expect_key[-1] = True
+                if len(stack) == 1 and self._top_key is not None:
+                    self.completed.append(self._top_key)
+                    self._top_key = None
+                self._safe_cut, self._safe_closers = i, _closers(stack)
+            elif c == ":":
+                if expect_key:
+                    expect_key[-1] = False
+
+    def text(self) -> str:
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def value(self) -> Optional[Any]:
+        """Tähänastisen tekstin paras tulkinta (None, jos ei vielä mitään)."""
+        text = self.text()
+        if not self._stack and not self._in_str:
+            try:
+                return json.loads(text)
+            except ValueError:
+                pass
+
+        if self._in_str and not self._str_is_key:
+            # Kesken oleva merkkijonoarvo näytetään sellaisenaan
+            head = text[:-1] if self._escape else _TRAILING_UNICODE.sub("", text)
+            try:
+                return json.loads(head + '"' + _closers(self._stack))
+            except ValueError:
+                pass
+
+        if self._safe_cut:
+            try:
+                return json.loads(text[:self._safe_cut] + self._safe_closers)
+            except ValueError:
+                pass
+        return None
+
+
+def parse_partial_json(text: str) -> Tuple[Optional[Any], List[str]]:
+    """
+    (arvo, valmiit ylätason avaimet). Arvo on None, jos tekstistä ei vielä
+    saa mitään jäsennettävää. Valmiin JSONin kohdalla sama kuin json.loads.
+    """
+    parser = PartialJsonParser()
+    parser.feed(text)
+    return parser.value(), list(parser.completed)
@@ -0,0 +1,454 @@
+# drawsync-backend/lib/pdf_render.py
+"""
+PDF-sivujen rasterointi Vision/GPT-käyttöön.
+
+Monisivuiset PDF:t jaetaan sivuryhmiin, jotka rasteroidaan prosessipoolissa
+rinnakkain. Jokainen worker avaa dokumentin kerran ja renderöi kaikki omat
+sivunsa samasta avatusta dokumentista.
+
+Renderöintitavat (PDF_RENDER_MODE):
+- full: koko sivu yhteen pixmapiin -> encode_for_vision
+- band: sivu renderöidään vaakakaistoina (clip-rect) suoraan PNG-virtaan,
+  jolloin muistihuippu pysyy PDF_RENDER_MEM_CEILING_MB:n alla arkin koosta riippumatta
+- auto (oletus): band, jos koko sivun pixmap ylittäisi muistikaton
+
+Viivapiirustustila (VISION_LINE_ART=auto tai industry-configin
+vision.line_art) tallentaa mustavalkoiset/vähäväriset sivut 1-bit- tai
+palettikuvina; valokuvat ja värikkäät sivut pysyvät RGB:nä.
+
+Marginaalien rajaus (VISION_CROP, ks. lib.ink_crop) haetaan pienestä
+esikatselusta ja annetaan renderöinnille clip-alueena, joten tyhjää
+arkkia ei rasteroida lainkaan.
+"""
+from __future__ import annotations
+
+import os
+import math
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional, Union
+
+try:
+    import fitz  # PyMuPDF
+except Exception:
+    fitz = None
+
+import numpy as np
+from PIL import Image
+
+from lib.ocr_image_prep import encode_for_vision_ex, fit_scale, detect_line_art, line_art_mode
+from lib.png_stream import PngStreamWriter
+from lib.ink_crop import find_ink_bbox, crop_info, crop_mode
+from lib.pdf_text import text_layer_ocr
+from lib.memstats import peak_rss_bytes, to_mb, MB
+from lib.concurrency import run_cpu, run_in_process, process_workers
+
+log = logging.getLogger(__name__)
+
+DEFAULT_DPI = 220
+DEFAULT_PIXEL_BUDGET = 40_000_000   # ~ A1 @ 220 DPI, A0 renderöidään pienemmällä DPI:llä
+MAX_LONG_SIDE = 10_000              # sama raja kuin encode_for_vision
+MAX_IMAGE_BYTES = 18 * 1024 * 1024  # sama raja kuin encode_for_vision
+DEFAULT_MEM_CEILING_MB = 64
+RENDER_MODES = ("auto", "full", "band")
+VISION_SUPERSAMPLE = 2              # GPT-variantti renderöidään 2x ja skaalataan LANCZOSilla (ohuet viivat säilyvät)
+LINE_ART_PROBE_LONG_SIDE = 2400     # band-tilan tunnistus tehdään tämän kokoisesta esikatselusta
+CROP_PROBE_LONG_SIDE = 1500         # marginaalien haku tehdään tämän kokoisesta esikatselusta
+BILEVEL_THRESHOLD = 176             # sama kynnys kuin ocr_image_prep.to_line_art
+
+
+PdfSource = Union[bytes, str]  # tavut tai polku
+
+
+class PdfRenderError(ValueError):
+    """PDF:ää ei voitu avata tai renderöidä (kutsuja muuntaa 400-virheeksi)."""
+
+
+def max_pages() -> int:
+    try:
+        return max(1, int(os.getenv("PDF_MAX_PAGES", "10")))
+    except ValueError:
+        return 10
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def render_dpi() -> int:
+    return _env_int("PDF_RENDER_DPI", DEFAULT_DPI)
+
+
+def pixel_budget() -> int:
+    return _env_int("PDF_PIXEL_BUDGET", DEFAULT_PIXEL_BUDGET)
+
+
+def render_mode() -> str:
+    mode = os.getenv("PDF_RENDER_MODE", "auto").strip().lower()
+    return mode if mode in RENDER_MODES else "auto"
+
+
+def memory_ceiling() -> int:
+    return _env_int("PDF_RENDER_MEM_CEILING_MB", DEFAULT_MEM_CEILING_MB) * MB
+
+
+@dataclass(frozen=True)
+class RenderOptions:
+    """Renderöinnin asetukset yhtenä (picklattavana) oliona prosessipoolin workereille."""
+    dpi: int = DEFAULT_DPI
+    max_pixels: int = DEFAULT_PIXEL_BUDGET
+    mode: str = "auto"
+    ceiling: int = DEFAULT_MEM_CEILING_MB * MB
+    need_ocr: bool = False
+    vision_limits: Optional[tuple] = None
+    line_art: str = "off"
+    crop: str = "off"
+
+    @classmethod
+    def from_env(
+        cls,
+        dpi: int | None = None,
+        need_ocr: bool = False,
+        vision_limits: tuple | None = None,
+        line_art: str | None = None,
+        crop: str | None = None,
+    ) -> "RenderOptions":
+        return cls(
+            dpi=dpi or render_dpi(),
+            max_pixels=pixel_budget(),
+            mode=render_mode(),
+            ceiling=memory_ceiling(),
+            need_ocr=need_ocr,
+            vision_limits=vision_limits,
+            line_art=line_art_mode(line_art),
+            crop=crop_mode(crop),
+        )
+
+
+def choose_zoom(width_pt: float, height_pt: float, dpi: int, max_pixels: int, max_long_side: int = MAX_LONG_SIDE) -> float:
+    """
+    Valitse renderöintizoom sivun koosta (pisteinä) ja pikselibudjetista.
+
+    Lähtökohta on dpi/72. Jos tulos ylittäisi pikselibudjetin tai pitkän
+    sivun rajan, zoomia pienennetään jo renderöinnissä – isoa arkkia ei
+    rasteroida täydellä resoluutiolla vain skaalattavaksi heti alas.
+    """
+    zoom = dpi / 72.0
+    if width_pt <= 0 or height_pt <= 0:
+        return zoom
+    pixels = (width_pt * zoom) * (height_pt * zoom)
+    if pixels > max_pixels:
+        zoom *= math.sqrt(max_pixels / pixels)
+    long_pt = max(width_pt, height_pt)
+    if long_pt * zoom > max_long_side:
+        zoom = max_long_side / long_pt
+    return zoom
+
+
+def _open(source: PdfSource):
+    """source = PDF:n tavut tai polku (levylle spoolattu upload, ks. lib.upload_spool)."""
+    if fitz is None:
+        raise RuntimeError("PDF support (PyMuPDF) not available")
+    try:
+        if isinstance(source, str):
+            return fitz.open(source, filetype="pdf")
+        return fitz.open(stream=source, filetype="pdf")
+    except Exception:
+        raise PdfRenderError("Invalid PDF")
+
+
+def page_count(source: PdfSource) -> int:
+    doc = _open(source)
+    try:
+        return doc.page_count
+    finally:
+        doc.close()
+
+
+def pixmap_to_image(pix) -> Image.Image:
+    """
+    Kääri fitz.Pixmapin samples-puskuri PIL-kuvaksi ilman kopiota.
+
+    Pixmapin on pysyttävä elossa niin kauan kuin kuvaa käytetään.
+    """
+    mode = "L" if pix.n == 1 else "RGB"
+    return Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride, 1)
+
+
+def render_page_image(
+    page,
+    dpi: int = DEFAULT_DPI,
+    max_pixels: int = DEFAULT_PIXEL_BUDGET,
+    mode: str = "full",
+) -> bytes:
+    """
+    Rasteroi yksi sivu ja enkoodaa se suoraan lopulliseen muotoon.
+
+    Yksi enkoodaus per sivu: pixmap -> PIL (sama puskuri) -> encode_for_vision,
+    ei pix.tobytes("png") + uudelleendekoodausta.
+    """
+    return render_page(page, dpi, max_pixels, mode)["image"]
+
+
+def render_page(
+    page,
+    dpi: int = DEFAULT_DPI,
+    max_pixels: int = DEFAULT_PIXEL_BUDGET,
+    mode: str = "auto",
+    ceiling: int = DEFAULT_MEM_CEILING_MB * MB,
+    line_art: str = "off",
+    clip=None,
+) -> Dict[str, Any]:
+    """
+    render_page_image + renderöintimeta (todellinen DPI, pikselikoko, muistihuippu).
+    clip = rajattu alue sivun koordinaateissa (page_crop_rect); zoom valitaan sen koosta.
+    """
+    # page.rect = näkyvä alue (cropbox, rotaatio huomioitu) eli se mitä get_pixmap piirtää
+    rect = clip or page.rect
+    zoom = choose_zoom(rect.width, rect.height, dpi, max_pixels)
+    full_bytes = (rect.width * zoom) * (rect.height * zoom) * 3
+
+    if mode == "band" or (mode == "auto" and full_bytes > ceiling):
+        bilevel = line_art == "auto" and _detect_page_line_art(page) == "1"
+        image, width, height, zoom, peak, passes = _render_banded(page, zoom, ceiling, bilevel=bilevel, clip=clip)
+        encode = {
+            "format": "PNG", "encode_passes": passes, "probe_passes": 0,
+            "line_art": "1" if bilevel else None, "bytes": len(image),
+        }
+        used = "band"
+    else:
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+        image, encode = encode_for_vision_ex(pixmap_to_image(pix), line_art=line_art)
+        width, height, peak = pix.width, pix.height, len(pix.samples_mv) + len(image)
+        used = "full"
+
+    render = {
+        "dpi": round(zoom * 72.0),
+        "width": width,
+        "height": height,
+        "mode": used,
+        "peak_buffer_mb": to_mb(peak),
+        "rss_peak_mb": to_mb(peak_rss_bytes()),
+        "encode": encode,
+    }
+    if clip is not None:
+        render["crop"] = _clip_info(page, clip, zoom, width, height)
+    return {"image": image, "render": render}
+
+
+def render_vision_variant(page, limits: tuple, dpi: int = DEFAULT_DPI, line_art: str = "off", clip=None) -> Dict[str, Any]:
+    """
+    Renderöi GPT-visionille menevä variantti suoraan vektoreista mallin
+    efektiiviseen resoluutioon (limits = (pitkä sivu, lyhyt sivu)).
+    Ei riipu OCR-kuvasta, joten sitä ei tarvitse renderöidä, jos OCR:ää ei ajeta.
+    """
+    rect = clip or page.rect
+    base_zoom = dpi / 72.0
+    target_zoom = base_zoom * fit_scale(rect.width * base_zoom, rect.height * base_zoom, limits[0], limits[1])
+    render_zoom = min(base_zoom, target_zoom * VISION_SUPERSAMPLE)
+
+    pix = page.get_pixmap(matrix=fitz.Matrix(render_zoom, render_zoom), clip=clip, alpha=False)
+    img = pixmap_to_image(pix)
+    target = (max(int(rect.width * target_zoom), 1), max(int(rect.height * target_zoom), 1))
+    if img.size != target and target[0] < img.size[0]:
+        img = img.resize(target, Image.LANCZOS)
+    image, encode = encode_for_vision_ex(img, line_art=line_art, allow_bilevel=False)
+    return {"image": image, "width": img.size[0], "height": img.size[1], "bytes": len(image), "encode": encode}
+
+
+def _preview(page, long_side: int):
+    """Pieni esikatselu-pixmap (pidettävä elossa kuvan ajan) + sen zoom."""
+    rect = page.rect
+    zoom = min(1.0, long_side / max(rect.width, rect.height, 1.0))
+    return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False), zoom
+
+
+def page_crop_rect(page, mode: str):
+    """
+    Musteen rajauslaatikko sivun koordinaateissa (fitz.Rect) tai None.
+    Haetaan esikatselusta, jotta täyttä sivua ei tarvitse rasteroida kahdesti.
+    """
+    if mode == "off":
+        return None
+    pix, zoom = _preview(page, CROP_PROBE_LONG_SIDE)
+    box = find_ink_bbox(pixmap_to_image(pix), mode)
+    if box is None:
+        return None
+    rect = page.rect
+    clip = fitz.Rect(
+        rect.x0 + box[0] / zoom, rect.y0 + box[1] / zoom,
+        rect.x0 + box[2] / zoom, rect.y0 + box[3] / zoom,
+    )
+    return clip & rect
+
+
+def _clip_info(page, clip, zoom: float, width: int, height: int) -> Dict[str, Any]:
+    # Offset renderöidyn kuvan mittakaavassa: rajaamaton sivu samalla zoomilla
+    rect = page.rect
+    info = crop_info(
+        (round((clip.x0 - rect.x0) * zoom), round((clip.y0 - rect.y0) * zoom), 0, 0),
+        (round(rect.width * zoom), round(rect.height * zoom)),
+    )
+    info.update(width=width, height=height, rect_pt=[round(v, 2) for v in clip])
+    return info
+
+
+def _detect_page_line_art(page) -> Optional[str]:
+    # Band-tilassa koko sivua ei ole muistissa -> tunnistus pienestä esikatselusta
+    pix, _ = _preview(page, LINE_ART_PROBE_LONG_SIDE)
+    return detect_line_art(pixmap_to_image(pix))
+
+
+def _pack_bilevel(samples, stride: int, rows: int, width: int, channels: int) -> bytes:
+    """RGB/L-kaista -> 1-bit rivit (1 = valkoinen), 8 pikseliä tavussa."""
+    arr = np.frombuffer(samples, dtype=np.uint8, count=stride * rows).reshape(rows, stride)
+    arr = arr[:, :width * channels].reshape(rows, width, channels)
+    # Tummin kanava: värillinenkin viiva lasketaan mustaksi
+    light = arr.min(axis=2) >= BILEVEL_THRESHOLD
+    return np.packbits(light, axis=1).tobytes()
+
+
+def _render_banded(page, zoom: float, ceiling: int, max_bytes: int = MAX_IMAGE_BYTES, bilevel: bool = False, clip=None):
+    """
+    Renderöi sivu vaakakaistoina suoraan PNG-virtaan.
+
+    Kaistan korkeus valitaan niin, että kaistan pixmap + suodatinkopio
+    mahtuvat muistikattoon. Jos PNG ylittää max_bytes, zoomia pienennetään
+    ja yritetään uudelleen (enint. 3 kertaa). bilevel=True kirjoittaa 1-bit PNG:n.
+
+    Palauttaa (png, leveys, korkeus, zoom, muistihuippu, enkoodauskierrokset).
+    """
+    area = clip or page.rect
+    for attempt in range(1, 4):
+        mat = fitz.Matrix(zoom, zoom)
+        inv = ~mat
+        full = (area * mat).irect
+        width, height = full.width, full.height
+        # pixmap + rivisuodatuksen kopio ~ 2x kaistan raakakoko
+        band_rows = max(16, int(ceiling // max(width * 3 * 2, 1)))
+
+        if bilevel:
+            writer = PngStreamWriter(width, height, channels=1, bit_depth=1)
+        else:
+            writer = PngStreamWriter(width, height, channels=3)
+        peak = 0
+        y = 0
+        while y < height:
+            y1 = min(height, y + band_rows)
+            band_rect = fitz.Rect(full.x0, full.y0 + y, full.x1, full.y0 + y1) * inv
+            pix = page.get_pixmap(matrix=mat, clip=band_rect, alpha=False)
+            got = min(pix.height, y1 - y)
+            if bilevel:
+                packed = _pack_bilevel(pix.samples_mv, pix.stride, got, width, pix.n)
+                writer.write_rows(packed, (width + 7) // 8, got)
+            else:
+                writer.write_rows(pix.samples_mv, pix.stride, got)
+            writer.write_blank_rows((y1 - y) - got)
+            peak = max(peak, len(pix.samples_mv) * 2 + writer.bytes_written)
+            del pix
+            y = y1
+
+        image = writer.finish()
+        if len(image) <= max_bytes:
+            break
+        if attempt == 3:
+            # Palautettu zoom vastaa palautettua kuvaa; ylisuuri kuva vain lokitetaan
+            log.warning(f"Banded PNG {len(image)} B still > {max_bytes} B after {attempt} attempts")
+            break
+        log.warning(f"Banded PNG {len(image)} B > {max_bytes} B, lowering zoom")
+        zoom *= math.sqrt(max_bytes / len(image)) * 0.9
+
+    return image, width, height, zoom, peak, attempt
+
+
+def render_pages(source: PdfSource, page_indexes: List[int], opts: RenderOptions) -> List[Dict[str, Any]]:
+    """
+    Worker-runko: avaa dokumentin kerran ja renderöi annetut sivut (0-indeksi).
+
+    Palauttaa listan sivuja:
+      {"page": 1-indeksi,
+       "ocr_image": täyden resoluution kuva OCR:lle tai None,
+       "vision_image": GPT:lle menevä kuva (vision_limits-kokoinen),
+       "text_layer": OCR-muotoinen dict tai None,
+       "render": meta}
+
+    need_ocr=True lukee ensin tekstikerroksen; täyden resoluution OCR-kuva
+    renderöidään vain, jos tekstikerros ei riitä.
+    Top-level-funktio, jotta se voidaan ajaa prosessipoolissa; polkuna
+    annettu PDF avataan workerissa levyltä eikä sitä picklata prosessien välillä.
+    """
+    doc = _open(source)
+    try:
+        out = []
+        for index in page_indexes:
+            page = doc.load_page(index)
+            text_layer = text_layer_ocr(page) if opts.need_ocr else None
+            render_ocr = opts.need_ocr and not text_layer
+            item = {"page": index + 1, "ocr_image": None, "text_layer": text_layer, "render": {}}
+            clip = page_crop_rect(page, opts.crop)
+
+            if render_ocr or not opts.vision_limits:
+                full = render_page(page, opts.dpi, opts.max_pixels, opts.mode, opts.ceiling, opts.line_art, clip)
+                item["render"] = full["render"]
+                item["ocr_image"] = full["image"] if render_ocr else None
+                item["vision_image"] = full["image"]
+
+            if opts.vision_limits:
+                variant = render_vision_variant(page, opts.vision_limits, opts.dpi, opts.line_art, clip)
+                item["vision_image"] = variant.pop("image")
+                item["render"]["vision"] = variant
+                if clip is not None and "crop" not in item["render"]:
+                    zoom = variant["width"] / clip.width
+                    item["render"]["crop"] = _clip_info(page, clip, zoom, variant["width"], variant["height"])
+            out.append(item)
+        return out
+    finally:
+        doc.close()
+
+
+def _split(indexes: List[int], groups: int) -> List[List[int]]:
+    # Round-robin: jokaiselle workerille tasainen määrä sivuja
+    return [indexes[i::groups] for i in range(groups) if indexes[i::groups]]
+
+
+async def render_pdf(
+    source: PdfSource,
+    dpi: int | None = None,
+    limit: int | None = None,
+    need_ocr: bool = False,
+    vision_limits: tuple | None = None,
+    line_art: str | None = None,
+    crop: str | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    Rasteroi PDF:n sivut (enintään PDF_MAX_PAGES) ja palauta ne sivujärjestyksessä.
+
+    DPI (PDF_RENDER_DPI) on yläraja: isot arkit renderöidään pikselibudjetin
+    (PDF_PIXEL_BUDGET) mukaan pienemmällä zoomilla.
+
+    Yksisivuinen PDF renderöidään CPU-säiepoolissa (ei IPC-kopiointia),
+    monisivuiset prosessipoolissa niin, että kokonaisaika seuraa hitainta
+    sivuryhmää eikä sivujen summaa.
+    """
+    total = await run_cpu(page_count, source)
+    if total == 0:
+        raise PdfRenderError("PDF has no pages")
+
+    opts = RenderOptions.from_env(dpi, need_ocr, vision_limits, line_art, crop)
+    limit = limit or max_pages()
+    indexes = list(range(min(total, limit)))
+    if total > limit:
+        log.warning(f"PDF has {total} pages, analysing first {limit}")
+
+    if len(indexes) == 1:
+        return await run_cpu(render_pages, source, indexes, opts)
+
+    groups = _split(indexes, min(process_workers(), len(indexes)))
+    chunks = await asyncio.gather(*(run_in_process(render_pages, source, g, opts) for g in groups))
+    pages = [p for chunk in chunks for p in chunk]
+    pages.sort(key=lambda p: p["page"])
+    return pages
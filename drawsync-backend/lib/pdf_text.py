@@ -0,0 +1,64 @@
+# drawsync-backend/lib/pdf_text.py
+"""
+PDF:n tekstikerros OCR:n korvikkeena.
+
+CAD-exporteissa on yleensä oikea tekstikerros, jolloin sanat saadaan
+PyMuPDF:llä suoraan ilman Google Vision -kutsua. Palautettava dict on
+samaa muotoa kuin extract_text_from_image_bytes(..., return_detailed=True),
+joten create_steel_prompt_with_ocr käyttää sitä sellaisenaan (sanataulukko
+"words" PDF-pisteinä).
+"""
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, Optional
+
+from lib.ocr_words import WordTable
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _readable(word: str) -> bool:
+    # Fonttien ilman ToUnicode-taulua tuottama roska: korvausmerkit / ei yhtään alfanumeerista
+    return "�" not in word and any(ch.isalnum() for ch in word)
+
+
+def text_layer_ocr(page) -> Optional[Dict[str, Any]]:
+    """
+    Lue sivun tekstikerros. Palauttaa OCR-muotoisen dictin, jos teksti on
+    riittävän rikasta (PDF_TEXT_MIN_WORDS sanaa, PDF_TEXT_MIN_READABLE osuus
+    luettavia), muuten None -> kutsuja tekee tavallisen Vision-OCR:n.
+    """
+    words = page.get_text("words", sort=True)
+    min_words = _env_int("PDF_TEXT_MIN_WORDS", 20)
+    if len(words) < min_words:
+        return None
+
+    readable = sum(1 for w in words if _readable(w[4]))
+    if readable / len(words) < _env_float("PDF_TEXT_MIN_READABLE", 0.8):
+        return None
+
+    # sort=True: lukujärjestys ylhäältä alas, vasemmalta oikealle (rivit säilyvät)
+    text = page.get_text("text", sort=True)
+    return {
+        "status": "success",
+        "text": text,
+        "text_length": len(text),
+        "confidence": 1.0,
+        "quality": "good",
+        "words_found": len(words),
+        "words": WordTable.from_words((w[4], w[0], w[1], w[2], w[3], 1.0) for w in words),
+        "source": "pdf_text_layer",
+    }
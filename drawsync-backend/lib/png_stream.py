@@ -0,0 +1,103 @@
+# drawsync-backend/lib/png_stream.py
+"""
+Rivi kerrallaan kirjoittava PNG-enkooderi.
+
+PIL vaatii koko kuvan muistiin ennen enkoodausta. Tämä kirjoittaja ottaa
+vastaan vaakasuuntaisia kaistoja (esim. PyMuPDF:n clip-renderöinnistä)
+ja pakkaa ne suoraan zlib-virtaan, joten muistissa on kerrallaan vain
+yksi kaista + pakattu tulos.
+"""
+from __future__ import annotations
+
+import io
+import zlib
+import struct
+
+_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_COLOR_TYPES = {1: 0, 3: 2}  # kanavat -> PNG color type (L, RGB)
+_IDAT_FLUSH_BYTES = 256 * 1024
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    crc = zlib.crc32(kind + data) & 0xFFFFFFFF
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+
+class PngStreamWriter:
+    """
+    Käyttö:
+        w = PngStreamWriter(width, height, channels=3)
+        w.write_rows(samples, stride, rows)   # toistuvasti, ylhäältä alas
+        png_bytes = w.finish()
+
+    bit_depth=1 (vain channels=1): mustavalkoinen kuva, rivit annetaan valmiiksi
+    pakattuina (8 pikseliä/tavu, 1 = valkoinen, esim. numpy.packbits).
+    """
+
+    def __init__(self, width: int, height: int, channels: int = 3, level: int = 6, bit_depth: int = 8):
+        if channels not in _COLOR_TYPES:
+            raise ValueError(f"Unsupported channel count: {channels}")
+        if bit_depth not in (1, 8) or (bit_depth == 1 and channels != 1):
+            raise ValueError(f"Unsupported bit depth: {bit_depth}")
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.bit_depth = bit_depth
+        self.rows_written = 0
+        self._row_bytes = (width * channels * bit_depth + 7) // 8
+        self._out = io.BytesIO()
+        self._pending = bytearray()
+        self._z = zlib.compressobj(level)
+
+        self._out.write(_SIGNATURE)
+        ihdr = struct.pack(">IIBBBBB", width, height, bit_depth, _COLOR_TYPES[channels], 0, 0, 0)
+        self._out.write(_chunk(b"IHDR", ihdr))
+
+    @property
+    def bytes_written(self) -> int:
+        return self._out.tell() + len(self._pending)
+
+    def _emit(self, data: bytes) -> None:
+        self._pending += data
+        if len(self._pending) >= _IDAT_FLUSH_BYTES:
+            self._out.write(_chunk(b"IDAT", bytes(self._pending)))
+            self._pending.clear()
+
+    def write_rows(self, samples, stride: int, rows: int) -> None:
+        """
+        Lisää `rows` riviä puskurista (rivin pituus `stride` tavua).
+        Leveämmät rivit katkaistaan, kapeammat täytetään valkoisella.
+        """
+        view = memoryview(samples)
+        rows = min(rows, self.height - self.rows_written, len(view) // stride if stride else 0)
+        if rows <= 0:
+            return
+        take = min(stride, self._row_bytes)
+        pad = b"\xff" * (self._row_bytes - take)
+        raw = bytearray()
+        for r in range(rows):
+            start = r * stride
+            raw += b"\x00"  # filter: None
+            raw += view[start:start + take]
+            if pad:
+                raw += pad
+        self._emit(self._z.compress(bytes(raw)))
+        self.rows_written += rows
+
+    def write_blank_rows(self, rows: int) -> None:
+        """Lisää valkoisia rivejä (esim. jos kaista tuli odotettua matalampana)."""
+        rows = min(rows, self.height - self.rows_written)
+        blank = b"\x00" + b"\xff" * self._row_bytes
+        for _ in range(max(rows, 0)):
+            self._emit(self._z.compress(blank))
+        self.rows_written += max(rows, 0)
+
+    def finish(self) -> bytes:
+        # Jos kaistoja tuli vähemmän kuin ilmoitettu korkeus, täytä valkoisella
+        self.write_blank_rows(self.height - self.rows_written)
+        self._pending += self._z.flush()
+        if self._pending:
+            self._out.write(_chunk(b"IDAT", bytes(self._pending)))
+            self._pending.clear()
+        self._out.write(_chunk(b"IEND", b""))
+        return self._out.getvalue()
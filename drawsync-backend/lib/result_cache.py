@@ -0,0 +1,237 @@
+# drawsync-backend/lib/result_cache.py
+"""
+Sisältöosoitteinen tulosvälimuisti /process-analyyseille.
+
+Avain = sha256(org + tiedoston sha256 + industry_type + promptin hash + malli),
+joten sama PDF samalle organisaatiolle samalla promptilla ja mallilla
+palautuu ilman uutta GPT- tai Vision-kutsua.
+
+Kaksi tasoa:
+- muisti: kokorajattu LRU (entries + tavut), per uvicorn-worker
+- levy (valinnainen): SQLite-tiedosto, jonka kaikki workerit jakavat
+  (RESULT_CACHE_DB=/polku/cache.sqlite3)
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+log = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_cache_key(
+    tenant: str,
+    file_sha256: str,
+    industry_type: str,
+    prompt: str,
+    model: str,
+    *extra: str,
+) -> str:
+    """
+    Rakenna välimuistiavain. tenant on org_slug (tai käyttäjä, jos orgia ei ole).
+    extra: muut tulokseen vaikuttavat asetukset (esim. kuvan detail-taso).
+    """
+    prompt_sha = sha256_hex(prompt.encode("utf-8"))
+    parts = [tenant, file_sha256, industry_type, prompt_sha, model, *extra]
+    return sha256_hex("\x00".join(parts).encode("utf-8"))
+
+
+class ResultCache:
+    """Kaksitasoinen (muisti-LRU + SQLite) JSON-tulosten välimuisti."""
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: int = 64 * 1024 * 1024,
+        db_path: Optional[str] = None,
+        ttl_seconds: int = 7 * 24 * 3600,
+        db_max_entries: int = 10_000,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.db_path = db_path or None
+        self.ttl_seconds = ttl_seconds
+        self.db_max_entries = db_max_entries
+
+        # key -> (stored_at, json-merkkijono). JSON-muoto eristää osumat toisistaan:
+        # jokainen get palauttaa uuden dictin, jota kutsuja saa muokata.
+        self._mem: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        if self.db_path:
+            try:
+                self._init_db()
+            except Exception as e:
+                log.warning(f"Result cache disk tier disabled: {e}")
+                self.db_path = None
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        return cls(
+            max_entries=_env_int("RESULT_CACHE_MAX_ENTRIES", 256),
+            max_bytes=_env_int("RESULT_CACHE_MAX_MB", 64) * 1024 * 1024,
+            db_path=os.getenv("RESULT_CACHE_DB", "").strip() or None,
+            ttl_seconds=_env_int("RESULT_CACHE_TTL_S", 7 * 24 * 3600),
+            db_max_entries=_env_int("RESULT_CACHE_DB_MAX_ENTRIES", 10_000),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or bool(self.db_path)
+
+    # ---------------------------
+    # Muistitaso
+    # ---------------------------
+
+    def _mem_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._mem.get(key)
+            if item is None:
+                return None
+            stored_at, payload = item
+            if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+                self._mem.pop(key)
+                self._mem_bytes -= len(payload)
+                return None
+            self._mem.move_to_end(key)
+            return payload
+
+    def _mem_put(self, key: str, payload: str, stored_at: float) -> None:
+        if self.max_entries <= 0 or len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old is not None:
+                self._mem_bytes -= len(old[1])
+            self._mem[key] = (stored_at, payload)
+            self._mem_bytes += len(payload)
+            while self._mem and (len(self._mem) > self.max_entries or self._mem_bytes > self.max_bytes):
+                _, (_, evicted) = self._mem.popitem(last=False)
+                self._mem_bytes -= len(evicted)
+
+    # ---------------------------
+    # Levytaso (SQLite, jaettu workerien kesken)
+    # ---------------------------
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self) -> None:
+        folder = os.path.dirname(os.path.abspath(self.db_path))
+        os.makedirs(folder, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS result_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " stored_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_stored ON result_cache(stored_at)")
+        conn.commit()
+        log.info(f"Result cache disk tier: {self.db_path}")
+
+    def _disk_get(self, key: str) -> Optional[tuple[float, str]]:
+        if not self.db_path:
+            return None
+        try:
+            row = self._conn().execute(
+                "SELECT stored_at, value FROM result_cache WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            log.warning(f"Result cache read failed: {e}")
+            return None
+        if not row:
+            return None
+        stored_at, payload = row
+        if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+            return None
+        return stored_at, payload
+
+    def _disk_put(self, key: str, payload: str, stored_at: float) -> None:
+        if not self.db_path:
+            return
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO result_cache(key, value, stored_at) VALUES (?, ?, ?)",
+                (key, payload, stored_at),
+            )
+            # Karsi vanhentuneet ja ylimääräiset rivit (halpa, indeksoitu)
+            if self.ttl_seconds:
+                conn.execute("DELETE FROM result_cache WHERE stored_at < ?", (stored_at - self.ttl_seconds,))
+            conn.execute(
+                "DELETE FROM result_cache WHERE key IN ("
+                " SELECT key FROM result_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                (self.db_max_entries,),
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            log.warning(f"Result cache write failed: {e}")
+
+    # ---------------------------
+    # Julkinen API
+    # ---------------------------
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        payload = self._mem_get(key)
+        if payload is None:
+            hit = self._disk_get(key)
+            if hit is None:
+                return None
+            stored_at, payload = hit
+            self._mem_put(key, payload, stored_at)
+        return json.loads(payload)
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        stored_at = time.time()
+        self._mem_put(key, payload, stored_at)
+        self._disk_put(key, payload, stored_at)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """Muistiosuma suoraan loopissa, levyhaku säikeessä."""
+        payload = self._mem_get(key)
+        if payload is not None:
+            return json.loads(payload)
+        if not self.db_path:
+            return None
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, value: Dict[str, Any]) -> None:
+        if self.db_path:
+            await asyncio.to_thread(self.put, key, value)
+        else:
+            self.put(key, value)
+
+
+# Global singleton instance
+result_cache = ResultCache.from_env()
+
+__all__ = ["result_cache", "ResultCache", "make_cache_key", "sha256_hex"]
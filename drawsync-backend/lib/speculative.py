@@ -0,0 +1,93 @@
+# drawsync-backend/lib/speculative.py
+"""
+Spekulatiivinen OCR + GPT steel-piirustuksille (latenssitila).
+
+Oletuksena steel ajaa Vision-OCR:n, rakentaa OCR-rikastetun promptin ja vasta
+sitten kutsuu GPT:tä: OCR:n aika lisätään suoraan vasteaikaan. Latenssitilassa
+GPT-kutsu peruspromptilla lähtee samaan aikaan OCR:n kanssa, ja OCR:n
+valmistuttua rinnalle käynnistetään rikastettu kutsu. Politiikka:
+
+  off          (oletus) ei spekulointia – yksi GPT-kutsu, kustannus ennallaan
+  first_valid  ensimmäinen validoinnit läpäisevä tulos voittaa, toinen perutaan
+  merge        odotetaan molemmat; parempi tulos pohjaksi, toisesta täydennetään
+               puuttuvat kentät ja materiaalirivien tyhjät arvot
+
+Spekulointi maksaa enintään yhden ylimääräisen GPT-kutsun sivua kohden, joten
+se rajataan asiakkaisiin, joille p95-latenssi on kulua tärkeämpi:
+  SPECULATIVE_OCR_POLICY   politiikka (yliajaa industry-configin "speculative_ocr")
+  SPECULATIVE_OCR_TENANTS  pilkuilla eroteltu tenant-lista ("org:acme,org:beta");
+                           tyhjä = kaikki
+PDF:n tekstikerroksen kanssa spekulointia ei tarvita (ei OCR-kutsua).
+"""
+from __future__ import annotations
+
+import os
+import copy
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from lib.industry_config import get_industry_block
+from lib.page_merge import is_empty
+
+log = logging.getLogger(__name__)
+
+POLICIES = ("off", "first_valid", "merge")
+# Materiaalirivit yhdistetään profiilin perusteella
+_ROW_KEYS = {"materiaalilista": "profiili"}
+
+
+def speculative_policy(itype: str, tenant: Optional[str]) -> str:
+    """Politiikka tälle industrylle ja tenantille ("off", jos ei käytössä)."""
+    policy = os.getenv("SPECULATIVE_OCR_POLICY", "").strip().lower()
+    if not policy:
+        try:
+            policy = str(get_industry_block(itype).get("speculative_ocr") or "off").strip().lower()
+        except Exception:
+            policy = "off"
+    if policy not in POLICIES:
+        log.warning(f"Unknown speculative OCR policy {policy!r}, using 'off'")
+        return "off"
+    tenants = {t.strip() for t in os.getenv("SPECULATIVE_OCR_TENANTS", "").split(",") if t.strip()}
+    if policy != "off" and tenants and tenant not in tenants:
+        return "off"
+    return policy
+
+
+# ---------------------------
+# merge-politiikka
+# ---------------------------
+
+def _norm(value: Any) -> str:
+    return "".join(str(value or "").split()).upper()
+
+
+def _fill(target: Dict[str, Any], source: Dict[str, Any], path: str, filled: List[str]) -> None:
+    """Täydennä targetin tyhjät arvot sourcesta (ei yliajoa, ei listojen yhdistämistä)."""
+    for key, value in source.items():
+        if key in ("processing_info", "huomiot", "yhteenveto"):
+            continue
+        here = f"{path}.{key}" if path else key
+        current = target.get(key)
+        if is_empty(current) and not is_empty(value):
+            target[key] = copy.deepcopy(value)
+            filled.append(here)
+        elif isinstance(current, dict) and isinstance(value, dict):
+            _fill(current, value, here, filled)
+        elif key in _ROW_KEYS and isinstance(current, list) and isinstance(value, list):
+            match_key = _ROW_KEYS[key]
+            by_key = {_norm(r.get(match_key)): r for r in value if isinstance(r, dict) and r.get(match_key)}
+            for i, row in enumerate(current):
+                other = by_key.get(_norm(row.get(match_key))) if isinstance(row, dict) else None
+                if other is not None:
+                    _fill(row, other, f"{here}[{i}]", filled)
+
+
+def reconcile(primary: Dict[str, Any], secondary: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    merge: primary pohjaksi, secondarysta vain puuttuvat/tyhjät arvot.
+    Palauttaa (tulos, täydennetyt polut). Yhteenvedot lasketaan kutsujalla uudelleen.
+    """
+    merged = copy.deepcopy(primary)
+    filled: List[str] = []
+    _fill(merged, secondary, "", filled)
+    return merged, filled
@@ -0,0 +1,50 @@
+# drawsync-backend/lib/sse.py
+"""
+Server-Sent Events -apurit striimaaville endpointeille.
+
+Taustatehtävä kirjoittaa (event, data) -pareja jonoon; sse_stream muuntaa ne
+text/event-stream -muotoon ja lähettää kommenttirivin (": ping") hiljaisina
+jaksoina, jotteivät proxyt katkaise yhteyttä. Kun asiakas katkaisee
+yhteyden, taustatehtävä perutaan.
+"""
+from __future__ import annotations
+
+import os
+import json
+import asyncio
+from typing import Any, AsyncIterator, Optional
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # nginx: ei puskurointia
+}
+
+
+def _ping_interval() -> float:
+    try:
+        return max(1.0, float(os.getenv("SSE_PING_S", "15")))
+    except ValueError:
+        return 15.0
+
+
+def sse_event(event: str, data: Any) -> str:
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+async def sse_stream(queue: "asyncio.Queue[Optional[tuple]]", task: "asyncio.Task") -> AsyncIterator[str]:
+    """Jonon (event, data) -parit SSE:nä; None päättää striimin."""
+    interval = _ping_interval()
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=interval)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if item is None:
+                break
+            yield sse_event(*item)
+    finally:
+        if not task.done():
+            task.cancel()
@@ -2,10 +2,19 @@
 
 import re
 import logging
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from lib.ocr_words import CELL_LINE_HEIGHTS, GridIndex, WordTable
 
 logger = logging.getLogger(__name__)
 
+# Sijaintiin perustuva linkitys (etäisyydet sanojen mediaanikorkeuksina)
+ROW_MAX_GAP = 25.0      # sama rivi: mitta enintään näin kaukana vaakasuunnassa
+NEAR_DISTANCE = 1.5     # viereinen rivi / viivan pää -> keskitaso
+MAX_DISTANCE = 4.0      # kauempana olevia ei linkitetä
+
 def create_steel_prompt_with_ocr(base_prompt: str, ocr_results: Dict) -> str:
     """
     Luo parannettu steel-prompt käyttäen valmista Google Vision OCR:ää.
@@ -19,15 +28,27 @@ def create_steel_prompt_with_ocr(base_prompt: str, ocr_results: Dict) -> str:
     confidence = ocr_results.get("confidence", 0)
     quality = ocr_results.get("quality", "unknown")
     
-    # Analysoi OCR-teksti
-    steel_analysis = analyze_steel_text_advanced(ocr_text)
-    
-    # Yritä yhdistää mittoja materiaaleihin
-    linked_items = link_measurements_to_profiles(steel_analysis)
+    # Analysoi OCR-teksti: sanataulukon kanssa rivit ja linkitys sijainneista,
+    # ilman sitä tekstirivien numeroista
+    words = ocr_results.get("words")
+    if isinstance(words, WordTable) and len(words):
+        steel_analysis = analyze_steel_words(words)
+        linked_items = link_measurements_spatial(steel_analysis, words)
+        lines = words.row_texts()
+    else:
+        steel_analysis = analyze_steel_text_advanced(ocr_text)
+        linked_items = link_measurements_to_profiles(steel_analysis)
+        lines = ocr_text.split('\n')
     
-    # Luo OCR-tiivistelmä
+    # Luo OCR-tiivistelmä (lähde: Vision-/Tesseract-OCR tai PDF:n tekstikerros)
+    if ocr_results.get("source") == "pdf_text_layer":
+        source_title = "PDF-TEKSTIKERROS"
+    elif ocr_results.get("engine") == "tesseract":
+        source_title = "TESSERACT OCR"
+    else:
+        source_title = "GOOGLE VISION OCR"
     ocr_summary = f"""
-GOOGLE VISION OCR TULOKSET:
+{source_title} TULOKSET:
 - Laatu: {quality} (luottamus: {confidence:.3f})
 - Sanat löydetty: {ocr_results.get('words_found', 0)}
 - Tekstin pituus: {ocr_results.get('text_length', 0)} merkkiä
@@ -86,8 +107,7 @@ PIIRUSTUSTYYPPI: {drawing_type}
 TEKSTIN RIVIT ANALYYSILLE:
 """
     
-    # Näytä tekstiä riveittäin analyysia varten
-    lines = ocr_text.split('\n')
+    # Näytä tekstiä riveittäin analyysia varten (samat rivinumerot kuin yllä)
     for i, line in enumerate(lines[:15]):  # Max 15 riviä
         if line.strip():
             ocr_summary += f"Rivi {i+1}: {line.strip()}\n"
@@ -144,88 +164,121 @@ def analyze_steel_text_advanced(text: str) -> Dict:
     if not text:
         return result
     
-    lines = text.split('\n')
-    text_upper = text.upper()
-    
     # Analysoi rivi kerrallaan
-    for line_number, line in enumerate(lines, 1):
-        line_upper = line.upper().strip()
-        if not line_upper:
-            continue
-            
-        # Teräsprofiilien tunnistus
-        profile_patterns = {
-            "IPE": r'\bIPE\s*(\d{2,3})\b',
-            "HEA": r'\bHEA\s*(\d{2,3})\b',
-            "HEB": r'\bHEB\s*(\d{2,3})\b',
-            "UPE": r'\bUP[EN]\s*(\d{2,3})\b',
-            "SHS": r'\bSHS\s*(\d{2,3})\s*[×xX]\s*(\d{1,2})\b',
-            "RHS": r'\bRHS\s*(\d{2,3})\s*[×xX]\s*(\d{2,3})\s*[×xX]\s*(\d{1,2})\b',
-            "L": r'\bL\s*(\d{2,3})\s*[×xX]\s*(\d{2,3})\b',
-            "LATTA": r'\bLATTA\s*(\d{2,3})\s*[×xX]\s*(\d{1,2})\b'
-        }
+    for line_number, line in enumerate(text.split('\n'), 1):
+        _analyze_line(line, line_number, result)
+    
+    return result
+
+def analyze_steel_words(words: WordTable) -> Dict:
+    """
+    Kuten analyze_steel_text_advanced, mutta sanataulukon visuaalisista riveistä:
+    jokainen löydös saa lisäksi "bbox"-laatikon osumaan kuuluvista sanoista.
+    """
+    result = {
+        "profiles": [],
+        "measurements": [],
+        "quantities": []
+    }
+    
+    for line_number, row in enumerate(words.rows(), 1):
+        starts, pos = [], 0
+        for i in row:
+            starts.append(pos)
+            pos += len(words.text[i]) + 1
+        line = " ".join(words.text[i] for i in row)
         
-        for profile_type, pattern in profile_patterns.items():
-            matches = re.finditer(pattern, line_upper)
-            for match in matches:
-                groups = match.groups()
-                
-                if profile_type in ["SHS", "RHS"] and len(groups) >= 2:
-                    if profile_type == "SHS":
-                        name = f"SHS{groups[0]}×{groups[1]}"
-                    else:
-                        name = f"RHS{groups[0]}×{groups[1]}×{groups[2] if len(groups) > 2 else '?'}"
-                elif profile_type in ["L", "LATTA"] and len(groups) >= 2:
-                    name = f"{profile_type}{groups[0]}×{groups[1]}"
-                else:
-                    name = f"{profile_type}{groups[0]}"
-                
-                result["profiles"].append({
-                    "name": name,
-                    "type": profile_type,
-                    "size": groups[0],
-                    "match": match.group(0),
-                    "line_number": line_number,
-                    "line_text": line.strip()
-                })
+        def locate(start: int, end: int, row=row, starts=starts) -> Optional[Tuple[float, ...]]:
+            hit = [i for i, s in zip(row, starts) if s < end and s + len(words.text[i]) > start]
+            return words.bbox(hit)
         
-        # Mittojen tunnistus (samalla rivillä kuin profiilit)
-        # L= merkinnät
-        l_measurements = re.finditer(r'\bL\s*=\s*(\d{3,5})\b', line_upper)
-        for match in l_measurements:
-            result["measurements"].append({
-                "value": int(match.group(1)),
-                "type": "L_equals",
+        _analyze_line(line, line_number, result, locate)
+    
+    return result
+
+def _analyze_line(line: str, line_number: int, result: Dict,
+                  locate: Optional[Callable[[int, int], Optional[Tuple[float, ...]]]] = None) -> None:
+    """Yhden rivin profiilit, mitat ja määrät resultiin. locate(start, end) -> osuman bbox."""
+    line_upper = line.upper().strip()
+    if not line_upper:
+        return
+    
+    def add(kind: str, item: Dict, match) -> None:
+        if locate is not None:
+            item["bbox"] = locate(match.start(), match.end())
+        result[kind].append(item)
+    
+    # Teräsprofiilien tunnistus
+    profile_patterns = {
+        "IPE": r'\bIPE\s*(\d{2,3})\b',
+        "HEA": r'\bHEA\s*(\d{2,3})\b',
+        "HEB": r'\bHEB\s*(\d{2,3})\b',
+        "UPE": r'\bUP[EN]\s*(\d{2,3})\b',
+        "SHS": r'\bSHS\s*(\d{2,3})\s*[×xX]\s*(\d{1,2})\b',
+        "RHS": r'\bRHS\s*(\d{2,3})\s*[×xX]\s*(\d{2,3})\s*[×xX]\s*(\d{1,2})\b',
+        "L": r'\bL\s*(\d{2,3})\s*[×xX]\s*(\d{2,3})\b',
+        "LATTA": r'\bLATTA\s*(\d{2,3})\s*[×xX]\s*(\d{1,2})\b'
+    }
+
+    for profile_type, pattern in profile_patterns.items():
+        matches = re.finditer(pattern, line_upper)
+        for match in matches:
+            groups = match.groups()
+
+            if profile_type in ["SHS", "RHS"] and len(groups) >= 2:
+                if profile_type == "SHS":
+                    name = f"SHS{groups[0]}×{groups[1]}"
+                else:
+                    name = f"RHS{groups[0]}×{groups[1]}×{groups[2] if len(groups) > 2 else '?'}"
+            elif profile_type in ["L", "LATTA"] and len(groups) >= 2:
+                name = f"{profile_type}{groups[0]}×{groups[1]}"
+            else:
+                name = f"{profile_type}{groups[0]}"
+
+            add("profiles", {
+                "name": name,
+                "type": profile_type,
+                "size": groups[0],
                 "match": match.group(0),
                 "line_number": line_number,
                 "line_text": line.strip()
-            })
-        
-        # Mahdolliset pituudet (4-5 numeroa)
-        potential_lengths = re.finditer(r'\b(\d{4,5})\b', line)
-        for match in potential_lengths:
-            value = int(match.group(1))
-            if 1000 <= value <= 15000:
-                result["measurements"].append({
-                    "value": value,
-                    "type": "potential_length",
-                    "match": match.group(0),
-                    "line_number": line_number,
-                    "line_text": line.strip()
-                })
-        
-        # Määrien tunnistus
-        kpl_matches = re.finditer(r'(\d{1,2})\s*KPL\b', line_upper)
-        for match in kpl_matches:
-            result["quantities"].append({
-                "count": int(match.group(1)),
-                "type": "KPL",
+            }, match)
+
+    # Mittojen tunnistus (samalla rivillä kuin profiilit)
+    # L= merkinnät
+    l_measurements = re.finditer(r'\bL\s*=\s*(\d{3,5})\b', line_upper)
+    for match in l_measurements:
+        add("measurements", {
+            "value": int(match.group(1)),
+            "type": "L_equals",
+            "match": match.group(0),
+            "line_number": line_number,
+            "line_text": line.strip()
+        }, match)
+
+    # Mahdolliset pituudet (4-5 numeroa)
+    potential_lengths = re.finditer(r'\b(\d{4,5})\b', line)
+    for match in potential_lengths:
+        value = int(match.group(1))
+        if 1000 <= value <= 15000:
+            add("measurements", {
+                "value": value,
+                "type": "potential_length",
                 "match": match.group(0),
                 "line_number": line_number,
                 "line_text": line.strip()
-            })
-    
-    return result
+            }, match)
+
+    # Määrien tunnistus
+    kpl_matches = re.finditer(r'(\d{1,2})\s*KPL\b', line_upper)
+    for match in kpl_matches:
+        add("quantities", {
+            "count": int(match.group(1)),
+            "type": "KPL",
+            "match": match.group(0),
+            "line_number": line_number,
+            "line_text": line.strip()
+        }, match)
 
 def link_measurements_to_profiles(steel_analysis: Dict) -> List[Dict]:
     """Yhdistä mittoja profiileihin rivisijainnin perusteella."""
@@ -269,6 +322,65 @@ def link_measurements_to_profiles(steel_analysis: Dict) -> List[Dict]:
     
     return linked_items
 
+def link_measurements_spatial(steel_analysis: Dict, words: WordTable) -> List[Dict]:
+    """
+    Yhdistä mittoja profiileihin sanojen sijainneista (analyze_steel_words:n
+    bboxit). Tulos samaa muotoa kuin link_measurements_to_profiles.
+    - sama visuaalinen rivi (taulukon rivi), vaakaväli <= ROW_MAX_GAP: rivin mitta
+      kuuluu rivin lähimmälle profiilille -> korkea
+    - muuten lähin vapaa mitta MAX_DISTANCE sisällä (alla/yllä oleva rivi,
+      viivan pää) -> keskitaso, jos <= NEAR_DISTANCE, muuten matala
+    Etäisyydet ovat sanojen mediaanikorkeuksina; mitat haetaan GridIndexistä.
+    """
+    h = words.line_height()
+    measurements = [m for m in steel_analysis["measurements"] if m.get("bbox")]
+    index = None
+    if measurements:
+        boxes = np.array([m["bbox"] for m in measurements], dtype=np.float32)
+        index = GridIndex(boxes, CELL_LINE_HEIGHTS * h)
+    
+    # Saman rivin mitta kuuluu vaakasuunnassa lähimmälle profiilille (tasapelissä vasemmalle)
+    row_profiles: Dict[int, List[Dict]] = {}
+    for profile in steel_analysis["profiles"]:
+        if profile.get("bbox"):
+            row_profiles.setdefault(profile["line_number"], []).append(profile)
+    
+    def h_gap(a: Tuple[float, ...], b: Tuple[float, ...]) -> float:
+        return max(0.0, a[0] - b[2], b[0] - a[2])
+    
+    owner: Dict[int, int] = {}
+    owned: Dict[int, List[Dict]] = {}
+    for mi, m in enumerate(measurements):
+        candidates = row_profiles.get(m["line_number"])
+        if not candidates:
+            continue
+        best = min(candidates, key=lambda p: (h_gap(p["bbox"], m["bbox"]), p["bbox"][0] > m["bbox"][0]))
+        if h_gap(best["bbox"], m["bbox"]) <= ROW_MAX_GAP * h:
+            owner[mi] = id(best)
+            owned.setdefault(id(best), []).append(m)
+    
+    linked_items = []
+    for profile in steel_analysis["profiles"]:
+        linked_measurements = list(owned.get(id(profile), []))
+        confidence_level = "korkea" if linked_measurements else "matala"
+        
+        if not linked_measurements and index is not None and profile.get("bbox"):
+            idx, dist = index.query(profile["bbox"], MAX_DISTANCE * h)
+            for mi, d in zip(idx.tolist(), dist.tolist()):
+                if mi in owner:
+                    continue  # toisen profiilin rivin mitta
+                linked_measurements.append(measurements[mi])
+                confidence_level = "keskitaso" if d <= NEAR_DISTANCE * h else "matala"
+                break
+        
+        linked_items.append({
+            "profile": profile,
+            "linked_measurements": linked_measurements,
+            "confidence_level": confidence_level
+        })
+    
+    return linked_items
+
 def analyze_drawing_type(ocr_text: str) -> str:
     """Tunnista piirustustyyppi OCR-tekstistä."""
     text_upper = ocr_text.upper()
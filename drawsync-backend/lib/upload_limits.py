@@ -0,0 +1,156 @@
+# drawsync-backend/lib/upload_limits.py
+"""
+Upload-koon raja ASGI-tasolla.
+
+Ennen tätä /process luki koko tiedoston muistiin (`await file.read()`) ja
+vasta sen jälkeen vertasi kokoa MAX_FILE_SIZE_MB:hen – 300 MB upload
+puskuroitiin kokonaan ennen 413-vastausta.
+
+UploadSizeLimitMiddleware:
+- hylkää pyynnön heti Content-Length-otsakkeen perusteella (runkoa ei lueta)
+- laskee chunked/valehtelevien pyyntöjen tavut lennossa ja katkaisee
+  lukemisen rajan ylittyessä -> 413, sovellus ei saa enempää dataa
+"""
+from __future__ import annotations
+
+import os
+import json
+import logging
+from typing import Callable, Iterable, Mapping, Optional
+
+log = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# multipart-rajat + lomakekentät tiedoston päälle
+DEFAULT_FORM_OVERHEAD_KB = 64
+
+
+def max_file_bytes() -> int:
+    """Yksittäisen tiedoston raja (MAX_FILE_SIZE_MB, oletus 25)."""
+    try:
+        return int(os.getenv("MAX_FILE_SIZE_MB", "25")) * MB
+    except ValueError:
+        return 25 * MB
+
+
+def max_request_bytes() -> int:
+    """Koko pyynnön rungon raja: tiedosto + multipart-overhead (MAX_UPLOAD_OVERHEAD_KB)."""
+    try:
+        overhead = int(os.getenv("MAX_UPLOAD_OVERHEAD_KB", str(DEFAULT_FORM_OVERHEAD_KB))) * 1024
+    except ValueError:
+        overhead = DEFAULT_FORM_OVERHEAD_KB * 1024
+    return max_file_bytes() + overhead
+
+
+def max_batch_bytes() -> int:
+    """Erä-uploadin (ZIP / monta tiedostoa) koko pyynnön raja (BATCH_MAX_UPLOAD_MB, oletus 500)."""
+    try:
+        return int(os.getenv("BATCH_MAX_UPLOAD_MB", "500")) * MB
+    except ValueError:
+        return 500 * MB
+
+
+def too_large_detail(limit_bytes: int) -> str:
+    return f"File too large (>{limit_bytes // MB}MB)"
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Puhdas ASGI-middleware (ei BaseHTTPMiddlewarea, joka puskuroisi rungon).
+
+    Käyttö (lisää ennen CORSia, jotta 413-vastauksessakin on CORS-otsakkeet):
+        app.add_middleware(UploadSizeLimitMiddleware)
+
+    path_limits: polkukohtaiset rajat (tarkka polku -> raja-funktio),
+    esim. erä-endpointille oletusta suurempi raja.
+    """
+
+    def __init__(
+        self,
+        app,
+        max_bytes: Optional[int] = None,
+        methods: Iterable[str] = ("POST", "PUT", "PATCH"),
+        path_limits: Optional[Mapping[str, Callable[[], int]]] = None,
+    ):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.methods = {m.upper() for m in methods}
+        self.path_limits = dict(path_limits or {})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method", "").upper() not in self.methods:
+            await self.app(scope, receive, send)
+            return
+
+        path_limit = self.path_limits.get(scope.get("path", ""))
+        limit = path_limit() if path_limit else (self.max_bytes or max_request_bytes())
+        length = self._content_length(scope)
+        if length is not None and length > limit:
+            log.warning(f"Rejected upload by Content-Length: {length} B > {limit} B ({scope.get('path')})")
+            await self._reject(send, limit)
+            return
+
+        received = 0
+        exceeded = False
+        started = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Sovellus näkee katkenneen yhteyden eikä lue enempää
+                    exceeded = True
+                    log.warning(f"Rejected upload while streaming: >{limit} B ({scope.get('path')})")
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal started, rejected
+            if exceeded and not started:
+                # Sovelluksen oma (400/500) vastaus katkenneesta rungosta korvataan 413:lla
+                started = rejected = True
+                await self._reject(send, limit)
+                return
+            if rejected:
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not started:
+            await self._reject(send, limit)
+
+    @staticmethod
+    def _content_length(scope) -> Optional[int]:
+        for name, value in scope.get("headers") or []:
+            if name == b"content-length":
+                try:
+                    return int(value)
+                except ValueError:
+                    return None
+        return None
+
+    @staticmethod
+    async def _reject(send, limit: int) -> None:
+        body = json.dumps({"detail": too_large_detail(limit)}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                # Runkoa ei luettu loppuun -> yhteyttä ei voi käyttää uudelleen
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
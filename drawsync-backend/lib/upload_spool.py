@@ -0,0 +1,155 @@
+# drawsync-backend/lib/upload_spool.py
+"""
+Uploadin tallennus väliaikaistiedostoon ilman kokonaisia bytes-kopioita.
+
+Tiedosto kopioidaan 1 MB paloina nimettyyn temp-tiedostoon ja SHA-256
+lasketaan samalla kierroksella. PyMuPDF ja PIL avaavat sen polulla, ja
+prosessipoolin workereille välitetään pelkkä polku (ei picklattua PDF:ää),
+joten pyynnön muistinkäyttö ei kasva uploadin koon mukana.
+
+spooled_upload_dependency on routereiden yhteinen FastAPI-dependency
+(/process, /process/stream, /jobs/process).
+"""
+from __future__ import annotations
+
+import os
+import mmap
+import hashlib
+import logging
+import tempfile
+from typing import Optional
+
+from fastapi import Depends, File, HTTPException, UploadFile
+
+from lib.auth_middleware import require_user, AuthenticatedUser
+from lib.concurrency import run_cpu
+from lib.upload_limits import max_file_bytes, too_large_detail
+
+log = logging.getLogger(__name__)
+
+CHUNK_BYTES = 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """Upload ylitti sallitun koon (kutsuja muuntaa 413-virheeksi)."""
+
+
+class SpooledUpload:
+    """Levylle kirjoitettu upload: polku, koko, SHA-256 ja alkuperäiset metatiedot."""
+
+    def __init__(self, path: str, size: int, sha256: str, filename: Optional[str], content_type: Optional[str]):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.filename = filename
+        self.content_type = content_type
+        self._detached = False
+
+    def read_bytes(self) -> bytes:
+        """Koko sisältö muistiin – vain pienille tiedostoille / yhteensopivuuteen."""
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def mmap(self) -> mmap.mmap:
+        """Vain luku -muistikartta (sivut ladataan levyltä tarpeen mukaan)."""
+        with open(self.path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def detach(self) -> "SpooledUpload":
+        """
+        Siirrä tiedoston omistus uudelle oliolle: tämän close() ei enää poista
+        tiedostoa. Striimaava vastaus lukee uploadia vielä endpointin palattua,
+        eikä sen saa olla kiinni siitä, milloin dependencyn siivous ajetaan.
+        """
+        owner = SpooledUpload(self.path, self.size, self.sha256, self.filename, self.content_type)
+        self._detached = True
+        return owner
+
+    def close(self) -> None:
+        if self._detached:
+            return
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "SpooledUpload":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _tmp_dir() -> Optional[str]:
+    return os.getenv("UPLOAD_TMP_DIR") or None
+
+
+def _copy(src, suffix: str, max_bytes: int) -> tuple:
+    """Kopioi tiedosto-olio paloina temp-tiedostoon ja laske SHA-256 (ajetaan säiepoolissa)."""
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=suffix, dir=_tmp_dir())
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = src.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        raise
+    return path, size, digest.hexdigest()
+
+
+def spool_fileobj(src, filename: Optional[str], content_type: Optional[str], max_bytes: int) -> SpooledUpload:
+    """Synkroninen versio mille tahansa luettavalle oliolle (esim. ZIP-entry); aja säiepoolissa."""
+    suffix = os.path.splitext(filename or "")[1][:10]
+    path, size, sha = _copy(src, suffix, max_bytes)
+    return SpooledUpload(path, size, sha, filename, content_type)
+
+
+async def spool_upload(upload, max_bytes: int) -> SpooledUpload:
+    """
+    Tallenna FastAPI:n UploadFile levylle. Starlette on jo purkanut multipartin
+    omaan SpooledTemporaryFileen; luetaan se paloina eikä kerralla muistiin.
+    """
+    src = upload.file
+    src.seek(0)
+    suffix = os.path.splitext(upload.filename or "")[1][:10]
+    path, size, sha = await run_cpu(_copy, src, suffix, max_bytes)
+    log.debug(f"Spooled upload {upload.filename!r}: {size} B -> {path}")
+    return SpooledUpload(path, size, sha, upload.filename, upload.content_type)
+
+
+# ---------------------------
+# FastAPI-dependency
+# ---------------------------
+
+async def spooled_upload_dependency(
+    file: UploadFile = File(...),
+    _user: AuthenticatedUser = Depends(require_user),
+):
+    """
+    Dependency: upload levylle paloina (SHA-256 samalla), poistetaan pyynnön jälkeen.
+    Riippuu require_userista, joten tunnistamattoman pyynnön runkoa ei kopioida
+    levylle (FastAPI välimuistittaa käyttäjän, tarkistus ajetaan kerran).
+    Isot pyynnöt on jo hylätty ASGI-tasolla (UploadSizeLimitMiddleware);
+    tämä on tiedostokohtainen varmistus.
+    """
+    limit = max_file_bytes()
+    try:
+        upload = await spool_upload(file, limit)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail=too_large_detail(limit))
+    try:
+        yield upload
+    finally:
+        upload.close()
@@ -46,6 +46,8 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.routing import APIRouter
 
+from lib.upload_limits import UploadSizeLimitMiddleware, max_batch_bytes
+
 app = FastAPI(
     title="DrawSync API",
     version="1.0.0",
@@ -78,6 +80,11 @@ ALLOWED_ORIGIN_REGEX = os.getenv(
 print("[CORS] ALLOWED_ORIGINS =", ALLOWED_ORIGINS)
 print("[CORS] ALLOWED_ORIGIN_REGEX =", ALLOWED_ORIGIN_REGEX)
 
+# Liian isot uploadit hylätään ennen kuin runkoa puskuroidaan (MAX_FILE_SIZE_MB).
+# Lisätään ennen CORSia -> CORS on uloin kerros ja 413:ssakin on CORS-otsakkeet.
+# Erä-endpointilla on oma, suurempi raja (BATCH_MAX_UPLOAD_MB).
+app.add_middleware(UploadSizeLimitMiddleware, path_limits={"/process/batch": max_batch_bytes})
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
@@ -134,6 +141,31 @@ async def startup_event():
     else:
         print(f"[STARTUP] Google Cloud credentials issue: {gcp_path}")
 
+    # Taustajobien workerit (JOBS_MODE=inprocess)
+    from lib.job_queue import start_workers
+    await start_workers()
+
+    # Vision-client + gRPC-yhteys valmiiksi taustalla (ei hidasta käynnistystä)
+    if gcp_path and os.path.exists(gcp_path):
+        import asyncio
+        from lib.ocr_utils import warm_vision_clients
+        app.state.vision_warmup = asyncio.create_task(warm_vision_clients())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Tyhjennä job-workerit, sulje CPU-executorit, OpenAI-yhteyspooli ja Vision-kanava hallitusti"""
+    from lib.concurrency import shutdown_pools
+    from lib.openai_client import aclose_clients
+    from lib.ocr_utils import aclose_vision_clients
+    from lib.job_queue import stop_workers
+    await stop_workers()
+    shutdown_pools()
+    await aclose_clients()
+    warmup = getattr(app.state, "vision_warmup", None)
+    if warmup is not None:
+        warmup.cancel()
+    await aclose_vision_clients()
+
 # ---------------------------
 # Paikalliskäynnistys
 # ---------------------------
@@ -3,16 +3,39 @@ import io
 import fitz  # PyMuPDF
 from PIL import Image
 
-def pdf_first_page_to_png_bytes(pdf_bytes: bytes, dpi: int = 200) -> bytes:
+from lib.pdf_render import choose_zoom, DEFAULT_PIXEL_BUDGET
+
+def pdf_first_page_to_png_bytes(pdf_bytes: bytes, dpi: int = 200, max_pixels: int = DEFAULT_PIXEL_BUDGET) -> bytes:
     doc = fitz.open(stream=pdf_bytes, filetype="pdf")
     if doc.page_count == 0:
         raise ValueError("PDF has no pages")
     page = doc.load_page(0)
-    # 72 dpi baseline -> skaalaus DPI:n mukaan
-    zoom = dpi / 72.0
+    # 72 dpi baseline -> skaalaus DPI:n mukaan, isot arkit pikselibudjetin mukaan
+    zoom = choose_zoom(page.rect.width, page.rect.height, dpi, max_pixels)
     mat = fitz.Matrix(zoom, zoom)
     pix = page.get_pixmap(matrix=mat, alpha=False)
     img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
     buf = io.BytesIO()
     img.save(buf, format="PNG")
     return buf.getvalue()
+
+def pdf_pages_to_png_bytes(
+    pdf_bytes: bytes,
+    dpi: int = 200,
+    max_pages: int | None = None,
+    max_pixels: int = DEFAULT_PIXEL_BUDGET,
+) -> list[bytes]:
+    """Kaikki sivut (tai max_pages ensimmäistä) PNG:ksi, dokumentti avataan kerran."""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    if doc.page_count == 0:
+        raise ValueError("PDF has no pages")
+    out = []
+    for index in range(min(doc.page_count, max_pages or doc.page_count)):
+        page = doc.load_page(index)
+        zoom = choose_zoom(page.rect.width, page.rect.height, dpi, max_pixels)
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        out.append(buf.getvalue())
+    return out
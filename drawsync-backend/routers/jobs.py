@@ -0,0 +1,55 @@
+# drawsync-backend/routers/jobs.py
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Form, HTTPException
+from lib.auth_middleware import require_user, AuthenticatedUser
+
+from lib.analysis_pipeline import resolve_prompt, resolve_ocr_backend, cache_tenant
+from lib.job_queue import job_store, worker_pool, job_view, jobs_mode, QUEUED
+from lib.upload_spool import SpooledUpload, spooled_upload_dependency
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+log = logging.getLogger("jobs")
+
+
+@router.post("/process", status_code=202)
+async def submit_process_job(
+    user: AuthenticatedUser = Depends(require_user),
+    upload: SpooledUpload = Depends(spooled_upload_dependency),
+    industry_type: Optional[str] = Form(None),
+    ocr_backend: Optional[str] = Form(None),
+):
+    """
+    Kuten /process, mutta palauttaa heti job-id:n; tulos haetaan GET /jobs/{id}.
+    Tuntematon industry tai OCR-backend hylätään jo tässä (400), ei vasta workerissa.
+    """
+    itype = (industry_type or "coating").strip().lower()
+    resolve_prompt(itype)
+    backend = resolve_ocr_backend(itype, ocr_backend)
+    try:
+        job_id = await asyncio.to_thread(
+            job_store.submit, upload, itype, cache_tenant(user), user.user_id, backend
+        )
+    except Exception:
+        log.exception("Job submit failed")
+        raise HTTPException(status_code=503, detail="Job queue unavailable")
+    worker_pool.notify()
+    log.info(f"Job {job_id} queued ({itype}, {upload.size} B, mode={jobs_mode()})")
+    return {"job_id": job_id, "status": QUEUED, "status_url": f"/jobs/{job_id}"}
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str, user: AuthenticatedUser = Depends(require_user)):
+    """
+    Jobin tila: queued (+ queue_position) | running | done (+ result) | failed (+ error).
+    Toisen organisaation job näkyy 404:nä.
+    """
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None or job["tenant"] != cache_tenant(user):
+        raise HTTPException(status_code=404, detail="Job not found")
+    position = await asyncio.to_thread(job_store.queue_position, job) if job["status"] == QUEUED else None
+    return job_view(job, position)
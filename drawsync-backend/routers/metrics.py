@@ -0,0 +1,27 @@
+from __future__ import annotations
+import asyncio
+from fastapi import APIRouter, Depends
+from lib.auth_middleware import require_admin
+from lib.openai_client import client_stats
+from lib.openai_scheduler import scheduler
+from lib.job_queue import job_store, worker_pool
+from lib.ocr_utils import ocr_stats
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+@router.get("/openai")
+async def openai_metrics(user = Depends(require_admin)):
+    # Rate limit -jono (syvyys, odotusajat, bucketit) + clientin retry-laskurit
+    return {"scheduler": scheduler.metrics(), "client": client_stats()}
+
+
+@router.get("/jobs")
+async def jobs_metrics(user = Depends(require_admin)):
+    # Jobit tiloittain (koko jono) + tämän prosessin workerit
+    return {"counts": await asyncio.to_thread(job_store.counts), "workers": worker_pool.stats()}
+
+
+@router.get("/ocr")
+async def ocr_metrics(user = Depends(require_admin)):
+    # Vision-clientin luonti, kylmät (ensimmäinen kutsu) vs. lämpimät kutsut
+    return ocr_stats()
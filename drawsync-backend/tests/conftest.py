@@ -0,0 +1,6 @@
+# drawsync-backend/tests/conftest.py
+import os
+import sys
+
+# Testit ajetaan backend-juuresta tai repon juuresta: lib/ importattavaksi
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -0,0 +1,101 @@
+# drawsync-backend/tests/test_job_queue.py
+"""JobStoren leaset, uudelleenvaraus ja yritysraja väliaikaista SQLite-tiedostoa vasten."""
+import io
+import os
+
+import pytest
+
+import lib.job_queue as job_queue
+from lib.job_queue import DONE, FAILED, QUEUED, RUNNING, JobStore
+from lib.upload_spool import spool_fileobj
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_800_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(job_queue, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return JobStore(str(tmp_path / "jobs.sqlite3"), str(tmp_path / "files"), lease_s=60, max_attempts=2)
+
+
+def _submit(store: JobStore, name: str = "a.png") -> str:
+    upload = spool_fileobj(io.BytesIO(b"\x89PNG" + bytes(64)), name, "image/png", 1024)
+    return store.submit(upload, "coating", "acme", "u1")
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(store, clock):
+    job_id = _submit(store)
+    job = store.claim("w1")
+    assert job["id"] == job_id and job["attempts"] == 1
+    assert store.claim("w2") is None  # lease voimassa
+
+    clock.advance(30)
+    assert store.heartbeat(job_id, "w1")  # lease jatkuu 30 + 60 s
+    clock.advance(59)
+    assert store.claim("w2") is None
+
+    clock.advance(2)  # w1 kuoli: ei heartbeatia, lease vanhenee
+    job = store.claim("w2")
+    assert job["id"] == job_id
+    assert job["worker"] == "w2" and job["attempts"] == 2
+
+    # Vanha worker ei enää omista jobia: heartbeat ja tulos hylätään
+    assert not store.heartbeat(job_id, "w1")
+    store.complete(job_id, "w1", {"from": "w1"})
+    assert store.get(job_id)["status"] == RUNNING
+
+    store.complete(job_id, "w2", {"from": "w2"})
+    done = store.get(job_id)
+    assert done["status"] == DONE and done["file_path"] is None
+    assert job_queue.job_view(done)["result"] == {"from": "w2"}
+
+
+def test_attempt_limit_fails_job_and_removes_file(store, clock):
+    job_id = _submit(store)
+    path = store.get(job_id)["file_path"]
+    assert os.path.exists(path)
+    for worker in ("w1", "w2"):
+        assert store.claim(worker)["id"] == job_id
+        clock.advance(61)
+
+    # Kaksi yritystä käytetty ja lease vanhentunut -> failed, ei kolmatta varausta
+    assert store.claim("w3") is None
+    failed = store.get(job_id)
+    assert failed["status"] == FAILED
+    assert failed["error_status"] == 500 and "too many times" in failed["error"]
+    assert not os.path.exists(path)
+
+
+def test_requeue_on_shutdown_does_not_count_attempt(store, clock):
+    job_id = _submit(store)
+    store.claim("w1")
+    store.requeue(job_id, "w1")
+    queued = store.get(job_id)
+    assert queued["status"] == QUEUED and queued["attempts"] == 0 and queued["worker"] is None
+    job = store.claim("w2")
+    assert job["id"] == job_id and job["attempts"] == 1
+
+
+def test_claim_order_and_queue_position(store, clock):
+    first = _submit(store, "1.png")
+    clock.advance(1)
+    second = _submit(store, "2.png")
+    assert store.queue_position(store.get(second)) == 1
+    assert store.claim("w1")["id"] == first
+    assert store.queue_position(store.get(second)) == 0
+    assert store.counts() == {RUNNING: 1, QUEUED: 1}
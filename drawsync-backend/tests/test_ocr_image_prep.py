@@ -0,0 +1,32 @@
+# drawsync-backend/tests/test_ocr_image_prep.py
+import io
+
+import numpy as np
+from PIL import Image
+
+from lib.ocr_image_prep import encode_for_vision_ex, _SHRINK_MIN_SIDE
+
+
+def _block_noise(side: int, block: int) -> Image.Image:
+    # Kohinaruudut: täysikokoisena JPEG pakkaa tasaiset ruudut hyvin, mutta
+    # pienennettynä joka pikseli on kohinaa -> tavut per pikseli kasvavat
+    noise = np.random.default_rng(0).integers(0, 256, (side // block, side // block, 3), dtype=np.uint8)
+    return Image.fromarray(noise).resize((side, side), Image.NEAREST)
+
+
+def test_shrink_fallback_fits_max_bytes():
+    max_bytes = 200 * 1024
+    data, stats = encode_for_vision_ex(_block_noise(2400, 8), max_bytes=max_bytes)
+    assert stats["format"] == "JPEG"
+    assert stats["scale"] < 1.0
+    assert len(data) <= max_bytes
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.size[0] == img.size[1] < 2400
+
+
+def test_shrink_fallback_stops_at_min_side():
+    data, stats = encode_for_vision_ex(_block_noise(2400, 4), max_bytes=2000)
+    # Rajaan ei mahdu; pienin sallittu versio palautetaan eikä silmukka jatku
+    assert len(data) > 2000
+    with Image.open(io.BytesIO(data)) as img:
+        assert min(img.size) == _SHRINK_MIN_SIDE
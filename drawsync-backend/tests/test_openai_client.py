@@ -0,0 +1,67 @@
+# drawsync-backend/tests/test_openai_client.py
+import asyncio
+
+import pytest
+
+import lib.openai_client as openai_client
+from lib.openai_client import OpenAIDeadlineExceeded, call_with_retries
+from lib.openai_pool import Endpoint, EndpointPool
+from lib.openai_scheduler import OpenAIScheduler
+
+TPM = 60_000
+
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    endpoint = Endpoint("test", "key", rpm=1000, tpm=TPM)
+    monkeypatch.setattr(openai_client, "scheduler", OpenAIScheduler(EndpointPool([endpoint])))
+    return endpoint
+
+
+def test_cancelled_call_refunds_tokens(endpoint):
+    async def main():
+        started = asyncio.Event()
+
+        async def hang(_endpoint):
+            started.set()
+            await asyncio.sleep(60)
+
+        task = asyncio.create_task(call_with_retries(hang, 30, tenant="a", cost=5000))
+        await started.wait()
+        assert endpoint.state.tokens.level <= TPM - 5000 + 100
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert endpoint.state.tokens.level == pytest.approx(TPM)
+    assert endpoint.in_flight == 0
+
+
+def test_deadline_in_concurrency_queue_refunds_tokens(endpoint, monkeypatch):
+    # Yksi paikka: toinen kutsu saa vuoron ajoittajalta, mutta deadline umpeutuu semaforissa
+    monkeypatch.setenv("OPENAI_MAX_CONCURRENCY", "1")
+
+    async def main():
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def hold(_endpoint):
+            started.set()
+            await release.wait()
+            return "ok"
+
+        async def never(_endpoint):
+            raise AssertionError("should not run")
+
+        first = asyncio.create_task(call_with_retries(hold, 30, tenant="a", cost=3000))
+        await started.wait()
+        with pytest.raises(OpenAIDeadlineExceeded):
+            await call_with_retries(never, 0.2, tenant="b", cost=20_000)
+        # Vain ensimmäisen kutsun varaus on enää voimassa (+ täyttö 0.2 s ajalta)
+        assert TPM - 3000 <= endpoint.state.tokens.level <= TPM - 3000 + 500
+        assert endpoint.in_flight == 1
+        release.set()
+        assert await first == "ok"
+
+    asyncio.run(main())
+    assert endpoint.in_flight == 0
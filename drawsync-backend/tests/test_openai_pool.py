@@ -0,0 +1,152 @@
+# drawsync-backend/tests/test_openai_pool.py
+"""Endpoint-poolin reititys ja terveys paikallisia stand-in-palvelimia vasten."""
+import json
+import time
+import socket
+import asyncio
+import contextlib
+from collections import Counter
+
+import pytest
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import lib.openai_client as openai_client
+from lib.openai_pool import EndpointPool
+from lib.openai_scheduler import OpenAIScheduler
+
+HEADERS = {
+    "x-ratelimit-limit-requests": "10000", "x-ratelimit-remaining-requests": "9999",
+    "x-ratelimit-limit-tokens": "10000000", "x-ratelimit-remaining-tokens": "9999000",
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _stand_in(name: str, latency_s: float, healthy: dict, served: Counter) -> Starlette:
+    async def completions(request: Request):
+        body = await request.json()
+        await asyncio.sleep(latency_s)
+        if not healthy.get(name, True):
+            return JSONResponse({"error": {"message": "upstream unavailable"}}, status_code=503)
+        served[name] += 1
+        return JSONResponse(
+            {
+                "id": f"{name}-{served[name]}", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "stand-in"),
+                "usage": {"prompt_tokens": 90, "completion_tokens": 10, "total_tokens": 100},
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": json.dumps({"endpoint": name})}}],
+            },
+            headers=HEADERS,
+        )
+
+    return Starlette(routes=[Route("/v1/chat/completions", completions, methods=["POST"])])
+
+
+@contextlib.asynccontextmanager
+async def stand_ins(latencies: dict, healthy: dict, served: Counter):
+    """Käynnistä stand-init ja aseta openai_clientille niistä rakennettu pooli."""
+    servers, config = [], []
+    for name, latency in latencies.items():
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config(_stand_in(name, latency, healthy, served), port=port, log_level="error"))
+        servers.append(server)
+        config.append({"name": name, "base_url": f"http://127.0.0.1:{port}/v1", "api_key": "stand-in"})
+    tasks = [asyncio.create_task(s.serve()) for s in servers]
+    while not all(s.started for s in servers):
+        await asyncio.sleep(0.01)
+    pool = EndpointPool.from_config(config)
+    previous = openai_client.scheduler
+    openai_client.scheduler = OpenAIScheduler(pool)
+    try:
+        yield pool
+    finally:
+        openai_client.scheduler = previous
+        await openai_client.aclose_clients()
+        for s in servers:
+            s.should_exit = True
+        await asyncio.gather(*tasks)
+
+
+async def _call() -> str:
+    completion = await openai_client.chat_completion(
+        tenant="org", estimated_tokens=100, model="stand-in",
+        messages=[{"role": "user", "content": "hi"}],
+    )
+    return json.loads(completion.choices[0].message.content)["endpoint"]
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setenv("OPENAI_BACKOFF_BASE_S", "0.01")
+    monkeypatch.setenv("OPENAI_EJECT_AFTER", "2")
+    monkeypatch.setenv("OPENAI_EJECT_S", "0.3")
+
+
+def test_from_config_builds_named_endpoints():
+    pool = EndpointPool.from_config([{"name": "a", "api_key": "k", "tpm": 1000}, {"base_url": "http://x/v1", "api_key": "k"}])
+    assert [e.name for e in pool.endpoints] == ["a", "endpoint-1"]
+    assert pool.get("a").state.tokens.limit == 1000
+    with pytest.raises(ValueError):
+        EndpointPool.from_config([{"name": "a"}, {"name": "a"}])
+
+
+def test_ewma_routes_to_faster_endpoint():
+    served = Counter()
+
+    async def main():
+        async with stand_ins({"fast": 0.02, "slow": 0.2}, {}, served) as pool:
+            answered = Counter([await _call() for _ in range(12)])
+            fast, slow = pool.get("fast"), pool.get("slow")
+            assert fast.latency_s < slow.latency_s
+            return answered
+
+    answered = asyncio.run(main())
+    # Mittaamaton endpoint saa ensimmäisen kutsun, sen jälkeen EWMA ohjaa nopeammalle
+    assert answered["slow"] <= 1
+    assert answered["fast"] >= 11
+
+
+def test_failing_endpoint_is_ejected_and_calls_retry_elsewhere(monkeypatch):
+    # Pitkä tauko: flaky ei palaa kokeeseen kesken testin
+    monkeypatch.setenv("OPENAI_EJECT_S", "30")
+    served = Counter()
+
+    async def main():
+        async with stand_ins({"flaky": 0.01, "steady": 0.05}, {"flaky": False}, served) as pool:
+            answered = [await _call() for _ in range(4)]
+            return answered, pool.get("flaky").snapshot()
+
+    answered, flaky = asyncio.run(main())
+    assert answered == ["steady"] * 4
+    assert flaky["ejections"] == 1
+    assert flaky["errors"] == 2
+    assert flaky["ejected_for_s"] > 0
+
+
+def test_probe_readmits_recovered_endpoint():
+    served = Counter()
+    healthy = {"flaky": False}
+
+    async def main():
+        async with stand_ins({"flaky": 0.01, "steady": 0.05}, healthy, served) as pool:
+            flaky = pool.get("flaky")
+            await _call()
+            assert flaky.ejected_until is not None
+            healthy["flaky"] = True
+            await asyncio.sleep(0.35)  # tauko (OPENAI_EJECT_S) ohi -> seuraava kutsu on koe
+            assert await _call() == "flaky"
+            return flaky
+
+    flaky = asyncio.run(main())
+    assert flaky.ejected_until is None
+    assert flaky.failures == 0
+    assert flaky.latency_s is not None
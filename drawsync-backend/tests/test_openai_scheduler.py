@@ -0,0 +1,112 @@
+# drawsync-backend/tests/test_openai_scheduler.py
+"""Token-bucketit ja reilu jono valekellolla (ei oikeita odotuksia bucketeissa)."""
+import asyncio
+
+import pytest
+
+import lib.openai_pool as openai_pool
+import lib.openai_scheduler as openai_scheduler
+from lib.openai_pool import Endpoint, EndpointPool, RateLimitState
+from lib.openai_scheduler import OpenAIScheduler, QueueTimeout
+
+
+class FakeClock:
+    """Korvaa moduulien time-nimen: monotonic() etenee vain advance():lla."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Vain poolin ja ajoittajan kello; asyncion omat ajastimet käyttävät oikeaa aikaa
+    clock = FakeClock()
+    monkeypatch.setattr(openai_pool, "time", clock)
+    monkeypatch.setattr(openai_scheduler, "time", clock)
+    return clock
+
+
+def _headers(**values) -> dict:
+    return {f"x-ratelimit-{k.replace('_', '-')}": str(v) for k, v in values.items()}
+
+
+def test_bucket_refills_at_header_limit(clock):
+    state = RateLimitState(rpm=600, tpm=6000)
+    state.take(5000)
+    # Palvelin kertoo vähemmän jäljellä kuin oma arvio -> taso laskee
+    state.observe_headers(_headers(limit_requests=600, remaining_requests=590,
+                                   limit_tokens=6000, remaining_tokens=200))
+    assert state.tokens.level == 200
+    assert state.wait_for(1200) == pytest.approx(10.0)  # 6000/min = 100 tokenia/s
+    clock.advance(4)
+    assert state.wait_for(1200) == pytest.approx(6.0)
+    clock.advance(6)
+    assert state.wait_for(1200) == 0.0
+    # Otsakkeen jäljellä oleva määrä ei koskaan nosta tasoa
+    state.observe_headers(_headers(limit_requests=600, remaining_requests=599,
+                                   limit_tokens=6000, remaining_tokens=6000))
+    assert state.tokens.level == pytest.approx(1200)
+
+
+def test_rate_limited_holds_bucket_empty_until_reset(clock):
+    endpoint = Endpoint("a", "k", rpm=600, tpm=6000)
+    pool = EndpointPool([endpoint])
+    endpoint.state.observe_rate_limited(_headers(
+        limit_requests=600, remaining_requests=10, limit_tokens=6000, remaining_tokens=0,
+        reset_requests="1s", reset_tokens="2s",
+    ))
+    picked, wait = pool.pick(100)
+    assert picked is None
+    assert wait == pytest.approx(3.0)  # 2 s reset + 100 tokenia 100/s
+    clock.advance(3)
+    assert pool.pick(100) == (endpoint, 0.0)
+
+
+def test_round_robin_between_tenants(clock):
+    endpoint = Endpoint("a", "k", rpm=60, tpm=1_000_000)  # 1 pyyntö/s
+    endpoint.state.requests.level = 0.0
+    scheduler = OpenAIScheduler(EndpointPool([endpoint]))
+    order = []
+
+    async def call(tenant: str, n: int) -> None:
+        granted, started_at = await scheduler.acquire(tenant, 10)
+        order.append(f"{tenant}{n}")
+        scheduler.release(granted, started_at, 0.1, healthy=True)
+
+    async def main():
+        jobs = [("a", 1), ("a", 2), ("a", 3), ("b", 1), ("b", 2), ("c", 1)]
+        tasks = [asyncio.create_task(call(t, n)) for t, n in jobs]
+        await asyncio.sleep(0)
+        assert scheduler.metrics()["queue_depth"] == 6
+        clock.advance(6)  # kuusi pyyntöä täyttyy
+        scheduler.observe_headers(endpoint, None)  # mikä tahansa tapahtuma ajaa jonon
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ["a1", "b1", "c1", "a2", "b2", "a3"]
+
+
+def test_queue_timeout_removes_waiter(clock):
+    endpoint = Endpoint("a", "k", rpm=60, tpm=1_000_000)
+    endpoint.state.requests.level = 0.0
+    scheduler = OpenAIScheduler(EndpointPool([endpoint]), max_wait_s=60)
+
+    async def main():
+        with pytest.raises(QueueTimeout):
+            await scheduler.acquire("a", 10, timeout=0.05)
+        return scheduler.metrics()
+
+    metrics = asyncio.run(main())
+    assert metrics["timeouts"] == 1
+    assert metrics["queue_depth"] == 0
+    assert metrics["granted"] == 0
+    assert endpoint.in_flight == 0
@@ -0,0 +1,72 @@
+# drawsync-backend/tests/test_partial_json.py
+"""Keskeneräisen JSONin tulkinta ja valmiiden ylätason avainten lista."""
+import json
+
+import pytest
+
+from lib.partial_json import PartialJsonParser, parse_partial_json
+
+DOC = {
+    "perustiedot": {"nimi": "Piirustus \"A\" \\ 1", "mittakaava": "1:50", "sivu": "ä€é"},
+    "materiaalilista": [{"koodi": "M1", "määrä": 12.5, "tags": ["a", ["b", {"c": None}]]}, {"koodi": "M2"}],
+    "valmis": True,
+}
+
+
+def test_truncated_string_value_is_shown_as_is():
+    assert parse_partial_json('{"nimi": "Piirus') == ({"nimi": "Piirus"}, [])
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('{"a": "x\\"y', {"a": 'x"y'}),
+        ('{"a": "x\\\\', {"a": "x\\"}),  # kokonainen escape
+        ('{"a": "x\\', {"a": "x"}),  # kesken oleva escape jätetään pois
+        ('{"a": "x\\u00e', {"a": "x"}),  # kesken oleva \u-escape jätetään pois
+        ('{"a": "x\\u00e9', {"a": "xé"}),
+    ],
+)
+def test_escapes_at_truncation_point(text, expected):
+    assert parse_partial_json(text)[0] == expected
+
+
+def test_nested_arrays_and_objects_are_closed():
+    value, completed = parse_partial_json('{"a": [1, [2, {"b": [3, "x')
+    assert value == {"a": [1, [2, {"b": [3, "x"]}]]}
+    assert completed == []
+    assert parse_partial_json("[1, [2, [")[0] == [1, [2, []]]
+
+
+def test_incomplete_key_number_and_literal_are_dropped():
+    assert parse_partial_json('{"a": {"b": 1}, "c')[0] == {"a": {"b": 1}}
+    assert parse_partial_json('{"a": 1, "b": 12')[0] == {"a": 1}
+    assert parse_partial_json('{"a": 1, "b": tr')[0] == {"a": 1}
+    assert parse_partial_json("") == (None, [])
+
+
+def test_completed_lists_finished_top_level_keys():
+    assert parse_partial_json('{"perustiedot": {"nimi": "A", "x": [1, 2]}')[1] == []
+    assert parse_partial_json('{"perustiedot": {"nimi": "A", "x": [1, 2]},')[1] == ["perustiedot"]
+    # Sisäkkäisen objektin pilkut ja avaimet eivät ole ylätason avaimia
+    value, completed = parse_partial_json('{"perustiedot": {"a": 1, "b": 2}, "lista": [{"c": 1}, {"d"')
+    assert completed == ["perustiedot"]
+    assert value == {"perustiedot": {"a": 1, "b": 2}, "lista": [{"c": 1}, {}]}
+
+
+def test_complete_document_equals_json_loads():
+    text = json.dumps(DOC, ensure_ascii=False)
+    assert parse_partial_json(text) == (DOC, ["perustiedot", "materiaalilista", "valmis"])
+    # Ylimääräinen teksti sulkeutuneen juuren jälkeen ei sotke tulosta
+    assert parse_partial_json(text + "}\n```")[0] == DOC
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64])
+def test_incremental_feed_matches_one_shot(chunk_size):
+    text = json.dumps(DOC, ensure_ascii=False, indent=1)
+    parser = PartialJsonParser()
+    for start in range(0, len(text), chunk_size):
+        parser.feed(text[start:start + chunk_size])
+        assert (parser.value(), parser.completed) == parse_partial_json(text[:start + chunk_size])
+    assert parser.text() == text
+    assert parser.value() == DOC
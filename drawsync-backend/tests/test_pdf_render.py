@@ -0,0 +1,41 @@
+# drawsync-backend/tests/test_pdf_render.py
+import io
+
+import fitz
+import numpy as np
+from PIL import Image
+
+from lib.pdf_render import _render_banded
+
+
+def _noisy_a4_page():
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)  # A4 pisteinä
+    noise = np.random.default_rng(0).integers(0, 256, (400, 300, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(noise).save(buf, format="PNG")
+    page.insert_image(page.rect, stream=buf.getvalue())
+    return doc, page
+
+
+def test_banded_retry_renders_whole_page():
+    doc, page = _noisy_a4_page()
+    # Pieni muistikatto -> monta kaistaa, pieni max_bytes -> uudelleenyritys pienemmällä zoomilla
+    png, width, height, zoom, _, attempts = _render_banded(page, 2.0, 256 * 1024, max_bytes=200 * 1024)
+    assert attempts > 1
+    assert zoom < 2.0
+    with Image.open(io.BytesIO(png)) as img:
+        assert img.size == (width, height)
+    # Koko sivu, ei viimeisen kaistan kaistale
+    assert abs(width / height - 595 / 842) < 0.01
+    assert abs(width - 595 * zoom) <= 2
+    doc.close()
+
+
+def test_banded_retry_keeps_clip_area():
+    doc, page = _noisy_a4_page()
+    clip = fitz.Rect(100, 100, 400, 500)
+    png, width, height, zoom, _, attempts = _render_banded(page, 2.0, 256 * 1024, max_bytes=50 * 1024, clip=clip)
+    assert attempts > 1
+    assert abs(width - 300 * zoom) <= 2 and abs(height - 400 * zoom) <= 2
+    doc.close()
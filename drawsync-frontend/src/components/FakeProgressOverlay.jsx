@@ -5,6 +5,10 @@ import React, { useEffect, useRef, useState, useMemo } from "react";
  * Hidas aikataulutettu fake-progress:
  * 0→40% (15s) → 63% (15s) → 85% (30s) → 93% (5s), sitten odottaa.
  * Kun complete===true JA 93% on saavutettu, viimeistellään 100%:iin.
+ *
+ * progress (0..1, /process/stream -vaiheista) ohjaa palkkia, kun se on annettu:
+ * aikataulu saa edetä enintään 10 %-yksikköä viimeisimmän todellisen vaiheen yli,
+ * ettei palkki jähmety pitkän vaiheen ajaksi. stageLabel näytetään alatekstinä.
  */
 export default function FakeProgressOverlay({
   open,
@@ -14,6 +18,8 @@ export default function FakeProgressOverlay({
   message = "Analysoidaan piirustusta…",
   finishDuration = 600,
   schedule: scheduleProp,
+  progress: realProgress,
+  stageLabel,
 }) {
   const defaultSchedule = useMemo(
     () => [
@@ -34,12 +40,16 @@ export default function FakeProgressOverlay({
   }, [scheduleProp, defaultSchedule]);
 
   const [progress, setProgress] = useState(0);
+  // luetaan tick-silmukassa -> ref, ettei animaatio käynnisty uudelleen joka vaiheessa
+  const realRef = useRef(null);
+  realRef.current = typeof realProgress === "number" ? realProgress : null;
   const [visible, setVisible] = useState(false);
 
   const rafRef = useRef(0);
   const startRef = useRef(0);
   const finishingRef = useRef(false);
   const finishStartRef = useRef(0);
+  const finishFromRef = useRef(0);
 
   const baseFromElapsed = (elapsedMs) => {
     const schedule = planRef.current;
@@ -92,17 +102,24 @@ useEffect(() => {
     const elapsed = now - startRef.current;
 
     if (!finishingRef.current) {
-      const base = Math.min(baseFromElapsed(elapsed), maxHold);
+      let base = Math.min(baseFromElapsed(elapsed), maxHold);
+      if (realRef.current != null) {
+        const real = Math.min(realRef.current * 100, maxHold);
+        base = Math.max(real, Math.min(base, real + 10, maxHold));
+      }
       setProgress((p) => (base > p ? base : p));
 
-      if (complete && base >= maxHold - 0.01) {
+      // Todellisella edistymisellä ei odoteta aikataulua: valmis -> viimeistely heti
+      if (complete && (base >= maxHold - 0.01 || realRef.current != null)) {
         finishingRef.current = true;
         finishStartRef.current = now;
+        finishFromRef.current = base;
       }
     } else {
       const t = Math.min(1, (now - finishStartRef.current) / finishDuration);
       const eased = 1 - Math.pow(1 - t, 3);
-      setProgress(maxHold + (100 - maxHold) * eased);
+      const from = finishFromRef.current;
+      setProgress((p) => Math.max(p, from + (100 - from) * eased));
 
       if (t >= 1) {
         setTimeout(() => {
@@ -140,7 +157,7 @@ useEffect(() => {
           <div className="flex-1">
             <h3 className="text-lg font-semibold text-gray-900">{message}</h3>
             <p className="text-sm text-gray-500 mt-1">
-              {progress < 93 ? "Rakennetaan tulokset…" : "Odotetaan palvelinta…"}
+              {stageLabel || (progress < 93 ? "Rakennetaan tulokset…" : "Odotetaan palvelinta…")}
             </p>
 
             <div className="mt-4 h-3 w-full bg-gray-100 rounded-full overflow-hidden">
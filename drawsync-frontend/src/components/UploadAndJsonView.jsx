@@ -1,6 +1,6 @@
 // src/components/UploadAndJsonView.jsx
 
-import React, { useState, useEffect } from 'react'
+import React, { useState, useEffect, useRef } from 'react'
 import { useNavigate } from 'react-router-dom'
 import { supabase } from '../supabaseClient'
 import { 
@@ -47,6 +47,16 @@ import aiEmpty from '../assets/ai-empty.svg'
 import { useOrganization } from "../contexts/OrganizationContext"
 import { db } from "../services/database"
 
+// /process/stream -vaiheet -> todellinen edistyminen (0..1) ja teksti
+const STREAM_STAGES = {
+  upload_received: { value: 0.10, label: 'Tiedosto vastaanotettu' },
+  rasterized: { value: 0.25, label: 'Piirustus käsitelty' },
+  ocr_done: { value: 0.40, label: 'Tekstintunnistus valmis' },
+  prompt_built: { value: 0.45, label: 'Analyysi käynnistetty' },
+  model_streaming: { value: 0.55, label: 'Malli kirjoittaa tuloksia…' },
+  escalated: { value: 0.55, label: 'Tarkennetaan tarkemmalla mallilla…' },
+}
+
 export default function UploadAndJsonView() {
   const navigate = useNavigate()
 
@@ -54,7 +64,12 @@ export default function UploadAndJsonView() {
   const [file, setFile] = useState(null)
   const [previewUrl, setPreviewUrl] = useState(null)
   const [data, setData] = useState(null)
+  // Striimin keskeneräinen tulos: näytetään, mutta ei tallenneta eikä päätä analyysiä
+  const [partialData, setPartialData] = useState(null)
+  const [analysisComplete, setAnalysisComplete] = useState(false)
   const [editedData, setEditedData] = useState({})
+  // Käyttäjä muokkasi kenttiä analyysin aikana -> lopullinen tulos ei ylikirjoita niitä
+  const userEditedRef = useRef(false)
   const [loading, setLoading] = useState(false)
   const [success, setSuccess] = useState(false)
   const [saving, setSaving] = useState(false)
@@ -64,6 +79,7 @@ export default function UploadAndJsonView() {
   const [manualSurfaceArea, setManualSurfaceArea] = useState('')
   const [showManualInput, setShowManualInput] = useState(false)
   const [fakeDone, setFakeDone] = useState(false)
+  const [streamProgress, setStreamProgress] = useState(null)
   const [fileType, setFileType] = useState(null)
 
   // Service selections (coating-spesifiset)
@@ -228,13 +244,35 @@ const handleUpload = async () => {
 
   setLoading(true)
   setFakeDone(false)
+  setStreamProgress(null)
+  setPartialData(null)
+  setAnalysisComplete(false)
+  userEditedRef.current = false
 
   const start = performance.now()
   try {
     await new Promise(requestAnimationFrame)
     
-    // ✅ KÄYTÄ KORJATTUA API CLIENTIA
-const json = await apiClient.post('/process', form)
+    // Striimattu analyysi: oikeat vaiheet progress-palkkiin ja perustiedot
+    // näkyviin heti kun malli on kirjoittanut ne (materiaalilista voi jatkua)
+let partialShown = false
+const json = await apiClient.postStream('/process/stream', form, (event, payload) => {
+  if (event === 'stage') {
+    const stage = STREAM_STAGES[payload?.stage]
+    if (stage) setStreamProgress(prev => ({ value: Math.max(prev?.value ?? 0, stage.value), label: stage.label }))
+  } else if (event === 'partial' && payload?.page === 1) {
+    const complete = payload.complete || []
+    setStreamProgress(prev => ({
+      value: Math.max(prev?.value ?? 0, 0.55 + 0.35 * Math.min(1, complete.length / 4)),
+      label: 'Vastaanotetaan tuloksia…',
+    }))
+    if (complete.includes('perustiedot')) {
+      if (!partialShown && !userEditedRef.current) setEditedData(payload.data.perustiedot ?? {})
+      partialShown = true
+      setPartialData(payload.data)
+    }
+  }
+})
 
 // Siedetään eri vastausmuodot:
 //  - { success: true, ... }
@@ -251,7 +289,8 @@ const success =
 
 if (success) {
   setData(payload)
-  setEditedData(payload.perustiedot ?? {})
+  setPartialData(null)
+  if (!userEditedRef.current) setEditedData(payload.perustiedot ?? {})
   setSuccess(true)
   setTimeout(() => setSuccess(false), 4000)
 } else {
@@ -261,6 +300,8 @@ if (success) {
 
   } catch (err) {
     console.error('Upload error:', err)
+    // Keskeneräistä striimitulosta ei jätetä näkyviin virheen jälkeen
+    setPartialData(null)
     
     // ✅ PAREMPI VIRHEENKÄSITTELY JWT:lle
     if (err.message.includes('Not authenticated')) {
@@ -278,6 +319,8 @@ if (success) {
     
     setFakeDone(true)
   } finally {
+    // Lopullinen vastaus (tai virhe) saapui: progress-overlay saa valmistua
+    setAnalysisComplete(true)
     const MIN_MS = 3000
     const elapsed = performance.now() - start
     const waitLeft = Math.max(0, MIN_MS - elapsed)
@@ -291,8 +334,10 @@ if (success) {
     if (loading && data && !fakeDone) setFakeDone(true)
   }, [data, loading, fakeDone])
 
-  const handleFieldEdit = (field, val) =>
+  const handleFieldEdit = (field, val) => {
+    userEditedRef.current = true
     setEditedData(prev => ({ ...prev, [field]: val }))
+  }
 
   const handleManualSurfaceArea = () => {
     if (!isNaN(manualSurfaceArea) && manualSurfaceArea) {
@@ -428,6 +473,9 @@ if (organization.industry_type === 'steel') {
     }
   }
 
+  // Näytettävä tulos: striimin aikana keskeneräinen, muuten lopullinen
+  const resultData = partialData ?? data
+
   //  Dynamic tab definitions based on industry
   const tabs = industryConfig.tabs.map(tab => ({
     ...tab,
@@ -456,31 +504,31 @@ if (organization.industry_type === 'steel') {
   function getTabEnabled(tabId) {
     switch (tabId) {
       case 'perustiedot':
-        return !!data
+        return !!resultData
       
       //  COATING-TABIT: Toimivat kun EI ole steel/machining
       case 'mitat':
-        return !!data?.mitat && organization?.industry_type !== 'steel' && organization?.industry_type !== 'machining'
+        return !!resultData?.mitat && organization?.industry_type !== 'steel' && organization?.industry_type !== 'machining'
       case 'pinta-ala':
-        return !!data?.pinta_ala_analyysi && organization?.industry_type !== 'steel' && organization?.industry_type !== 'machining'
+        return !!resultData?.pinta_ala_analyysi && organization?.industry_type !== 'steel' && organization?.industry_type !== 'machining'
       case 'palvelu':
-        return !!data && organization?.industry_type !== 'steel' && organization?.industry_type !== 'machining'
+        return !!resultData && organization?.industry_type !== 'steel' && organization?.industry_type !== 'machining'
       case 'hinnoittelu':
         return !!pricing && organization?.industry_type !== 'steel' && organization?.industry_type !== 'machining'
       
       //  STEEL-TABIT: Vain steel-organisaatioissa  
       case 'materiaalilista':
-        return !!data?.materiaalilista && organization?.industry_type === 'steel'
+        return !!resultData?.materiaalilista && organization?.industry_type === 'steel'
       case 'tarkistettavaa':
-        return !!data?.materiaalilista && organization?.industry_type === 'steel'
+        return !!resultData?.materiaalilista && organization?.industry_type === 'steel'
       case 'ostolista':
-        return !!data?.materiaalilista && organization?.industry_type === 'steel'
+        return !!resultData?.materiaalilista && organization?.industry_type === 'steel'
       
       //  MACHINING-TABIT
       case 'toleranssit':
-        return !!data?.toleranssit && organization?.industry_type === 'machining'
+        return !!resultData?.toleranssit && organization?.industry_type === 'machining'
       case 'operaatiot':
-        return !!data?.koneistusoperaatiot && organization?.industry_type === 'machining'
+        return !!resultData?.koneistusoperaatiot && organization?.industry_type === 'machining'
       
       default:
         return false
@@ -510,12 +558,12 @@ if (organization.industry_type === 'steel') {
 
         {/* Right: Results */}
         <div className="space-y-6">
-          {data ? (
+          {resultData ? (
             <>
               <StatusOverview 
-                success={data.success !== false}
+                success={resultData.success !== false}
                 filename={file?.name || 'Tuntematon'}
-                hasMeasurement={!!data.mitat}
+                hasMeasurement={!!resultData.mitat}
                 pricing={pricing} 
               />
 
@@ -531,13 +579,13 @@ if (organization.industry_type === 'steel') {
               {activeTab === 'perustiedot' && (
                 organization?.industry_type === 'steel' ? (
                   <SteelPerustiedotPanel
-                    data={data}
+                    data={resultData}
                     editedData={editedData}
                     onFieldSave={handleFieldEdit}
                   />
                 ) : (
                   <PerustiedotPanel
-                    data={data}
+                    data={resultData}
                     editedData={editedData}
                     onFieldSave={handleFieldEdit}
                   />
@@ -546,12 +594,12 @@ if (organization.industry_type === 'steel') {
 
               {/*  COATING-TABIT - Korjattu: Renderöidään kun EI ole steel/machining */}
               {activeTab === 'mitat' && organization?.industry_type !== 'steel' && organization?.industry_type !== 'machining' && (
-                <MitatPanel mitat={data.mitat} />
+                <MitatPanel mitat={resultData.mitat} />
               )}
 
               {activeTab === 'pinta-ala' && organization?.industry_type !== 'steel' && organization?.industry_type !== 'machining' && (
                 <PintaAlaPanel
-                  pintaAla={data.pinta_ala_analyysi}
+                  pintaAla={resultData.pinta_ala_analyysi}
                   pricing={pricing}
                   onManualClick={() => setShowManualInput(true)}
                 />
@@ -583,7 +631,7 @@ if (organization.industry_type === 'steel') {
               {/*  STEEL-TABIT - Vain steel-organisaatioissa */}
               {activeTab === 'materiaalilista' && organization?.industry_type === 'steel' && (
                 <SteelMaterialListPanel
-                  data={data}
+                  data={resultData}
                   editedData={editedData}
                   onFieldSave={handleFieldEdit}
                 />
@@ -591,7 +639,7 @@ if (organization.industry_type === 'steel') {
 
               {activeTab === 'tarkistettavaa' && organization?.industry_type === 'steel' && (
                 <SimpleMaterialDetectionPanel
-                  data={data}
+                  data={resultData}
                   editedData={editedData}
                   onFieldSave={handleFieldEdit}
                 />
@@ -599,10 +647,10 @@ if (organization.industry_type === 'steel') {
 
               {activeTab === 'ostolista' && organization?.industry_type === 'steel' && (
                 <SteelSummaryPanel
-                  data={data}
-                  materiaalilista={data?.materiaalilista}
-                  yhteenveto={data?.yhteenveto}
-                  liitokset={data?.liitokset}
+                  data={resultData}
+                  materiaalilista={resultData?.materiaalilista}
+                  yhteenveto={resultData?.yhteenveto}
+                  liitokset={resultData?.liitokset}
                 />
               )}
 
@@ -622,7 +670,7 @@ if (organization.industry_type === 'steel') {
               )}
 
               {/* YHTEISET KOMPONENTIT */}
-              <NotesPanel notes={data.huomiot || data.notes} />
+              <NotesPanel notes={resultData.huomiot || resultData.notes} />
 
               <ActionButtons
                 onSaveProject={handleSaveProject}
@@ -671,7 +719,9 @@ if (organization.industry_type === 'steel') {
       {(loading || !fakeDone) && (
         <FakeProgressOverlay
           open={loading}
-          complete={!!data}
+          complete={analysisComplete}
+          progress={streamProgress?.value}
+          stageLabel={streamProgress?.label}
           onFinish={() => setLoading(false)}
           message={organization?.industry_type === 'steel' ? 
             'Analysoidaan teräsrakennetta...' :
@@ -86,6 +86,57 @@ export class ApiClient {
     const headers = { 'Content-Type': 'application/json' }
     return this.request('POST', endpoint, { headers, body: JSON.stringify(payload) })
   }
+
+  // --- SSE-striimi (POST + text/event-stream) ---
+  // onEvent(event, data) kutsutaan jokaiselle tapahtumalle; palauttaa "result"-tapahtuman datan.
+  // EventSource ei tue POSTia, joten striimi luetaan fetchin ReadableStreamista.
+  async postStream(endpoint, formData, onEvent, { signal } = {}) {
+    const auth = await this.getAuthHeaders()
+    const url = joinUrl(this.baseUrl, endpoint)
+    const headers = { ...auth, Accept: 'text/event-stream' }
+    let res = await fetch(url, { method: 'POST', headers, body: formData, signal })
+
+    if (res.status === 401) {
+      const retried = await this.tryRefreshAndRetry(url, { method: 'POST', headers: { Accept: 'text/event-stream' }, body: formData, signal })
+      if (retried) res = retried
+    }
+
+    if (!res.ok || !res.body) {
+      const data = await parseJsonSafely(res)
+      const msg = data?.detail || data?.error || data?.raw || res.statusText || `HTTP ${res.status}`
+      if (res.status === 401) throw new Error('Not authenticated')
+      if (res.status === 403) throw new Error('Access denied')
+      throw new Error(msg)
+    }
+
+    const reader = res.body.pipeThrough(new TextDecoderStream()).getReader()
+    let buffer = ''
+    let result = null
+    for (;;) {
+      const { value, done } = await reader.read()
+      if (done) break
+      buffer += value.replace(/\r\n/g, '\n')
+      let sep
+      while ((sep = buffer.indexOf('\n\n')) >= 0) {
+        const block = buffer.slice(0, sep)
+        buffer = buffer.slice(sep + 2)
+        let event = 'message'
+        const dataLines = []
+        for (const line of block.split('\n')) {
+          if (line.startsWith('event:')) event = line.slice(6).trim()
+          else if (line.startsWith('data:')) dataLines.push(line.slice(5).replace(/^ /, ''))
+        }
+        if (!dataLines.length) continue // ": ping" -kommentit
+        let data
+        try { data = JSON.parse(dataLines.join('\n')) } catch { data = { raw: dataLines.join('\n') } }
+        if (event === 'error') throw new Error(data?.detail || 'Analyysi epäonnistui')
+        if (event === 'result') result = data
+        onEvent?.(event, data)
+      }
+    }
+    if (!result) throw new Error('Yhteys katkesi ennen tulosta')
+    return result
+  }
 }
 
 // singleton